@@ -19,8 +19,11 @@ class Options(object):
     install = False
     config = None
     debug = False
+    dump_plan = None
     fetchfirst = False
     fetchonly = False
+    fetch_ahead = None
+    jobs = None
     jump = False
     nodeps = False
     offline = False
@@ -31,6 +34,7 @@ class Options(object):
     sync = False
     reinstall_minilays = False
     reinstall = False
+    resume = False
     update = False
     upgrade = False
     verbose = True
@@ -70,7 +74,8 @@ def do_read_options(read_options=False, **defaults):
     if (
         (options.reinstall and options.delete) or
         (options.fetchonly and options.offline) or
-        (options.jump and options.nodeps)
+        (options.jump and options.nodeps) or
+        (options.jump and options.resume)
     ):
         raise core.ConflictModesError('You are using conflicting modes')
 
@@ -79,7 +84,8 @@ def do_read_options(read_options=False, **defaults):
         and (
             (
                 (not args and len(sys.argv) > 1)
-                and not (options.sync or options.reinstall_minilays)
+                and not (options.sync or options.reinstall_minilays
+                         or options.resume)
             )
         )
     ):
@@ -126,13 +132,17 @@ def do_read_options(read_options=False, **defaults):
         'ask': options.ask,
         'config': cfg,
         'debug': options.debug,
+        'dump_plan': options.dump_plan,
         'fetchfirst': options.fetchfirst,
         'fetchonly': options.fetchonly,
+        'fetch_ahead': options.fetch_ahead,
+        'jobs': options.jobs,
         'jump': options.jump,
         'nodeps': options.nodeps,
         'offline': options.offline,
         'packages': args,
         'pretend': options.pretend,
+        'resume': options.resume,
         'update': options.update,
         'nofetch': options.nofetch,
         'upgrade': options.upgrade,
@@ -5,6 +5,10 @@ try:
     from hashlib import md5
 except:
     from md5 import new as md5
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 
 import optparse
@@ -15,7 +19,6 @@ import shutil
 import tempfile
 import urllib2
 import urlparse
-import subprocess
 
 from distutils.dir_util import copy_tree
 
@@ -23,10 +26,15 @@ from setuptools.package_index import PackageIndex
 from pkg_resources import Requirement, resource_filename
 from minitage.core.version import __version__
 from minitage.core.version import version
+from minitage.core import httpclient
+from minitage.core import runner
+from minitage.core import tools
 letter_re = re.compile('^((?P<letter>[a-zA-Z]):)(?P<path>.*)', re.U | re.S | re.I)
 
 
 PYTHON_VERSIONS = ('2.4', '2.5', '2.6', '2.7')
+""" size of the chunks files are read and downloaded by"""
+CHUNK_SIZE = 256 * 1024
 D = os.path.dirname
 B = os.path.basename
 J = os.path.join
@@ -49,6 +57,11 @@ jump_help = ('Squizze prior dependencies to the '
              'minibuild specified in that option')
 fetchonly_help = 'Fetch the packages but do not build yet'
 fetchfirst_help = 'Fetch the packages first before building them'
+fetch_ahead_help = ('Fetch the next packages in the background while a '
+                   'package is built, at most that number of packages '
+                   'ahead (default: 0, fetch just in time)')
+jobs_help = ('Number of packages to build at the same time, a package is '
+             'built as soon as its dependencies are. (default: 1)')
 delete_help = 'Remove selected packages'
 reinstall_help = (
     'Unconditionnaly rebuild/reinstall packages in conservative '
@@ -61,6 +74,10 @@ config_help = ('Alternate config file. By default it\'s searched in '
 pretend_help = 'Do nothing, show what will be done'
 
 ask_help = 'Do nothing, show what will be done and ask to continue'
+dump_plan_help = ('Write what will be done as JSON into that file '
+                  '(- for the standard output)')
+resume_help = ('Resume the last failed run where it stopped, skipping '
+               'what it did')
 only_dependencies_help = 'Do actions onto dependencies, do not build the given packages'
 all_python_versions_help = 'Build python bindings for all python packages present in minitage'
 update_help = ('Update packages codesource (fetch/pull) '
@@ -110,6 +127,12 @@ modifiers = [
     optparse.make_option('-f', '--fetchfirst',
                          action='store_true', dest='fetchfirst',
                          help=fetchfirst_help),
+    optparse.make_option('--jobs',
+                         action='store', dest='jobs', type='int',
+                         help=jobs_help),
+    optparse.make_option('--fetch-ahead',
+                         action='store', dest='fetch_ahead', type='int',
+                         help=fetch_ahead_help),
     optparse.make_option('--nofetch',
                          action='store_true', dest='nofetch',
                          help=nofetch_help),
@@ -133,6 +156,12 @@ flags = [
     optparse.make_option('-a', '--ask',
                          action='store_true', dest='ask',
                          help=ask_help),
+    optparse.make_option('--dump-plan',
+                         action='store', dest='dump_plan',
+                         help=dump_plan_help),
+    optparse.make_option('--resume',
+                         action='store_true', dest='resume',
+                         help=resume_help),
     optparse.make_option('--skip-self-upgrade',
                          action='store_true', dest='skip_self_upgrade',
                          help='Do not do minitage self upgrades.'),
@@ -217,11 +246,142 @@ def md5sum(filep):
     if isinstance(filep, basestring):
         fobj = open(filep, 'rb')
     m = md5()
-    while True:
-        d = fobj.read(8096)
-        if not d:
-            break
-        m.update(d)
+    try:
+        while True:
+            d = fobj.read(CHUNK_SIZE)
+            if not d:
+                break
+            m.update(d)
+    finally:
+        if fobj is not filep:
+            fobj.close()
+    return m.hexdigest()
+
+
+def _content_range(info):
+    """(first byte, total size or None) of a Content-Range header."""
+    try:
+        unit, value = info.getheader('content-range', '').split()
+        first, total = value.split('-')[0], value.split('/')[1]
+        if total == '*':
+            total = None
+        return int(first), total
+    except ValueError:
+        return None, None
+
+
+def _remove(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def download(uri, filepath, md5_ref=None, resume=True, logger=None,
+             pool=None):
+    """Stream uri to filepath, by chunks, never holding it in memory.
+    The file is written to filepath.part and renamed once complete,
+    filepath is either the whole download or left untouched.
+    With resume, an interrupted download is kept with the ETag and
+    Last-Modified of the response (filepath.part.meta). It is continued
+    with a Range request as long as the server says in return to
+    If-Range that the file did not change, and downloaded again from the
+    beginning otherwise.
+    Arguments:
+        - md5_ref: md5 the whole download must match
+        - resume: keep and continue interrupted downloads
+        - logger: where to tell about resumed downloads
+        - pool: the HTTPPool to use, see urlopen
+    Returns
+        - the md5 of the file, computed while downloading
+    Exceptions
+        - MinimergeDownloadError if the download is incomplete
+        - MinimergeMD5Mismatch if it does not match md5_ref
+    """
+    part = '%s.part' % filepath
+    metapath = '%s.meta' % part
+    meta, offset, headers = None, 0, {}
+    if resume and os.path.exists(part):
+        try:
+            meta = json.loads(open(metapath).read())
+        except (IOError, ValueError):
+            meta = None
+        if (meta and meta.get('uri') == uri
+            and (meta.get('etag') or meta.get('last_modified'))):
+            offset = os.path.getsize(part)
+    if offset:
+        headers['Range'] = 'bytes=%s-' % offset
+        headers['If-Range'] = meta.get('etag') or meta['last_modified']
+    try:
+        resp = urlopen(uri, headers=headers, pool=pool)
+    except urllib2.HTTPError, e:
+        # 416: the part is bigger than the file now is
+        if not (offset and e.code == 416):
+            raise
+        headers, resp = {}, urlopen(uri, pool=pool)
+    info = resp.info()
+    m = md5()
+    first, expected = _content_range(info)
+    if (headers and getattr(resp, 'code', None) == 206
+        and first == offset):
+        # the server continues the part, hash what we already have
+        if logger:
+            logger.info('Resuming the download of %s at byte %s.' % (
+                uri, offset))
+        fobj = open(part, 'rb')
+        try:
+            while True:
+                data = fobj.read(CHUNK_SIZE)
+                if not data:
+                    break
+                m.update(data)
+        finally:
+            fobj.close()
+        fobj = open(part, 'ab')
+    else:
+        offset, expected = 0, info.getheader('content-length')
+        etag = info.getheader('etag')
+        last_modified = info.getheader('last-modified')
+        # without validators, we could not tell it is the same file
+        resume = resume and bool(etag or last_modified)
+        _remove(metapath)
+        if resume:
+            meta = open(metapath, 'w')
+            meta.write(json.dumps({'uri': uri,
+                                   'etag': etag,
+                                   'last_modified': last_modified}))
+            meta.close()
+        fobj = open(part, 'wb')
+    size, discard = offset, not resume
+    try:
+        try:
+            try:
+                while True:
+                    data = resp.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    m.update(data)
+                    size += len(data)
+                    fobj.write(data)
+            finally:
+                fobj.close()
+        finally:
+            resp.close()
+        if expected and int(expected) != size:
+            discard = discard or size > int(expected)
+            raise MinimergeDownloadError(
+                'Download of %s is incomplete: got %s bytes out of %s.' % (
+                    uri, size, expected))
+        if md5_ref and m.hexdigest() != md5_ref:
+            discard = True
+            raise MinimergeMD5Mismatch(
+                'MD5SUM mismatch for %s: Good:%s != Bad:%s' % (
+                    uri, md5_ref, m.hexdigest()))
+        os.rename(part, filepath)
+    except:
+        if discard:
+            _remove(part, metapath)
+        raise
+    _remove(metapath)
     return m.hexdigest()
 
 
@@ -266,6 +426,25 @@ def append_env_var(env, var, sep=":", before=True):
             )
 
 
+def get_environ(config=None, paths=None):
+    """Environment of the commands minimerge runs, os.environ is left
+    alone.
+    Arguments
+        - config: the [minimerge] section, its http_proxy, https_proxy and
+          ftp_proxy are set
+        - paths: directories to search before the PATH
+    """
+    environ = os.environ.copy()
+    for key in ('http_proxy', 'https_proxy', 'ftp_proxy'):
+        value = (config or {}).get(key, None)
+        if value:
+            environ[key] = value
+    if paths:
+        environ['PATH'] = os.pathsep.join(
+            list(paths) + [environ.get('PATH', '')])
+    return environ
+
+
 def substitute(filename, search_re, replacement):
     """Substitutes text within the contents of ``filename`` matching
     ``search_re`` with ``replacement``.
@@ -304,25 +483,28 @@ def is_local_url(url):
     return False
 
 
-def Popen(command, verbose=False, output=False):
-    # FIXME: Popen strange behaviour
+def Popen(command, verbose=False, output=False, timeout=None, cwd=None,
+          env=None, log_file=None):
+    """Run a shell command (see minitage.core.runner.run), in cwd and
+    with the env environment if given, writing its output to log_file
+    too.
+    Its output is shown as it comes, or returned (stdout, then stderr) if
+    output is True.
+    Exceptions
+        - MinimergeError if the command fails
+    """
     ret = None
-    if not output:
-        cret = os.system(command)
-    else:
-        stdout = subprocess.PIPE
-        p = subprocess.Popen(
-            command,
-            shell=True,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        cret = p.wait()
-    if cret != 0:
+    try:
+        result = runner.run(command, echo=not output, capture=output,
+                            timeout=timeout, cwd=cwd, env=env,
+                            log_file=log_file)
+    except runner.CommandError, e:
         error = ''
-        #if not verbose:
-        #    error = p.stdout.read()
+        if output:
+            # not shown yet
+            error = '\n'.join(e.result.tail)
+        if e.result.timed_out:
+            error += '\nTimed out after %ss.' % timeout
         message = '%s\n%s' % (
             error,
             '----------------------------------------------------------\n'
@@ -334,7 +516,7 @@ def Popen(command, verbose=False, output=False):
         )
         raise MinimergeError(message)
     if output:
-        ret = p.stdout.read() + '\n\n' + p.stderr.read()
+        ret = result.stdout + '\n\n' + result.stderr
     return ret
 
 
@@ -343,7 +525,9 @@ def get_from_cache(url,
                    logger=None,
                    file_md5=None,
                    offline=False,
-                   use_cache=True):
+                   use_cache=True,
+                   store=None,
+                   pool=None):
     """Get a file from the buildout download cache.
     Arguments:
         - url : where to fetch from
@@ -351,7 +535,13 @@ def get_from_cache(url,
         - download_cache: path to the dl cache
         - install_from_cache:
         - offline : offline mode
+        - store: the DownloadStore files are shared with, the default
+          one if None, False for none
+        - pool: the HTTPPool http(s) downloads go through, see urlopen
     """
+    if store is None:
+        from minitage.core.store import get_store
+        store = get_store()
     # borrowed from zc.recipe.cmmi
     if download_cache:
         if not os.path.isdir(download_cache):
@@ -427,12 +617,16 @@ def get_from_cache(url,
     if not use_cache and not offline:
         file_present = False
 
+    # the download store may have it
+    from_store = (not file_present and use_cache and store and file_md5
+                  and store.get(file_md5))
+
     if os.path.exists(url):
         url = 'file://%s' % os.path.abspath(url)
 
     if not file_present:
         # static local files
-        if offline and not is_local_url(url):
+        if offline and not is_local_url(url) and not from_store:
             # no file in the cache, but we are staying offline
             raise MinimergeOfflineError(
                 "Offline mode: file from %s not found in the cache at %s" %
@@ -468,21 +662,32 @@ def get_from_cache(url,
                         url = url.replace('file://', 'file:///')
             if os.path.isdir(local_file):
                 copy_tree(local_file, fname)
-            if (not os.path.exists(fname)) or use_cache is False:
+            elif os.path.isfile(fname):
+                # do not write through a link to the download store
+                os.remove(fname)
+            if from_store:
+                store.link(file_md5, fname)
+                if logger:
+                    logger.debug('Using the download store file %s' % (
+                        from_store))
+            elif (not os.path.exists(fname)) or use_cache is False:
                 # we try to download the url with fragments, if it fails,
                 # without.
-                dfd = open(fname, 'wb')
-                try:
-                    pi = PackageIndex()
-                    pi._attempt_download(url, fname)
-                except:
-                    url, info = url.split('#', 1)
-                    if 'md5' in fragment:
-                        dfd.write(urlopen(url).read())
-                    else:
-                        raise
-                dfd.flush()
-                dfd.close()
+                if url.startswith('http://') or url.startswith('https://'):
+                    # through the keep-alive connections, download checks
+                    # the md5
+                    download(url.split('#')[0], fname, file_md5, pool=pool,
+                             logger=logger)
+                else:
+                    try:
+                        pi = PackageIndex()
+                        pi._attempt_download(url, fname)
+                    except:
+                        url, info = url.split('#', 1)
+                        if 'md5' in fragment:
+                            download(url, fname, pool=pool)
+                        else:
+                            raise
             if file_md5:
                 if not test_md5(fname, file_md5):
                     raise MinimergeMD5Mismatch(
@@ -492,6 +697,8 @@ def get_from_cache(url,
                             md5sum(fname)
                         )
                     )
+            if store and os.path.isfile(fname):
+                store.add(fname, file_md5)
         except MinimergeOfflineError, e:
             if tmp2 is not None:
                 shutil.rmtree(tmp2)
@@ -598,20 +805,15 @@ You seem to be running minitage for the first time.
 
 
 def which(program, environ=None, key='PATH', split=':'):
+    """Full path of program in the environ PATH, see minitage.core.tools
+    for the cache of the lookups."""
     if not environ:
         environ = os.environ
     PATH = environ.get(key, '').split(split)
-    for entry in PATH:
-        fp = os.path.abspath(os.path.join(entry, program))
-        if os.path.exists(fp):
-            return fp
-        if (
-            (sys.platform.startswith('win')
-             or sys.platform.startswith('cyg'))
-            and os.path.exists(fp + '.exe')
-        ):
-            return fp + '.exe'
-    raise IOError('Program not fond: %s in %s ' % (program, PATH))
+    fp = tools.which(program, PATH)
+    if fp is None:
+        raise IOError('Program not fond: %s in %s ' % (program, PATH))
+    return fp
 
 
 class MinibuildNotFoundException(Exception):
@@ -619,6 +821,16 @@ class MinibuildNotFoundException(Exception):
 
 
 def search_latest(regex, minilays):
+    # imported there as the index needs the minibuilds objects
+    from minitage.core import index
+    minilays_index = index.get_index(minilays)
+    if minilays_index is not None:
+        minibuild = minilays_index.search(regex)
+        if minibuild is not None:
+            return minibuild
+        raise MinibuildNotFoundException(
+            'Regex %s didnt match or '
+            'minibuild not found in %s.' % (regex, minilays))
     for mpath, directories, files in os.walk(minilays):
         subpath = mpath.replace(
             os.path.commonprefix([minilays, mpath]),
@@ -638,13 +850,15 @@ def search_latest(regex, minilays):
 GENTOO_FF_UA = 'Mozilla/5.0 (X11; U; Linux i686; en-US; rv:1.9.1.3) Gecko/20090912 Gentoo Shiretoko/3.5.3'
 
 
-def urlopen(uri, ua=GENTOO_FF_UA, *args, **kwargs):
+def urlopen(uri, ua=GENTOO_FF_UA, headers=None, pool=None, *args, **kwargs):
     """Fake user agent to prevent some basic sysadmins
-    restrictrions."""
-    request = urllib2.Request(uri)
-    request.add_header('User-Agent', ua)
-    opener = urllib2.build_opener()
-    urlo = opener.open(request)
-    return urlo
+    restrictrions.
+    The request goes through a pool of keep-alive connections, the one of
+    the environment proxies if pool is None (see httpclient.get_pool)."""
+    if pool is None:
+        pool = httpclient.get_pool()
+    headers = dict(headers or {})
+    headers['User-Agent'] = ua
+    return pool.open(uri, headers)
 
 # vim:set et sts=4 ts=4 tw=80:
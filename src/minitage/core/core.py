@@ -10,21 +10,38 @@ import random
 import copy
 import re
 import shutil
+import urlparse
 from cStringIO import StringIO
+from glob import glob
 from distutils.dir_util import copy_tree
 import pkg_resources
-import subprocess
 
 from iniparse import ConfigParser as WritableConfigParser
 
 from minitage.core import objects
+from minitage.core import plan
+from minitage.core import runner
+from minitage.core import graph
+from minitage.core import httpclient
+from minitage.core import index
+from minitage.core import journal
+from minitage.core import metadata
+from minitage.core import scheduler
+from minitage.core import state
+from minitage.core import store
+from minitage.core import tools
+from minitage.core.status import StatusCache, memoized
 from minitage.core.fetchers import interfaces as fetchers
+from minitage.core.fetchers import heads
+from minitage.core.fetchers import ssh
 from minitage.core.makers import interfaces as makers
 from minitage.core.version import __version__, version as mm_version
 from minitage.core import update as up
 from minitage.core.common import newline
 from minitage.core.fetchers.interfaces import InvalidUrlError
 from minitage.core.common import PYTHON_VERSIONS, get_install_root
+from minitage.core.common import get_environ
+from minitage.core.interfaces import get_factory
 
 try:
     from os import uname
@@ -35,6 +52,17 @@ DEFAULT_BINARIES_URL = 'http://distfiles.minitage.org/public/externals/minitage/
 CORE_MINILAYS_URLBASE = 'https://github.com/minitage/minilays'
 
 
+""" packages fetched at the same time by --fetchfirst and --fetchonly,
+in all and from the same host"""
+FETCH_JOBS = 4
+FETCH_JOBS_PER_HOST = 2
+""" minimerge modes of a run, restored when it is resumed"""
+JOURNAL_MODES = ('fetchonly', 'fetchfirst', 'offline', 'nofetch',
+                 'update', 'upgrade')
+""" scms the minitage dependencies can provide to the builds"""
+SCMS = ('git', 'hg', 'svn', 'bzr')
+
+
 class MinimergeError(Exception):
     """General Minimerge Error"""
 
@@ -128,6 +156,13 @@ class Minimerge(object):
                 - config: configuration file path *mandatory*
                 - binary: allow use of binaries in the form:
                         http://binaryurl/platform/arch/package_name(-packageversion)*.tar.gz
+                - jobs: number of packages to build at the same time, defaults
+                  to the [minimerge] jobs setting or 1 (serial build).
+                - fetch_ahead: number of packages to fetch in the background
+                  ahead of the one being built, defaults to the [minimerge]
+                  fetch_ahead setting or 0 (fetch just in time).
+                - dump_plan: file to write the build plan to, in JSON.
+                - resume: resume the last failed run from its journal.
                 - flags :
 
                     - ask: prompt to continue
@@ -187,6 +222,8 @@ class Minimerge(object):
         self._upgrade = options.get('upgrade', True)
         self._pretend = options.get('pretend', False)
         self._ask = options.get('ask', False)
+        self._dump_plan = options.get('dump_plan', None)
+        self._resume = options.get('resume', False)
         self._offline = options.get('offline', self._config._sections\
                                     .get('minimerge', {}).get('offline', False))
 
@@ -205,6 +242,62 @@ class Minimerge(object):
         # they are too in etc/minmerge.cfg[minilays]
         self.minimerge_section = self._config._sections.get('minimerge', {})
 
+        # parallel builds
+        self._jobs = options.get('jobs', None)
+        if not self._jobs:
+            self._jobs = self.minimerge_section.get('jobs', 1)
+        try:
+            self._jobs = max(1, int(self._jobs))
+        except ValueError:
+            message = 'The jobs setting is invalid: %s' % self._jobs
+            raise InvalidConfigFileError(message)
+        # parallel fetches (--fetchfirst, --fetchonly)
+        try:
+            self._fetch_jobs = max(1, int(
+                self.minimerge_section.get('fetch_jobs', FETCH_JOBS)))
+            self._fetch_jobs_per_host = max(1, int(
+                self.minimerge_section.get('fetch_jobs_per_host',
+                                           FETCH_JOBS_PER_HOST)))
+        except ValueError:
+            message = 'The fetch_jobs settings are invalid'
+            raise InvalidConfigFileError(message)
+        self._fetch_ahead = options.get('fetch_ahead', None)
+        if self._fetch_ahead is None:
+            self._fetch_ahead = self.minimerge_section.get('fetch_ahead', 0)
+        try:
+            self._fetch_ahead = max(0, int(self._fetch_ahead))
+        except ValueError:
+            message = 'The fetch_ahead setting is invalid: %s' % (
+                self._fetch_ahead)
+            raise InvalidConfigFileError(message)
+        self._prefetcher = None
+        # -U only updates the working copies whose remote moved
+        try:
+            self._remote_heads_ttl = max(0, int(self.minimerge_section.get(
+                'remote_heads_ttl', heads.TTL)))
+        except ValueError:
+            message = 'The remote_heads_ttl setting is invalid'
+            raise InvalidConfigFileError(message)
+        self._remote_moved = {}
+        # the download store files unused for download_store_max_age days
+        # are removed after the runs, they are kept if it is not set
+        self._store_max_age = None
+        max_age = self.minimerge_section.get(
+            'download_store_max_age', '').strip()
+        if max_age:
+            try:
+                self._store_max_age = max(0, int(max_age)) * 24 * 3600
+            except ValueError:
+                message = 'The download_store_max_age setting is invalid'
+                raise InvalidConfigFileError(message)
+
+        # dependency resolution
+        self._graph = None
+        self._index = None
+        self._not_found = set()
+        self._dependencies_order = self.minimerge_section.get(
+            'dependencies_order', 'compat').strip()
+
         # minitage binaries
         self.use_binaries = options.get('binary', False)
 
@@ -226,6 +319,17 @@ class Minimerge(object):
         # installed binaries packages
         self._binaries = []
 
+        # journal of the run being executed, see execute
+        self._journal = None
+
+        # installed packages state, see get_state
+        self._state = None
+        self.status_cache = StatusCache()
+
+        # parsed minibuilds
+        self.metadata_cache = metadata.MetadataCache(
+            os.path.join(self._prefix, self.history_dir, 'minibuilds.cache'),
+            self._config, objects.UNAME, tuple(PYTHON_VERSIONS))
 
         self.load_minilays()
         if options.get('reinstall_minilays', False):
@@ -268,9 +372,14 @@ class Minimerge(object):
         minilays_search_paths.sort(minilays_sort)
         self._minilays = [objects.Minilay(
             path = os.path.expanduser(dir),
-            minitage_config = copy.copy(self._config))
+            minitage_config = copy.copy(self._config),
+            metadata_cache = self.metadata_cache)
             for dir in minilays_search_paths
             if os.path.isdir(dir)]
+        # minibuilds may now resolve differently
+        self._graph = None
+        self._index = None
+        self._not_found = set()
 
     def update(self):
         updates = up.UPDATES.keys()
@@ -322,6 +431,14 @@ class Minimerge(object):
                             sys.exit(1)
         self.store_config()
 
+    def get_minilays_index(self):
+        """Return the index of the minibuilds of all the minilays."""
+        if self._index is None:
+            self._index = index.MinilayIndex(
+                os.path.join(self.minilays_parent, index.INDEX),
+                [minilay.path for minilay in self._minilays])
+        return self._index
+
     def find_minibuild(self, package):
         """
         @param package str minibuild to find
@@ -331,9 +448,17 @@ class Minimerge(object):
         Returns
             - The minibuild found
         """
-        for minilay in self._minilays:
-            if package in minilay:
-                return minilay[package]
+        if not package in self._not_found:
+            minilays_index = self.get_minilays_index()
+            entry = minilays_index.find(package)
+            # maybe added since the index was loaded
+            if entry is None and minilays_index.refresh():
+                entry = minilays_index.find(package)
+            if entry is not None:
+                for minilay in self._minilays:
+                    if minilay.path == entry.minilay:
+                        return minilay.register(package)
+            self._not_found.add(package)
         message = 'The minibuild \'%s\' was not found' % package
         raise MinibuildNotFoundError(message)
 
@@ -351,50 +476,42 @@ class Minimerge(object):
             cpackages.append(self._find_minibuild(package))
         return cpackages
 
-    def compute_dependencies(self, packages = None, ancestors = None):
+    def compute_dependencies(self, packages = None, ancestors = None, order = None):
         """
         @param package list list of packages to get the deps
-        @param ancestors list list of tuple(ancestor,level of dependency)
+        @param ancestors list already computed packages, new ones are
+               appended after them.
+        @param order str 'compat' (default, historical order) or 'kahn'
+               see minitage.core.graph.ORDERS
         Exceptions
             - CircurlarDependencyError in case of curcular dependencies trees
+              its path attribute is the list of the packages in the cycle.
 
         Returns
-            - Nothing but self.computed_packages is filled with needed
-            dependencies. Not that this list must be reversed.
+            - The list of the packages to build, dependencies first.
         """
         if packages is None:
             packages = []
         if ancestors is None:
             ancestors = []
-
-        for package in packages:
-            mb = self._find_minibuild(package)
-            # test if we have not already the package in our deps list, then
-            # ...
-            # if we have no ancestor, the end of the list is fine.
-            index = len(ancestors)
-            # if we have ancestors
-            if ancestors:
-                # we must check ancestor installation priority:
-                #  we must install dependencies prior to the first
-                #  package which have the dependency in its list
-                for ancestor in ancestors:
-                    if mb.name in ancestor.dependencies:
-                        index = ancestors.index(ancestor)
-                        break
-            # last check if package is not already there.
-            if not mb in ancestors:
-                ancestors.insert(index, mb)
-            # unconditionnaly parsing dependencies, even if the package is
-            # already there to detect circular dependencies
-            try:
-                ancestors = self._compute_dependencies(mb.dependencies,
-                                                       ancestors=ancestors)
-            except RuntimeError,e:
-                message = 'Circular dependency around %s and ancestors: \'%s\''
-                raise CircurlarDependencyError(message %
-                                         (mb.name, [m.name for m in ancestors]))
-        return ancestors
+        if order is None:
+            order = self._dependencies_order
+        try:
+            computed = self.get_graph().sort(packages, order)
+        except graph.CycleError, e:
+            error = CircurlarDependencyError(
+                'Circular dependency: %s' % e)
+            error.path = e.path
+            raise error
+        except graph.InvalidOrderError, e:
+            raise InvalidConfigFileError('%s' % e)
+        return ancestors + [mb for mb in computed if not mb in ancestors]
+
+    def get_graph(self):
+        """Return the dependency graph engine of this run."""
+        if self._graph is None:
+            self._graph = graph.DependencyGraph(self._find_minibuild)
+        return self._graph
 
     def is_package_src_to_be_fetched(self, package):
         """Does the package folder need to be fetched/unpacked"""
@@ -437,16 +554,67 @@ class Minimerge(object):
             ret = True
         return ret
 
+    @memoized
     def is_package_src_to_be_updated(self, package):
         """Does the package folder need to be updated"""
         ret = False
-        if (self._update
+        if ((self._update and self.has_remote_moved(package))
             or self.has_new_revision(package)
             or not self.is_installed(package)
            ):
             ret = True
         return ret
 
+    def has_remote_moved(self, package):
+        """Did the remote of the package working copy get new revisions
+        since it was updated, True if it cannot be told."""
+        if not package.name in self._remote_moved:
+            self.check_remote_heads([package])
+        return self._remote_moved.get(package.name, True)
+
+    def check_remote_heads(self, packages):
+        """Ask the remotes of the installed packages working copies for
+        their last revision, all at once, to update with -U only the
+        working copies which miss it. The remote heads are kept
+        remote_heads_ttl seconds in <prefix>/.minitage/remote-heads.json.
+        Queries run in threads as they do not touch the current directory
+        nor the environment.
+        """
+        if not self._update or self._offline:
+            return
+        items, todo = [], []
+        factory = get_factory(
+            fetchers.IFetcherFactory, self._config_path)
+        for package in packages:
+            if (package.name in self._remote_moved
+                or not package.src_uri
+                or package.name.startswith('meta-')
+                or not self.is_installed(package)):
+                continue
+            fetcher = factory(package.src_type)
+            if fetcher is None:
+                continue
+            todo.append(package)
+            items.append((fetcher, package.src_uri, package.scm_branch,
+                          self.get_install_path(package)))
+        if not items:
+            return
+        self.logger.debug('Checking the remotes of %s.' % (
+            ', '.join([p.name for p in todo])))
+        rheads = heads.RemoteHeads(
+            os.path.join(self._prefix, self.history_dir, 'remote-heads.json'),
+            self._remote_heads_ttl)
+        for package, moved in zip(todo, rheads.moved(items)):
+            self._remote_moved[package.name] = moved
+            if not moved:
+                self.logger.info('%s is up to date with %s, not updating '
+                                 'it.' % (package.name, package.src_uri))
+        try:
+            rheads.save()
+        except (IOError, OSError), e:
+            self.logger.warning('Cannot save the remote heads: %s' % e)
+
+    @memoized
     def is_package_to_be_installed(self, package):
         """Does this package need to be installed."""
         ret = False
@@ -455,6 +623,7 @@ class Minimerge(object):
             ret = True
         return ret
 
+    @memoized
     def is_package_to_be_reinstalled(self, package):
         """Does this package need to be installed."""
         ret = False
@@ -470,6 +639,7 @@ class Minimerge(object):
             ret = True
         return ret
 
+    @memoized
     def is_package_to_be_upgraded(self, package):
         """Does this package need to be upgraded."""
         ret = False
@@ -479,6 +649,7 @@ class Minimerge(object):
             ret = True
         return ret
 
+    @memoized
     def is_package_to_be_updated(self, package):
         """Does this package need to be upgraded."""
         ret = False
@@ -491,6 +662,7 @@ class Minimerge(object):
             ret = True
         return ret
 
+    @memoized
     def is_package_to_be_deleted(self, package):
         """Does this package need to be upgraded."""
         ret = False
@@ -499,8 +671,74 @@ class Minimerge(object):
             ret = True
         return ret
 
+    def get_state(self):
+        """Return the installed packages state database, None if sqlite
+        is not available: the markers files are then used alone."""
+        if self._state is None and state.sqlite3 is not None:
+            self._state = state.StateDB(
+                os.path.join(self._prefix, self.history_dir, 'state.db'))
+        return self._state
+
+    def import_state(self):
+        """Import once in the state database the marker files of the
+        packages installed by older minitage versions, the database is
+        trusted afterwards."""
+        db = self.get_state()
+        if db is None or db.imported():
+            return
+        histories = {}
+        for markers in glob(os.path.join(
+            self._prefix, '*', '*', self.history_dir, 'markers')):
+            hd = os.path.dirname(markers)
+            histories[os.path.dirname(hd)] = hd
+        self.logger.debug('Importing the markers of %s packages in %s.' % (
+            len(histories), db.path))
+        db.import_files(histories)
+
+    def get_state_status(self):
+        """State of all the packages, read in one query and kept by the
+        status cache during a run (None out of a run, or without the
+        database)."""
+        db = self.get_state()
+        if db is None or not self.status_cache.active:
+            return None
+        if self.status_cache.state is None:
+            self.status_cache.read()
+            self.status_cache.state = db.status()
+        return self.status_cache.state
+
+    def get_package_history(self, package):
+        """Return the install path and the history directory."""
+        ipath = self.get_install_path(package)
+        return ipath, os.path.join(ipath, self.history_dir)
+
+    @memoized
+    def get_package_markers(self, package):
+        """Return all the markers of a package: {marker: value}"""
+        db = self.get_state()
+        if db is not None:
+            ipath, hd = self.get_package_history(package)
+            status = self.get_state_status()
+            if status is None:
+                # queried for this package alone
+                self.status_cache.read()
+            return db.get_markers(ipath, hd, status)
+        hd = os.path.join(self.get_package_history(package)[1], 'markers')
+        markers = {}
+        self.status_cache.read()
+        if os.path.isdir(hd):
+            self.status_cache.read()
+            for marker in os.listdir(hd):
+                self.status_cache.read()
+                markers[marker] = open(os.path.join(hd, marker)).read()
+        return markers
+
+    @memoized
     def is_package_marked(self, package, marker):
         """Does the history contain the specific marker"""
+        db = self.get_state()
+        if db is not None:
+            return marker in self.get_package_markers(package)
         fmarker = self.get_package_mark_common(package, marker)
         if os.path.exists(fmarker):
             return True
@@ -515,6 +753,9 @@ class Minimerge(object):
 
     def get_package_mark(self, package, marker):
         """Get from the history the specific marker"""
+        db = self.get_state()
+        if db is not None:
+            return self.get_package_markers(package).get(marker, '')
         fmarker = self.get_package_mark_common(package, marker)
         if os.path.exists(fmarker):
             return open(fmarker).read()
@@ -538,9 +779,15 @@ class Minimerge(object):
         hd = os.path.join(ipath, self.history_dir, 'markers')
         if not os.path.exists(hd):
             os.makedirs(hd)
+        # markers files are still written for older minitage versions,
+        # the state database does not read them
         fic = open(os.path.join(hd, marker), 'w')
         fic.write(text)
         fic.close()
+        db = self.get_state()
+        if db is not None:
+            db.set_marker(ipath, os.path.dirname(hd), marker, text)
+        self.status_cache.invalidate(package.name)
 
     def record_minibuild(self, package):
         """Copy in the history the current minibuild"""
@@ -550,39 +797,47 @@ class Minimerge(object):
         if not os.path.exists(hd):
             os.makedirs(hd)
         shutil.copy2(package.path, hdm)
+        db = self.get_state()
+        if db is not None:
+            db.record(ipath, hd, package.revision, open(hdm).read())
+        self.status_cache.invalidate(package.name)
 
+    @memoized
     def get_installed_minibuild(self, package):
         """Get in the history the relevant minibuild"""
         mb = None
-        ipath = self.get_install_path(package)
-        hd = os.path.join(ipath, self.history_dir)
+        ipath, hd = self.get_package_history(package)
         hdm = os.path.join(hd, 'minibuild')
         if self.is_installed(package):
+            self.status_cache.read()
             if os.path.exists(hdm):
-                mb = objects.Minibuild(path=hdm, minitage_config=self._config)
+                self.status_cache.read()
+                mb = objects.Minibuild(path=hdm, minitage_config=self._config,
+                                       metadata_cache=self.metadata_cache)
             else:
                 # packae is installed but without history, old minitage versions
                 # take the reference minibuild as the installed one.
                 mb = package
         return mb
 
+    @memoized
     def is_installed(self, package):
-        ip = self.get_install_path(package)
-        hd = os.path.join(ip, self.history_dir)
         ret = False
+        markers = self.get_package_markers(package)
         if package.category == 'eggs':
             versions = []
             pm = self.pyvers
             if package.name in pm:
                 versions = pm[package.name]
-                ret = True in [self.is_package_marked(package, 'install-%s' % version)
+                ret = True in [('install-%s' % version) in markers
                                for version in versions]
         # minitage has got the revision and history system
-        if not ret and self.is_package_marked(package, 'install'):
+        if not ret and 'install' in markers:
             ret = True
         return ret
 
 
+    @memoized
     def has_new_revision(self, package):
         """Does this package has a new revision to be installed"""
         oldrev = self.get_installed_revision(package)
@@ -592,78 +847,66 @@ class Minimerge(object):
                 ret = True
         return ret
 
+    @memoized
     def get_installed_revision(self, package):
         """Get the installed revision of a package"""
         revision = None
         if self.is_installed(package):
-            mb = self.get_installed_minibuild(package)
-            if mb:
-                revision = mb.revision
+            ipath, hd = self.get_package_history(package)
+            db = self.get_state()
+            if db is not None:
+                revision = db.get_revision(ipath, hd,
+                                           self.get_state_status())
+            if revision is None:
+                # installed by an older minitage, recorded on its next
+                # install
+                mb = self.get_installed_minibuild(package)
+                if mb:
+                    revision = mb.revision
         return revision
 
-    def _fetch(self, package):
+    def _fetch(self, package, step=None):
         """
         @param param minitage.core.objects.Minibuid the minibuild to fetch
+        @param step plan.BuildStep saying if the code is fetched and/or
+               updated, computed if not given (see get_step)
         Exceptions
            - MinimergeFetchComponentError if we do not found any component to
              fetch the package.
            - The fetcher exception.
         """
         self.logger.debug('Will fetch package %s.' % (package.name))
+        if step is None:
+            step = self.get_step(package)
         destination = self.get_install_path(package)
         dest_container = os.path.dirname(destination)
-        fetcherFactory = fetchers.IFetcherFactory(self._config_path)
+        fetcherFactory = get_factory(
+            fetchers.IFetcherFactory, self._config_path)
         # add maybe the scm to the path if it is avalaible
         mfetcher = fetcherFactory(package.src_type)
         sfetcher = fetcherFactory('static')
-        # in dependencies dir.
-        #try to add scms merged via minitage to the path.
-        deps = os.path.join(
-            self.getPrefix(), 'dependencies')
-        scm = getattr(mfetcher, 'executable', None)
-        if scm:
-            # do we minimerged yet
-            # and added a dependency directory?
-            if os.path.exists(deps):
-                for path in os.listdir(deps):
-                    fp = os.path.join(
-                        deps,
-                        path,
-                        'parts', 'part', 'bin')
-                    if os.path.exists(
-                        os.path.join(fp, scm)):
-                        self.logger.debug(
-                            'Adding %s to your path, this will '
-                            'enable %s \'scm\'.' % (fp, scm)
-                        )
-                        os.environ['PATH'] = '%s%s%s' % (
-                            fp, ':', os.environ['PATH']
-                    )
-        # add also minitage top /bin directory
-        os.environ['PATH'] = '%s%s%s' % (
-            os.path.join(self._prefix, 'bin'),
-            ':',
-            os.environ['PATH']
-        )
+        mfetcher.paths = self.get_paths(getattr(mfetcher, 'executable', None))
 
         urls_descriptions = []
         if self.use_binaries:
             urls_descriptions.extend([(True, sfetcher, url)
                                       for url in self.get_binary_urls(package)])
         urls_descriptions.append((False, mfetcher, package.src_uri,))
+        src_opts = self.get_fetch_options(package)
         # create categ dir
         if not os.path.isdir(dest_container):
             os.makedirs(dest_container)
         for is_binary, fetcher, src_uri in urls_descriptions:
             try:
-                if self.is_package_src_to_be_fetched(package):
+                if step.fetch:
                     self.logger.info('Fetching package %s from %s.' % (
                         package.name, src_uri)
                     )
-                    fetcher.fetch(destination, src_uri)
+                    fetcher.fetch(destination, src_uri,
+                                  not is_binary and src_opts or {})
                     self.set_package_mark(package, 'fetch', 'fetch')
                     downloaded = True
-                if self.is_package_src_to_be_updated(package):
+                if step.updatecode:
                     self.logger.info('Updating package %s from %s.' % (
                         package.name, src_uri)
                     )
@@ -674,11 +917,16 @@ class Minimerge(object):
                         if os.path.isdir(temp):
                             shutil.rmtree(temp)
 
-                        fetcher.fetch(temp, package.src_uri, {'branch':package.scm_branch})
+                        opts = dict(src_opts, branch=package.scm_branch)
+                        fetcher.fetch(temp, package.src_uri, opts)
                         copy_tree(temp, destination)
                         shutil.rmtree(temp)
                     else:
-                        fetcher.update(destination, src_uri, {'branch':package.scm_branch})
+                        opts = dict(src_opts, branch=package.scm_branch)
+                        if self._remote_moved.get(package.name) is False:
+                            # updated for a new revision of the minibuild
+                            opts['refresh_mirror'] = False
+                        fetcher.update(destination, src_uri, opts)
                     self.set_package_mark(package, 'fetch', 'fetch')
                     downloaded = True
                 if is_binary and downloaded:
@@ -692,23 +940,76 @@ class Minimerge(object):
                     continue
                 raise
 
-    def _do_action(self, action, packages, pyvers = None):
+    def get_paths(self, *scms):
+        """Directories the commands are searched in before the PATH:
+        the minitage top bin directory and the dependencies directories
+        providing the scms given (scms merged via minitage).
+        The dependencies are listed once by run, see minitage.core.tools.
+        """
+        paths = []
+        deps = os.path.join(self.getPrefix(), 'dependencies')
+        for scm in scms:
+            if scm:
+                for path in reversed(tools.providers(deps, scm)):
+                    if not path in paths:
+                        paths.append(path)
+        paths.insert(0, os.path.join(self._prefix, 'bin'))
+        return paths
+
+    def get_fetch_options(self, package):
+        """Shallow, partial and sparse checkout options of a package for
+        its fetcher: its src_depth, src_filter and src_sparse, the depth
+        and filter defaulting to the [minimerge] ones."""
+        opts = {}
+        for option, key in (('src_depth', 'depth'),
+                            ('src_filter', 'filter')):
+            value = (getattr(package, option, None)
+                     or self.minimerge_section.get(option, '').strip())
+            if value and value != 'full':
+                opts[key] = value
+        if getattr(package, 'src_sparse', None):
+            opts['sparse'] = package.src_sparse
+        return opts
+
+    def get_build_log(self, package):
+        """Log of the commands run by the last build of package,
+        <prefix>/logs/<name>.log, emptied for the new build."""
+        logs = os.path.join(self._prefix, 'logs')
+        if not os.path.isdir(logs):
+            try:
+                os.makedirs(logs)
+            except OSError:
+                # made meanwhile by another build worker
+                if not os.path.isdir(logs):
+                    raise
+        path = os.path.join(logs, '%s.log' % package.name)
+        open(path, 'w').close()
+        return path
+
+    def _do_action(self, action, packages, steps=None):
         """Do action.
         Install, delete, generate .env,  or reinstall a list of packages (minibuild instances).
         Arguments
             - action: reinstall|install|delete|generate_env action to do.
             - packages: minibuilds to deal with in order!
-            - pyvers: dict(package, [pythonver,]
+            - steps: dict(package name, plan.BuildStep), the steps
+              missing are computed for action (see get_step)
         """
-        if pyvers is None:
-            pyvers = {}
+        if steps is None:
+            steps = {}
 
         maker_kwargs = {}
 
-        mf = makers.IMakerFactory(self._config_path)
+        mf = get_factory(makers.IMakerFactory, self._config_path)
         for package in packages:
+            step = steps.get(package.name)
+            if step is None:
+                step = self.get_step(package, action)
+            step_action = step.action
             # if we are an egg, we maybe will have python versions setted.
-            maker_kwargs['python_versions'] = pyvers.get(package.name, None)
+            maker_kwargs['python_versions'] = None
+            if step.python_versions is not None:
+                maker_kwargs['python_versions'] = list(step.python_versions)
             # we install unless we are dealing with a meta
             if not package.name.startswith('meta-'):
                 options = {}
@@ -729,31 +1030,45 @@ class Minimerge(object):
                 options['minimerge'] = self
                 options['debug'] = self._debug
                 options['verbose'] = self.verbose
+                # environment of the commands of the maker, with the scms
+                # merged via minitage for the buildout checkouts
+                options['env'] = get_environ(
+                    self.minimerge_section, self.get_paths(*SCMS))
+                # steps already done by a failed run, see RunJournal
+                done_steps = None
+                if self._journal is not None:
+                    done_steps = self._journal.package(package.name)
+                options['steps'] = done_steps
 
                 # finally, time to act.
                 if not os.path.isdir(ipath):
                     os.makedirs(ipath)
-                callback = getattr(maker, action, None)
+                callback = getattr(maker, step_action, None)
                 if callback:
                     if ((package.category == 'eggs')
-                        and (action in ['install', 'reinstall'])):
+                        and (step_action in ['install', 'reinstall'])):
                         if 'parts' in options:
                             real_parts = []
                             parts = options['parts']
-                            for v in PYTHON_VERSIONS:
+                            for v in step.install_python_versions:
                                 for part in parts:
                                     if part.endswith(v):
-                                        reinstall = self.is_package_to_be_reinstalled(
-                                            package
-                                        ) or action == 'reinstall'
-                                        if (not self.is_package_marked(
-                                            package,
-                                            'install-%s' % v)
-                                            or reinstall):
-                                            real_parts.append(part)
+                                        real_parts.append(part)
                             options['parts'] = real_parts
-                    callback(ipath, options)
-                    if action in ['install', 'reinstall']:
+                    # where the maker commands write their output too
+                    options['log_file'] = self.get_build_log(package)
+                    try:
+                        callback(ipath, options)
+                    finally:
+                        if package.category == 'dependencies':
+                            # the tools it provides may have changed
+                            tools.forget(ipath)
+                    if step_action == 'delete':
+                        if self.get_state() is not None:
+                            self.get_state().forget(ipath)
+                        self.status_cache.invalidate(package.name)
+                    if (step_action in ['install', 'reinstall']
+                        and not (done_steps and 'record' in done_steps)):
                         self.record_minibuild(package)
                         onlyrecord = True
                         if package.category == 'eggs':
@@ -771,87 +1086,48 @@ class Minimerge(object):
                                                       'install-%s' % (v))
                             else:
                                 onlyrecord = True
-                        self.generate_env(package)
                         if onlyrecord:
-                            self.set_package_mark(package, action, action)
-                elif action == 'generate_env':
-                    self.generate_env(package)
+                            self.set_package_mark(package, step_action,
+                                              step_action)
+                        if done_steps:
+                            done_steps.done('record')
+                    if (step_action in ['install', 'reinstall']
+                        and not (done_steps and 'env' in done_steps)):
+                        self.generate_env(package)
+                        if done_steps:
+                            done_steps.done('env')
+                elif step_action == 'generate_env':
+                    if not (done_steps and 'env' in done_steps):
+                        self.generate_env(package)
+                        if done_steps:
+                            done_steps.done('env')
                 else:
-                    message = 'The action \'%s\' does not exists ' % action
+                    message = 'The action \'%s\' does not exists ' % step_action
                     message += 'in this \'%s\' component' \
                             % ( package.install_method)
                     raise ActionError(message)
 
 
     def _cut_jumped_packages(self, packages):
-        """Remove jumped packages."""
+        """Remove jumped packages.
+        An unknown package is reported, forgotten and nothing is removed."""
+        names = [package.name for package in packages]
         try:
-            m = self._find_minibuild(self._jump)
-            if m:
-                names = [package.name for package in packages]
-                i = names.index(m.name)
-                packages = packages[i:]
-        except Exception, e:
-            pass
-        return packages
+            i = names.index(self._find_minibuild(self._jump).name)
+        except (MinimergeError, ValueError), e:
+            self.logger.warning(
+                'Cannot jump to %s, it is not one of the packages to '
+                'merge: %s.' % (self._jump, ', '.join(names)))
+            self._jump = False
+            return packages
+        return packages[i:]
 
 
     def pretend(self, packages):
         """Return a string indication what will be done on packages list"""
-        log = StringIO()
-        log.write('Action:\t%s\n\n' % self._action)
         if packages:
             self.logger.debug('Packages:')
-            for p in packages:
-                EMPTY_CELL = ' '
-                actionsd = {
-                    'fetch': (True==self.is_package_src_to_be_fetched(p)
-                              and 'f' or EMPTY_CELL),
-                    'updatecode': (True==self.is_package_src_to_be_updated(p)
-                                    and 'F' or EMPTY_CELL),
-                    'install': (True==self.is_package_to_be_installed(p)
-                                and 'I' or ''),
-                    'reinstall': (True==self.is_package_to_be_reinstalled(p)
-                                  and 'R'or ''),
-                    'delete': (True==self.is_package_to_be_deleted(p)
-                                and 'D' or ''),
-                    'upgrade': (True==self.is_package_to_be_upgraded(p)
-                                and 'U' or EMPTY_CELL),
-                    'update': (True==self.is_package_to_be_updated(p)
-                                and 'u' or EMPTY_CELL),
-                }
-                actions = '%s' % (
-                    '%(fetch)s%(updatecode)s'
-                    '%(install)s%(reinstall)s%(delete)s'
-                    '%(upgrade)s%(update)s' % actionsd
-                )
-                pyvers = ''
-                if p.category == 'eggs':
-                    versions, iversions = [], []
-                    pm = self.pyvers
-                    if p.name in pm:
-                        versions = pm[p.name]
-                    for version in versions:
-                        reinstall = self.is_package_to_be_reinstalled(p)
-                        if (not self.is_package_marked(p, 'install-%s' % version)
-                            or reinstall):
-                            iversions.append(version)
-                    if len(iversions)>0:
-                        pyvers = '(%s)' % (', '.join(iversions))
-                revision = ''
-                if self.is_package_to_be_upgraded(p):
-                    revision = '[%s => %s]' % (self.get_installed_revision(p), p.revision)
-                log.write('\t\t%s * %s %s %s\n' % (actions, p.name, revision, pyvers))
-        log.write('\n')
-        log.write('\t FLAGS * PACKAGE_NAME [OLD_REVISION => NEW_REVISION] (python versions)\n')
-        log.write('\t f : fetch\n')
-        log.write('\t F : update the code from repository\n')
-        log.write('\t I : install the package\n')
-        log.write('\t R : reinstall the package\n')
-        log.write('\t D : delete the package\n')
-        log.write('\t U : upgrade the package to the lastest revision if any\n')
-        log.write('\t u : update the package (for example, re run buildout)\n')
-        return log
+        return self.make_plan(packages).format()
 
     def main(self):
         """Main loop.
@@ -863,58 +1139,47 @@ class Minimerge(object):
                   - maybe install
                   - maybe delete
         """
+        self.import_state()
+        self.status_cache.start()
+        # the shared ssh connections are made here, before the fetch and
+        # build workers are forked, and closed here once they are done
+        mux = ssh.get_multiplexer({'minimerge': self.minimerge_section})
+        if mux is not None and not self._offline:
+            mux.get_wrapper()
+        try:
+            self._main()
+        finally:
+            if mux is not None:
+                mux.close()
+            self.status_cache.stop()
+            self.logger.debug(self.status_cache.report())
+            self.metadata_cache.save()
+            self.logger.debug(
+                'Minibuilds metadata cache: %s hits, %s misses.' % (
+                    self.metadata_cache.hits, self.metadata_cache.misses))
+            self.logger.debug(httpclient.report())
+            self.logger.debug(tools.report())
+
+    def _main(self):
         if self._action == 'sync':
             self._sync()
         else:
-            packages = self._packages
-            # compute dependencies
-            self.logger.debug('Calculating dependencies.')
-            if not self._nodeps:
-                packages = self._compute_dependencies(self._packages)
-            if self._nodeps:
-                packages = self._find_minibuilds(self._packages)
-            direct_dependencies = self._find_minibuilds(self._packages)
-
-            if self._jump:
-                # cut jumped dependencies.
-                packages = self._cut_jumped_packages(packages)
-                self.logger.debug('Shrinking packages away. _1/2_' )
-
-            # cut pythons we do not need !
-            # also get the parts to do in 'eggs' buildout
-            pypackages, pyvers = self._select_pythons(packages[:])
-            self.pyvers = pyvers
-            #pypackages, _ = self._select_pythons(direct_dependencies)
-
-            ## do not take python tree in account if we are in nodep mode
-            if not self._nodeps:
-                # fiter only python deptree
-                pypackages = [p for p in pypackages
-                              if not p.name in [d.name for d in direct_dependencies]]
-
-                # add dependency packages
-                noecho = [pypackages.append(p)
-                          for p in packages
-                          if not p.name in [q.name for q in pypackages]]
-                packages = pypackages
-
-            # cut jumped dependencies again.
-            if self._jump:
-                self.logger.debug('Shrinking packages away. _2/2_')
-                packages = self._cut_jumped_packages(packages)
-
-            if self._only_dependencies:
-                packages = [p for p in packages if not p.name in self._packages]
-
-            packages = self.install_filter(packages)
-            pretend = self.pretend(packages)
-            self.logger.debug(pretend.getvalue())
+            if self._resume:
+                build_plan = self.resume_plan()
+            else:
+                self.logger.debug('Calculating dependencies.')
+                build_plan = self.get_plan()
+            if build_plan.steps:
+                self.logger.debug('Packages:')
+            self.logger.debug(build_plan.format().getvalue())
+            if self._dump_plan:
+                self.dump_plan(build_plan, self._dump_plan)
 
             stop = False
             answer = ''
             valid_answers = ('y', '', 'yes')
             if self._ask:
-                print
+                print build_plan.format().getvalue()
                 print 'Continue ? (y|n)'
                 answer = raw_input()
 
@@ -927,33 +1192,401 @@ class Minimerge(object):
             if not stop:
                 if answer:
                     self.logger.info('User choosed to continue')
+                self.execute(build_plan)
+                self.prune_store()
 
+    def prune_store(self):
+        """Remove the files of the download store which no package nor
+        prefix used since download_store_max_age days."""
+        if self._store_max_age is None:
+            return
+        dstore = store.get_store(
+            self.minimerge_section.get('download_store', None))
+        if dstore is None:
+            return
+        try:
+            count, size = dstore.prune(self._store_max_age)
+        except (IOError, OSError), e:
+            self.logger.warning('Cannot prune the download store: %s' % e)
+            return
+        if count:
+            self.logger.info(
+                'Removed %s unused files (%s bytes) from the download '
+                'store %s.' % (count, size, dstore.path))
+
+    def select_packages(self):
+        """Compute the packages of the run, with their dependencies, the
+        needed pythons and without the jumped ones.
+        Returns
+            - ([packages], {egg name: [python versions]})
+        """
+        packages = self._packages
+        if not self._nodeps:
+            packages = self._compute_dependencies(self._packages)
+        if self._nodeps:
+            packages = self._find_minibuilds(self._packages)
+        direct_dependencies = self._find_minibuilds(self._packages)
 
-                # fetch first, or just in time
-                if self._fetchfirst:
-                    # fetch all first, build after
-                    for package in packages:
-                        if not package.name.startswith('meta-'):
-                            # fetch if not offline
-                            if not (self._offline or self._action == 'delete'):
-                                self.fetch(package)
-                    # if we do not want just to fetch, let's go ,
-                    # (install|delete|reinstall) baby.
-                    if not self._fetchonly:
-                        if not package in self._binaries:
-                            self._do_action(self._action, packages, pyvers)
-                else:
-                    # just in time fetch
+        if self._jump:
+            # cut jumped dependencies.
+            packages = self._cut_jumped_packages(packages)
+            self.logger.debug('Shrinking packages away. _1/2_' )
+
+        # cut pythons we do not need !
+        # also get the parts to do in 'eggs' buildout
+        pypackages, pyvers = self._select_pythons(packages[:])
+        #pypackages, _ = self._select_pythons(direct_dependencies)
+
+        ## do not take python tree in account if we are in nodep mode
+        if not self._nodeps:
+            # fiter only python deptree
+            pypackages = [p for p in pypackages
+                          if not p.name in [d.name for d in direct_dependencies]]
+
+            # add dependency packages
+            noecho = [pypackages.append(p)
+                      for p in packages
+                      if not p.name in [q.name for q in pypackages]]
+            packages = pypackages
+
+        # cut jumped dependencies again.
+        if self._jump:
+            self.logger.debug('Shrinking packages away. _2/2_')
+            packages = self._cut_jumped_packages(packages)
+
+        if self._only_dependencies:
+            packages = [p for p in packages if not p.name in self._packages]
+        return packages, pyvers
+
+    def get_plan(self):
+        """Compute the BuildPlan of the run."""
+        packages, pyvers = self.select_packages()
+        self.pyvers = pyvers
+        return self.make_plan(packages, needed_only=True)
+
+    def make_plan(self, packages, needed_only=False):
+        """BuildPlan of packages, using self.pyvers for the eggs.
+        Arguments:
+            - needed_only: drop packages with nothing to do
+        """
+        steps = []
+        self.check_remote_heads(packages)
+        for p in packages:
+            decisions = {
+                'install': self.is_package_to_be_installed(p),
+                'reinstall': self.is_package_to_be_reinstalled(p),
+                'delete': self.is_package_to_be_deleted(p),
+                'upgrade': self.is_package_to_be_upgraded(p),
+                'update': self.is_package_to_be_updated(p),
+            }
+            if (needed_only and not True in decisions.values()
+                and not self._action == 'generate_env'):
+                continue
+            versions = self.pyvers.get(p.name, None)
+            iversions = []
+            if p.category == 'eggs':
+                for version in versions or []:
+                    if (not self.is_package_marked(p, 'install-%s' % version)
+                        or decisions['reinstall']):
+                        iversions.append(version)
+            installed_revision = None
+            if decisions['upgrade']:
+                installed_revision = self.get_installed_revision(p)
+            steps.append(plan.BuildStep(
+                name=p.name,
+                path=p.path,
+                category=p.category,
+                action=self._action,
+                meta=p.name.startswith('meta-'),
+                fetch=self.is_package_src_to_be_fetched(p),
+                updatecode=self.is_package_src_to_be_updated(p),
+                python_versions=versions,
+                install_python_versions=iversions,
+                revision=p.revision,
+                installed_revision=installed_revision,
+                **decisions))
+        return plan.BuildPlan(self._action, steps)
+
+    def get_step(self, package, action=None):
+        """BuildStep of a package merged out of a plan, for action
+        (default to the minimerge one)."""
+        current = self._action
+        if action is not None:
+            self._action = action
+        try:
+            return self.make_plan([package]).steps[0]
+        finally:
+            self._action = current
+
+    def get_runs_directory(self):
+        return os.path.join(self._prefix, self.history_dir, 'runs')
+
+    def resume_plan(self):
+        """Load the journal of the last failed run, restore its modes and
+        return its BuildPlan."""
+        runs = self.get_runs_directory()
+        self._journal = journal.RunJournal.last(runs)
+        if self._journal is None:
+            raise MinimergeError(
+                'There is no minimerge run to resume in %s.' % runs)
+        for mode, value in self._journal.get_modes().items():
+            setattr(self, '_%s' % mode, value)
+        build_plan = self._journal.get_plan()
+        self._action = build_plan.action
+        self.pyvers = build_plan.pyvers()
+        point = self._journal.resume_point()
+        if point is not None:
+            self.logger.info(
+                'Resuming %s at %s (%s), %s packages already merged.' % (
+                    self._journal.path, point[0], point[1] or 'done',
+                    len(self._journal.completed)))
+        return build_plan
+
+    def dump_plan(self, build_plan, path):
+        """Write the plan in JSON to path, '-' for stdout."""
+        if path == '-':
+            print build_plan.to_json()
+        else:
+            fic = open(path, 'w')
+            fic.write(build_plan.to_json())
+            fic.close()
+            self.logger.info('Build plan written to %s.' % path)
+
+    def execute(self, build_plan):
+        """Fetch and build the steps of a BuildPlan.
+        What is done is written in the run journal, the packages it
+        says are merged are skipped."""
+        if self._journal is None:
+            self._journal = journal.RunJournal.create(
+                self.get_runs_directory(), build_plan,
+                dict([(mode, getattr(self, '_%s' % mode))
+                      for mode in JOURNAL_MODES]))
+        run = self._journal
+        packages = [self._find_minibuild(step.name) for step in build_plan
+                    if not run.is_complete(step.name)]
+        steps = dict([(step.name, step) for step in build_plan])
+        try:
+            # fetch first, or just in time
+            if self._fetchfirst:
+                # fetch all first, build after
+                # fetch if not offline
+                if not (self._offline or self._action == 'delete'):
+                    self.fetch_packages(
+                        [p for p in packages
+                         if not p.name.startswith('meta-')
+                         and self.is_to_be_fetched(steps[p.name])],
+                        steps)
+                # if we do not want just to fetch, let's go ,
+                # (install|delete|reinstall) baby.
+                if not self._fetchonly:
+                    if self._jobs > 1:
+                        self._merge_parallel(packages, fetch=False,
+                                             steps=steps)
+                    else:
+                        for package in packages:
+                            self._merge(package, fetch=False,
+                                        step=steps[package.name])
+            elif self._jobs > 1 and not self._fetchonly:
+                self._merge_parallel(packages, steps=steps)
+            else:
+                # just in time fetch, maybe fetching ahead
+                self._prefetcher = self.get_prefetcher(packages, steps)
+                try:
                     for package in packages:
-                        if not package.name.startswith('meta-'):
-                            # fetch if not offline
-                            if not (self._offline or self._action == 'delete'):
-                                self.fetch(package)
-                            # if we do not want just to fetch, let's go ,
-                            if not self._fetchonly:
-                                # (install|delete|reinstall|generate_env) baby.
-                                if not package in self._binaries:
-                                    self._do_action(self._action, [package], pyvers)
+                        self._merge(package, step=steps[package.name])
+                finally:
+                    if self._prefetcher is not None:
+                        self._prefetcher.stop()
+                        self._prefetcher = None
+        except (Exception, KeyboardInterrupt), e:
+            self._journal = None
+            self.logger.error(
+                'Minimerge %s, the run journal is %s, use --resume to '
+                'continue it.' % (
+                    isinstance(e, KeyboardInterrupt) and 'was interrupted'
+                    or 'failed', run.path))
+            raise
+        self._journal = None
+        run.finish()
+
+    def is_to_be_fetched(self, step):
+        """Does the plan need to fetch or update the step code."""
+        return step is None or step.fetch or step.updatecode
+
+    def get_fetch_host(self, package):
+        """Host the package is fetched from, None for local sources."""
+        return urlparse.urlparse(package.src_uri or '')[1] or None
+
+    def fetch_packages(self, packages, steps=None):
+        """Fetch packages before building them.
+        fetch_jobs packages are fetched at the same time, at most
+        fetch_jobs_per_host of them from the same host, each in its own
+        process so that its output, shown when it is over, is not mixed
+        with the others.
+        All the packages are fetched even if some fail, the failures are
+        reported at the end.
+        The binary packages (-k) are fetched here, one after the other, as
+        this process has to know which packages did install a binary.
+        steps are the plan.BuildStep of the packages, by name.
+        """
+        if steps is None:
+            steps = {}
+        if (self._fetch_jobs < 2 or len(packages) < 2
+            or self.use_binaries):
+            for package in packages:
+                self._journaled_fetch(package, steps.get(package.name))
+            return
+        hosts = set([self.get_fetch_host(p) for p in packages])
+        sched = scheduler.Scheduler(
+            self._fetch_jobs, self.logger,
+            limits=dict([(h, self._fetch_jobs_per_host)
+                         for h in hosts if h]),
+            keep_going=True, buffered=True)
+        self.logger.info('Fetching %s packages with %s jobs.' % (
+            len(packages), self._fetch_jobs))
+        for package in packages:
+            sched.add(package.name,
+                      lambda p=package: self._journaled_fetch(
+                          p, steps.get(p.name)),
+                      resources=[self.get_fetch_host(package)])
+        try:
+            try:
+                sched.run()
+            except scheduler.SchedulerError, e:
+                raise MinimergeError('Fetch failed:\n%s' % e)
+        finally:
+            # the packages status changed in the workers
+            for package in packages:
+                self.status_cache.invalidate(package.name)
+
+    def get_prefetcher(self, packages, steps):
+        """Start fetching the packages in the background, fetch_ahead
+        packages ahead of the one being built, in the build order.
+        Returns
+            - the started scheduler.Prefetcher, None if there is nothing
+              to fetch ahead
+        The binary packages (-k) are fetched just in time, see
+        fetch_packages.
+        """
+        if (not self._fetch_ahead or self._fetchonly or self.use_binaries
+            or self._offline or self._action == 'delete'):
+            return None
+        packages = [p for p in packages
+                    if not p.name.startswith('meta-')
+                    and self.is_to_be_fetched(steps[p.name])]
+        if len(packages) < 2:
+            return None
+        self.logger.info('Fetching up to %s packages ahead.' % (
+            self._fetch_ahead))
+        prefetcher = scheduler.Prefetcher(
+            [(p.name, lambda p=p: self._journaled_fetch(p, steps[p.name]))
+             for p in packages],
+            self._fetch_ahead, self.logger)
+        prefetcher.start()
+        return prefetcher
+
+    def _prefetched(self, package):
+        """Wait for the package if it is fetched in the background.
+        Returns
+            - True if it was fetched there
+        """
+        if self._prefetcher is None:
+            return False
+        fetched = self._prefetcher.join(package.name)
+        if fetched is None:
+            return False
+        # the package status changed in the worker
+        self.status_cache.invalidate(package.name)
+        if not fetched:
+            self.logger.warning(
+                'Fetching %s in the background failed, fetching it '
+                'again.' % package.name)
+        return fetched
+
+    def _journaled_fetch(self, package, step=None):
+        """Fetch a package unless the run journal says it is."""
+        run = self._journal
+        if run is not None and run.is_done(package.name, 'fetch'):
+            return
+        try:
+            self.fetch(package, step)
+        except Exception, e:
+            if run is not None:
+                run.fail(package.name, e)
+            raise
+        if run is not None:
+            run.done(package.name, 'fetch')
+
+    def _merge(self, package, fetch=True, step=None):
+        """Fetch and build one package as its plan.BuildStep says."""
+        if step is None:
+            step = self.get_step(package)
+        if not package.name.startswith('meta-'):
+            # fetch if not offline
+            if (fetch and self.is_to_be_fetched(step)
+                and not (self._offline or self._action == 'delete')
+                and not self._prefetched(package)):
+                self._journaled_fetch(package, step)
+            # if we do not want just to fetch, let's go ,
+            if not self._fetchonly:
+                # (install|delete|reinstall|generate_env) baby.
+                if not package in self._binaries:
+                    try:
+                        self._do_action(step.action, [package],
+                                        {package.name: step})
+                    except Exception, e:
+                        if self._journal is not None:
+                            self._journal.fail(package.name, e)
+                        raise
+        if self._journal is not None:
+            self._journal.complete(package.name)
+
+    def get_dependency_graph(self, packages):
+        """Return the dependency graph restricted to the given packages.
+        Packages which are not in the list (already installed, metas) are
+        walked through so that their own dependencies are still honoured.
+        Returns
+            - dict {package name: [names of the packages it waits for]}
+        """
+        names = set([p.name for p in packages])
+        dgraph = {}
+        for package in packages:
+            dgraph[package.name] = [
+                d for d in self.get_graph().reachable(package.name, names)
+                if d != package.name]
+        return dgraph
+
+    def _merge_parallel(self, packages, fetch=True, steps=None):
+        """Build independent packages at the same time."""
+        if steps is None:
+            steps = {}
+        dgraph = self.get_dependency_graph(packages)
+        sched = scheduler.Scheduler(self._jobs, self.logger)
+        self.logger.info('Building %s packages with %s jobs.' % (
+            len(packages), self._jobs))
+        for package in packages:
+            func = None
+            if not package.name.startswith('meta-'):
+                func = (lambda p=package: self._merge(
+                    p, fetch, steps.get(p.name)))
+            sched.add(package.name, func, dgraph[package.name])
+        try:
+            try:
+                sched.run()
+            except scheduler.SchedulerError, e:
+                raise MinimergeError('%s' % e)
+        finally:
+            # the packages merged, metas included, as _merge does
+            if self._journal is not None:
+                self._journal.reload()
+                for name in sched.done:
+                    self._journal.complete(name)
+            # the packages status changed in the workers, and the tools
+            # they provide: the workers forgot them in their own process
+            for package in packages:
+                self.status_cache.invalidate(package.name)
+                if not package.name.startswith('meta-'):
+                    tools.forget(self.get_install_path(package))
 
     def _select_pythons(self, packages, test=False):
         """Get pythons to build into dependencies.
@@ -1111,7 +1744,8 @@ class Minimerge(object):
         default_minilays = self.get_default_minilays()
         minimerge_section = self._config._sections.get('minimerge', {})
         urlbase = '%s.%s' % (CORE_MINILAYS_URLBASE, version)
-        f = fetchers.IFetcherFactory(self._config_path)
+        f = get_factory(
+            fetchers.IFetcherFactory, self._config_path)
         hg = f('static')
 
         # create default minilay dir in case
@@ -1146,7 +1780,7 @@ class Minimerge(object):
             type = None
             # querying scm factory for registered scms
             # and removing static
-            scms = [key for key in f.products.keys() if key != 'static']
+            scms = [key for key in f.keys() if key != 'static']
             scmfound = False
             for strscm in scms:
                 if os.path.isdir(
@@ -1213,7 +1847,7 @@ class Minimerge(object):
             )
         return ip
 
-    def fetch(self, package):
+    def fetch(self, package, step=None):
         if self._nofetch:
             self.logger.warn('Skip fetch')
             return
@@ -1223,12 +1857,12 @@ class Minimerge(object):
                 package.name)
         )
         try:
-            self._fetch(package)
+            self._fetch(package, step)
         except Exception, e:
             fail = True
             if package.install_method == 'buildout':
 
-                mf = makers.IMakerFactory(self._config_path)
+                mf = get_factory(makers.IMakerFactory, self._config_path)
                 buildout = mf(package.install_method)
                 buildout.get_options(self, package)
                 if os.path.exists(
@@ -1245,13 +1879,16 @@ class Minimerge(object):
         upgrade = self._upgrade
         self._update  = True
         self._upgrade = True
+        if pyvers is not None:
+            self.pyvers = pyvers
+        action = 'install'
+        if force:
+            action = 'reinstall'
         for package in packages:
             package = self.find_minibuild(package)
-            self.fetch(package)
-            action = 'install'
-            if force:
-                action = 'reinstall'
-            self._do_action(action, [package], pyvers=pyvers)
+            step = self.get_step(package, action)
+            self.fetch(package, step)
+            self._do_action(action, [package], {package.name: step})
         self._update  = update
         self._upgrade = upgrade
 
@@ -1265,13 +1902,16 @@ class Minimerge(object):
     def generate_env(self, mb):
         try:
             self.logger.debug('.env will be regenerated for %s' % mb.name)
-            top = [os.path.join(self._prefix, 'bin', 'paster'),
+            paster = tools.which('paster', self.get_paths())
+            if paster is None:
+                raise IOError('paster is not installed')
+            top = [paster,
                    'create', '-q',
                    '-t', 'minitage.instances.env',
                    '--no-interactive',
                    mb.name
                   ]
-            retcode = subprocess.call(top)
+            runner.run(top, logger=self.logger)
             self.logger.info('.env has been regenerated for %s' % mb.name)
         except:
             # minitage.paste is not installed anymore
@@ -1307,17 +1947,8 @@ class Minimerge(object):
 
     def install_filter(self, packages):
         """ Return only packages really needing action"""
-        packages = [p for p in packages
-                    if (
-                        self.is_package_to_be_installed(p)
-                        or self.is_package_to_be_reinstalled(p)
-                        or self.is_package_to_be_upgraded(p)
-                        or self.is_package_to_be_updated(p)
-                        or self.is_package_to_be_deleted(p)
-                        or self._action == 'generate_env'
-                    )
-                   ]
-        return packages
+        names = self.make_plan(packages, needed_only=True).names()
+        return [p for p in packages if p.name in names]
 
 
 
@@ -0,0 +1,111 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import time
+import logging
+import tempfile
+from multiprocessing.dummy import Pool
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+__logger__ = 'minitage.fetchers.heads'
+
+""" seconds a remote head is trusted for"""
+TTL = 300
+""" seconds after which a remote which does not answer is taken as moved"""
+TIMEOUT = 60
+""" remotes queried at the same time"""
+JOBS = 8
+
+
+class RemoteHeads(object):
+    """Last revisions of the remote repositories, to update only the
+    working copies whose remote moved.
+    The heads are asked to the fetchers (get_remote_head) a batch at a
+    time, with JOBS queries running at the same time, and kept in a JSON
+    file for ttl seconds.
+    Example::
+        >>> heads = RemoteHeads('/prefix/.minitage/remote-heads.json')
+        >>> heads.moved([(GitFetcher(), 'http://host/repo', None,
+        ...               '/prefix/dependencies/repo')])
+        [False]
+        >>> heads.save()
+    """
+
+    def __init__(self, path, ttl=TTL, jobs=JOBS):
+        self.path = path
+        self.ttl = ttl
+        self.jobs = max(1, jobs)
+        self.heads = {}
+        self.changed = False
+        self.log = logging.getLogger(__logger__)
+        if os.path.isfile(path):
+            try:
+                self.heads = json.loads(open(path).read())
+            except ValueError:
+                self.log.warning('Ignoring the invalid %s.' % path)
+
+    def key(self, fetcher, uri, branch=None):
+        return '%s %s %s' % (fetcher.name, uri, branch or '')
+
+    def get(self, fetcher, uri, branch=None):
+        """The remote head, from the cache if it is fresh enough.
+        Returns None if the fetcher cannot tell or the remote cannot be
+        reached."""
+        key = self.key(fetcher, uri, branch)
+        cached = self.heads.get(key)
+        if cached and time.time() - cached[0] < self.ttl:
+            return cached[1]
+        try:
+            head = fetcher.get_remote_head(uri, branch)
+        except Exception, e:
+            self.log.debug('Cannot get the head of %s: %s' % (uri, e))
+            head = None
+        if head is not None:
+            self.heads[key] = [time.time(), head]
+            self.changed = True
+        return head
+
+    def _moved(self, item):
+        fetcher, uri, branch, dest = item
+        head = self.get(fetcher, uri, branch)
+        if head is None:
+            return True
+        try:
+            return not fetcher.has_head(dest, head)
+        except Exception, e:
+            self.log.debug('Cannot find %s in %s: %s' % (head, dest, e))
+            return True
+
+    def moved(self, items):
+        """Did the remotes move since their working copies were updated.
+        Arguments
+            - items: [(fetcher, uri, branch, working copy)]
+        Returns
+            - a boolean by item, True when it cannot be told
+        """
+        if not items:
+            return []
+        pool = Pool(min(self.jobs, len(items)))
+        try:
+            return pool.map(self._moved, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def save(self):
+        if not self.changed:
+            return
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        os.write(fd, json.dumps(self.heads))
+        os.close(fd)
+        os.rename(tmp, self.path)
+        self.changed = False
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -8,6 +8,10 @@ import datetime
 from distutils.dir_util import copy_tree
 
 from minitage.core import interfaces
+from minitage.core import tools
+from minitage.core.fetchers.mirrors import get_mirrors
+from minitage.core.fetchers.ssh import get_multiplexer, is_local
+from minitage.core.fetchers import heads
 import minitage.core.common
 
 class IFetcherError(Exception):
@@ -84,11 +88,7 @@ class IFetcherFactory(interfaces.IFactory):
                 -hg: mercurial
                 -svn: subversion
         """
-        for key in self.products:
-            klass = self.products[key]
-            instance = klass(config = self.sections)
-            if instance.match(switch):
-                return instance
+        return self.get_instance(switch, config = self.sections)
 
 class IFetcher(interfaces.IProduct):
     """Interface for fetching a package from somewhere.
@@ -112,6 +112,9 @@ class IFetcher(interfaces.IProduct):
             - is_valid_src_uri to know if the src url is good
             - _has_uri_changed to know if we get the source from the last repo
               we got from or a new one.
+        Fetchers which can check out against a local mirror (see
+        minitage.core.fetchers.mirrors) also implement create_mirror and
+        update_mirror and use get_mirror.
     """
 
     def __init__(self,
@@ -138,20 +141,22 @@ class IFetcher(interfaces.IProduct):
             config = {}
         self.config = config
         self.executable = executable
-        self._scm_found = None
         self.default_revision = default_revision
         mconfig = config.get('minimerge', {})
         if branch is None:
             branch = mconfig.get('branch', None)
         self.branch = branch
-        self._proxies = {
-            'http_proxy': mconfig.get('http_proxy', None),
-            'https_proxy': mconfig.get('https_proxy', None),
-            'ftp_proxy': mconfig.get('ftp_proxy', None),
-        }
-        for proxy_type in self._proxies:
-            if self._proxies[proxy_type]:
-                os.environ[proxy_type] = self._proxies[proxy_type]
+        # directories searched for the scm before the PATH, see get_env
+        self.paths = []
+        self.mirrors = get_mirrors(config)
+        self.ssh = get_multiplexer(config)
+        # seconds given to get_remote_head, 0 to wait as long as it takes
+        try:
+            self.remote_timeout = max(0, int(mconfig.get(
+                'remote_heads_timeout', None) or heads.TIMEOUT))
+        except ValueError:
+            self.log.warning('The remote_heads_timeout setting is invalid.')
+            self.remote_timeout = heads.TIMEOUT
 
     def update(self, dest, uri, opts=None, verbose=False):
         """
@@ -163,6 +168,8 @@ class IFetcher(interfaces.IProduct):
                 - revision: particular revision to deal with.
                 - args: misc arguments to give to the underlying program
                 - goto-revision-args: misc arguments to give to udpate to a specified version
+                - refresh_mirror: False not to refresh the mirror of uri,
+                  when the remote is known not to have moved
         """
         self.log.debug('Updating %s / %s' % (dest, uri))
         if not opts:
@@ -182,7 +189,13 @@ class IFetcher(interfaces.IProduct):
             )
             self.fetch(dest, uri, opts, verbose)
         else:
-            self.update_wc(dest, uri, opts, verbose)
+            revision = opts.get('revision', None)
+            if revision and self.has_revision(dest, revision):
+                # pinned revisions do not need the network
+                self.log.info('%s is already in %s, not updating it.' % (
+                    revision, dest))
+            else:
+                self.update_wc(dest, uri, opts, verbose)
             # atm, only git has the use case of in place branches
             # others can use plain url
             branch = opts.get('branch', None)
@@ -214,6 +227,9 @@ class IFetcher(interfaces.IProduct):
                 - revision: particular revision to deal with.
                 - args: misc arguments to give to the underlying program
                 - goto-revision-args: misc arguments to give to udpate to a specified version
+                - depth, filter, sparse: shallow, partial and sparse
+                  checkouts for the fetchers which support them, see the
+                  minibuild src_depth, src_filter and src_sparse options
         """
         if opts is None:
             opts = {}
@@ -291,30 +307,40 @@ class IFetcher(interfaces.IProduct):
             )
             raise InvalidRepositoryError(message)
 
+    def get_env(self):
+        """Environment of the scm commands: ours with the proxies of the
+        configuration, and self.paths before the PATH."""
+        return minitage.core.common.get_environ(
+            self.config.get('minimerge', {}), self.paths)
+
     def _check_scm_presence(self):
         """check if the scm is in he path"""
-        for path in os.environ.get('PATH', '').split(':'):
-            exe = os.path.join(path, self.executable)
-            if os.path.exists(exe):
-                self._scm_found = True
-                break
-
-        if not getattr(self, '_scm_found', False):
+        if tools.which(self.executable,
+                       self.get_env().get('PATH', '')) is None:
             message = '%s is not in your path, ' % self.executable
             message += 'please install it or maybe get it into your PATH'
             raise FetcherNotInPathError(message)
 
-    def _scm_cmd(self, command, verbose=False, output=False):
-        """Helper to run scm commands."""
+    def _scm_cmd(self, command, verbose=False, output=False, cwd=None,
+                 timeout=None):
+        """Helper to run scm commands, in cwd if given, killed after
+        timeout seconds if given."""
         self._check_scm_presence()
         ret = None
         logging.getLogger(__logger__).debug(
-            'Running %s %s ' % (self.executable, command))
+            'Running %s %s %s' % (self.executable, command,
+                                  cwd and 'in %s' % cwd or ''))
+        command = '%s %s' % (self.executable, command)
+        if not is_local(command):
+            command = self.ssh_command(command)
         try:
             ret = minitage.core.common.Popen(
-                '%s %s' % (self.executable, command),
+                command,
                 verbose=verbose,
-                output=output)
+                output=output,
+                cwd=cwd,
+                timeout=timeout,
+                env=self.get_env())
         except Exception, e:
             raise FetcherRuntimeError('%s' % e)
         return ret
@@ -344,6 +370,39 @@ class IFetcher(interfaces.IProduct):
             return True
         return False
 
+    def has_revision(self, dest, revision):
+        """Is revision in the working copy at dest, and not a name which
+        may move (a branch, tip, HEAD), the update can then go to it
+        without asking the remote."""
+        return False
+
+    def get_remote_head(self, uri, branch=None):
+        """Id of the last revision of uri (on branch), asked to the
+        remote without fetching anything.
+        Returns None if the fetcher cannot tell: the working copies are
+        then always updated."""
+        return None
+
+    def has_head(self, dest, head):
+        """Is the remote head (see get_remote_head) in the working copy at
+        dest."""
+        return False
+
+    def ssh_command(self, command):
+        """The scm command line, made to use the shared ssh connections
+        (see minitage.core.fetchers.ssh) by the fetchers which can."""
+        return command
+
+    def get_mirror(self, uri, verbose=False, create=True):
+        """Path of the refreshed local mirror of uri, None if there is
+        none.
+        Arguments
+            - create: make the mirror if it does not exist yet
+        """
+        if self.mirrors is None:
+            return None
+        return self.mirrors.mirror(self, uri, verbose, create)
+
     def archive_previous_co(self, dest):
         """
         Return True if archived
@@ -420,4 +479,16 @@ class IFetcher(interfaces.IProduct):
         """Test if the switch match the module."""
         raise NotImplementedError('The method is not implemented')
 
+    def create_mirror(self, path, uri, verbose=False):
+        """
+        Make a bare mirror of uri in path.
+        """
+        raise NotImplementedError('The method is not implemented')
+
+    def update_mirror(self, path, uri, verbose=False):
+        """
+        Get the new changes of uri in its mirror at path.
+        """
+        raise NotImplementedError('The method is not implemented')
+
 # vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,110 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import re
+import fcntl
+import shutil
+import logging
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+__logger__ = 'minitage.fetchers.mirrors'
+
+""" where the mirrors are by default, relative to the prefix"""
+DEFAULT_MIRRORS = os.path.join('.minitage', 'mirrors')
+_mirrors = {}
+
+
+def get_mirrors(config=None):
+    """Return the MirrorStore of a fetcher configuration:
+    [minimerge] mirrors, <prefix>/.minitage/mirrors by default.
+    Returns None if mirrors is 'none' or if there is no prefix."""
+    mconfig = (config or {}).get('minimerge', {})
+    path = (mconfig.get('mirrors', None) or '').strip()
+    if not path:
+        prefix = (mconfig.get('prefix', None) or '').strip()
+        if not prefix:
+            return None
+        path = os.path.join(prefix, DEFAULT_MIRRORS)
+    if path.lower() == 'none':
+        return None
+    path = os.path.abspath(os.path.expanduser(path))
+    if not path in _mirrors:
+        _mirrors[path] = MirrorStore(path)
+    return _mirrors[path]
+
+
+class MirrorStore(object):
+    """Bare mirrors of the repositories the git and mercurial fetchers
+    check out, in <mirrors>/<scm>/<name>-<hash of the url>.
+    A mirror is made by the first checkout of its url, working copies are
+    then cloned against it (git clone --reference, hg clone of the
+    mirror): a new checkout only gets from the network what the mirror
+    misses. A mirror is refreshed once per process, the working copies
+    of all the prefixes configured with the same mirrors share that
+    fetch.
+    Mirrors are locked while they are made or refreshed.
+    Example::
+        >>> mirrors = get_mirrors({'minimerge': {'prefix': '/minitage'}})
+        >>> mirrors.mirror(GitFetcher(), 'http://host/repo.git')
+        '/minitage/.minitage/mirrors/git/repo.git-0c1d5e8c5a9b'
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.refreshed = set()
+        self.log = logging.getLogger(__logger__)
+
+    def get_path(self, scm, uri):
+        name = re.sub('[^A-Za-z0-9._-]', '_',
+                      uri.rstrip('/').split('/')[-1]) or scm
+        return os.path.join(self.path, scm, '%s-%s' % (
+            name, md5(uri).hexdigest()[:12]))
+
+    def mirror(self, fetcher, uri, verbose=False, create=True):
+        """Make or refresh the mirror of uri with fetcher (its
+        create_mirror and update_mirror methods).
+        Arguments
+            - create: make the mirror if it does not exist yet
+        Returns
+            - the mirror path, None if there is no usable mirror
+        """
+        path = self.get_path(fetcher.executable, uri)
+        if path in self.refreshed:
+            return path
+        if not (create or os.path.isdir(path)):
+            return None
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            lock = open('%s.lock' % path, 'w')
+        except (IOError, OSError), e:
+            self.log.warning('Cannot mirror %s: %s' % (uri, e))
+            return None
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            tmp = '%s.tmp-%s' % (path, os.getpid())
+            try:
+                if os.path.isdir(path):
+                    self.log.debug('Refreshing the mirror %s.' % path)
+                    fetcher.update_mirror(path, uri, verbose)
+                else:
+                    self.log.info('Mirroring %s in %s.' % (uri, path))
+                    fetcher.create_mirror(tmp, uri, verbose)
+                    os.rename(tmp, path)
+            except Exception, e:
+                self.log.warning('Cannot mirror %s: %s' % (uri, e))
+                if os.path.isdir(tmp):
+                    shutil.rmtree(tmp)
+                if not os.path.isdir(path):
+                    return None
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+        self.refreshed.add(path)
+        return path
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -1,15 +1,24 @@
 __docformat__ = 'restructuredtext en'
 
 import os
-import subprocess
 import re
 import datetime
 import logging
 from distutils.dir_util import copy_tree
 
+from minitage.core import runner
 from minitage.core.fetchers import interfaces
+from minitage.core.fetchers import uris
 
 __logger__ = 'minitage.fetchers.scm'
+""" commits a shallow git working copy is deepened by, in turn, to find a
+revision before getting all the history"""
+GIT_DEEPEN = (50, 500)
+""" src_depth values subversion knows"""
+SVN_DEPTHS = ('empty', 'files', 'immediates', 'infinity')
+""" full git and mercurial commit ids, the revisions which do not move:
+abbreviated ones may be branch or tag names too"""
+COMMIT_ID_RE = re.compile('^[0-9a-fA-F]{40}$')
 
 class OfflineModeRestrictionError(interfaces.IFetcherError):
     """Restriction error in offline mode."""
@@ -31,7 +40,35 @@ class HgFetcher(interfaces.IFetcher):
         args = opts.get('args', '')
         if not verbose:
             args += ' -q '
-        self._scm_cmd('clone %s %s %s' % (args, uri, dest), verbose)
+        mirror = self.get_mirror(uri, verbose)
+        if mirror:
+            # hardlinked to the mirror store, but a clone of its own which
+            # outlives the mirror, pulling from the real remote
+            self._scm_cmd('clone %s %s %s' % (args, mirror, dest), verbose)
+            hgrc = open(os.path.join(dest, '.hg', 'hgrc'), 'w')
+            hgrc.write('[paths]\ndefault = %s\n' % uri)
+            hgrc.close()
+        else:
+            self._scm_cmd('clone %s %s %s' % (args, uri, dest), verbose)
+
+    def create_mirror(self, path, uri, verbose=True):
+        args = ''
+        if not verbose:
+            args += ' -q '
+        self._scm_cmd('clone -U %s %s %s' % (args, uri, path), verbose)
+
+    def ssh_command(self, command):
+        if self.ssh is None:
+            return command
+        return '%s --config ui.ssh=%s%s' % (
+            self.executable, self.ssh.get_wrapper(),
+            command[len(self.executable):])
+
+    def update_mirror(self, path, uri, verbose=True):
+        args = ''
+        if not verbose:
+            args += ' -q '
+        self._scm_cmd('pull %s -R %s %s' % (args, path, uri), verbose)
 
     def update_wc(self, dest, uri, opts, verbose=True):
         if not uri:
@@ -50,6 +87,32 @@ class HgFetcher(interfaces.IFetcher):
             args += '-C -r%s' % opts['revision']
         self._scm_cmd('up %s -R %s' % (args, dest), verbose)
 
+    def has_revision(self, dest, revision):
+        if not COMMIT_ID_RE.match(revision):
+            return False
+        try:
+            out = self._scm_cmd('-R %s log -r %s --template x' % (
+                dest, revision), output=True)
+        except interfaces.FetcherRuntimeError:
+            return False
+        return out.startswith('x')
+
+    def get_remote_head(self, uri, branch=None):
+        out = self._scm_cmd('identify --id -r %s %s' % (
+            branch or 'default', uri), output=True,
+            timeout=self.remote_timeout).strip()
+        return out and out.split()[0] or None
+
+    def has_head(self, dest, head):
+        try:
+            out = self._scm_cmd(
+                '-R %s log -r "%s and ancestors(.)" --template x' % (
+                    dest, head), output=True)
+        except interfaces.FetcherRuntimeError:
+            # unknown revision
+            return False
+        return out.startswith('x')
+
     def is_valid_src_uri(self, uri):
         """See interface."""
         match = interfaces.URI_REGEX.match(uri)
@@ -67,35 +130,32 @@ class HgFetcher(interfaces.IFetcher):
 
     def get_uri(self, dest):
         """get Mercurial url"""
+        uri = uris.read_uri(os.path.join(dest, '.hg', 'hgrc'),
+                            uris.parse_hgrc)
+        if uri is not None:
+            return uri
         self._check_scm_presence()
+        self.log.debug('Running %s %s in %s' % (
+            self.executable,
+            'showconfig |grep paths.default',
+            dest
+        ))
         try:
-            cwd = os.getcwd()
-            os.chdir(dest)
-            self.log.debug('Running %s %s in %s' % (
-                self.executable,
-                'showconfig |grep paths.default',
-                dest
-            ))
-            process = subprocess.Popen(
+            result = runner.run(
                 '%s %s' % (
                     self.executable,
                     'showconfig |grep paths.default'
                 ),
-                shell = True, stdout=subprocess.PIPE
+                capture=True, cwd=dest, env=self.get_env()
             )
-            ret = process.wait()
-            if ret != 0:
-                message = '%s failed to achieve correctly.' % self.name
-                raise interfaces.FetcherRuntimeError(message)
-            dest_uri = re.sub('([^=]*=)\s*(.*)',
-                          '\\2',
-                          process.stdout.read().strip()
-                         )
-            os.chdir(cwd)
-            return dest_uri
-        except Exception, instance:
-            os.chdir(cwd)
-            raise instance
+        except runner.CommandError, e:
+            message = '%s failed to achieve correctly.' % self.name
+            raise interfaces.FetcherRuntimeError(message)
+        dest_uri = re.sub('([^=]*=)\s*(.*)',
+                      '\\2',
+                      result.stdout.strip()
+                     )
+        return dest_uri
 
     def _has_uri_changed(self, dest, uri):
         """See interface."""
@@ -132,7 +192,21 @@ class SvnFetcher(interfaces.IFetcher):
         args = '%s %s' % (args, opts.get('goto-revision-args', ''))
         if 'revision' in opts:
             args += '-r %s' % opts['revision']
+        depth = opts.get('depth', None)
+        sparse = opts.get('sparse', None)
+        if sparse and not depth in SVN_DEPTHS:
+            depth = 'empty'
+        if depth in SVN_DEPTHS:
+            args += ' --depth %s ' % depth
+        elif depth:
+            self.log.warning('Ignoring the src_depth %s, subversion depths '
+                             'are: %s' % (depth, ', '.join(SVN_DEPTHS)))
         self._scm_cmd('co %s %s %s' % (args, uri, dest), verbose=True)
+        # sparse directories are fully checked out
+        for path in sparse or []:
+            self._scm_cmd('up %s --parents --set-depth infinity %s' % (
+                verbose and ' ' or ' -q ', os.path.join(dest, path)),
+                verbose)
 
     def update_wc(self, dest, uri, opts, verbose=True):
         args = opts.get('args', '')
@@ -147,6 +221,24 @@ class SvnFetcher(interfaces.IFetcher):
         if not passive:
             self.update_wc(dest, uri, opts, verbose)
 
+    def ssh_command(self, command):
+        if self.ssh is None or self.get_env().get('SVN_SSH', None):
+            return command
+        return 'SVN_SSH=%s %s' % (self.ssh.get_wrapper(), command)
+
+    def get_remote_head(self, uri, branch=None):
+        # the revision of the repository moves with any commit in it, the
+        # last changed revision only with the commits under uri
+        out = self._scm_cmd('info --show-item last-changed-revision %s' % (
+            uri), output=True, timeout=self.remote_timeout).strip()
+        return out and out.split()[0] or None
+
+    def has_head(self, dest, head):
+        local = self.get_remote_head(dest)
+        return (local is not None
+                and local.isdigit() and head.isdigit()
+                and int(local) >= int(head))
+
     def is_valid_src_uri(self, uri):
         """See interface."""
         match = interfaces.URI_REGEX.match(uri)
@@ -165,20 +257,20 @@ class SvnFetcher(interfaces.IFetcher):
     def get_uri(self, dest):
         """Get url."""
         self._check_scm_presence()
-        process = subprocess.Popen(
-            '%s %s' % (
-                self.executable,
-                'info %s|grep -i url' % dest
-            ),
-            shell = True, stdout=subprocess.PIPE
-        )
-        ret = process.wait()
-        # we werent svn
-        if ret != 0:
+        try:
+            result = runner.run(
+                '%s %s' % (
+                    self.executable,
+                    'info %s|grep -i url' % dest
+                ),
+                capture=True, env=self.get_env()
+            )
+        except runner.CommandError, e:
+            # we werent svn
             return None
         return re.sub(
             '([^:]*:)\s*(.*)', '\\2',
-            process.stdout.read().strip()
+            result.stdout.strip()
         )
 
     def _has_uri_changed(self, dest, uri):
@@ -227,6 +319,14 @@ class BzrFetcher(interfaces.IFetcher):
                 args, uri, dest), verbose
             )
 
+    def get_remote_head(self, uri, branch=None):
+        out = self._scm_cmd('revno %s' % uri, output=True,
+                            timeout=self.remote_timeout).strip()
+        return out and out.split()[0] or None
+
+    def has_head(self, dest, head):
+        return self.get_remote_head(dest) == head
+
     def is_valid_src_uri(self, uri):
         """See interface."""
         match = interfaces.URI_REGEX.match(uri)
@@ -248,39 +348,36 @@ class BzrFetcher(interfaces.IFetcher):
 
     def get_uri(self, dest):
         """get bazaar url"""
+        uri = uris.read_uri(os.path.join(dest, '.bzr', 'branch', 'branch.conf'),
+                            uris.parse_bzr_branch_conf)
+        if uri is not None:
+            return uri
         self._check_scm_presence()
+        self.log.debug('Running %s %s in %s' % (
+            self.executable,
+            ' info 2>&1|egrep "(checkout of branch|parent branch)"|cut -d:  -f 2,3',
+            dest
+        ))
         try:
-            cwd = os.getcwd()
-            os.chdir(dest)
-            self.log.debug('Running %s %s in %s' % (
-                self.executable,
-                ' info 2>&1|egrep "(checkout of branch|parent branch)"|cut -d:  -f 2,3',
-                dest
-            ))
-            process = subprocess.Popen(
+            result = runner.run(
                 '%s %s' % (
                     self.executable,
                     ' info 2>&1|egrep "(checkout of branch|parent branch)"|cut -d:  -f 2,3',
                 ),
-                shell = True, stdout=subprocess.PIPE
-            )
-            ret = process.wait()
-            if ret != 0:
-                message = '%s failed to achieve correctly.' % self.name
-                raise interfaces.FetcherRuntimeError(message)
-            dest_uri = re.sub(
-                '([^=]*=)\s*(.*)',
-                '\\2',
-                process.stdout.read().strip()
+                capture=True, cwd=dest, env=self.get_env()
             )
-            if '\n' in dest_uri:
-                # return 'checkout branch'
-                dest_uri = dest_uri.split('\n')[0]
-            os.chdir(cwd)
-            return dest_uri
-        except Exception, instance:
-            os.chdir(cwd)
-            raise instance
+        except runner.CommandError, e:
+            message = '%s failed to achieve correctly.' % self.name
+            raise interfaces.FetcherRuntimeError(message)
+        dest_uri = re.sub(
+            '([^=]*=)\s*(.*)',
+            '\\2',
+            result.stdout.strip()
+        )
+        if '\n' in dest_uri:
+            # return 'checkout branch'
+            dest_uri = dest_uri.split('\n')[0]
+        return dest_uri
 
     def _has_uri_changed(self, dest, uri):
         """See interface."""
@@ -313,74 +410,177 @@ class GitFetcher(interfaces.IFetcher):
         args = opts.get('args', '')
         if not verbose:
             args += ' -q '
+        mirror = self.get_mirror(uri, verbose)
+        if mirror:
+            # objects are copied from the mirror: borrowing them would
+            # corrupt the working copy once the mirror drops them (force
+            # push then gc)
+            args += ' --reference %s --dissociate ' % mirror
+        if opts.get('depth', None):
+            # keep the other branches reachable for switch_branch
+            args += ' --depth %s --no-single-branch ' % opts['depth']
+        if opts.get('filter', None):
+            args += ' --filter=%s ' % opts['filter']
+        sparse = opts.get('sparse', None)
+        if sparse:
+            args += ' --sparse '
         self._scm_cmd('clone  %s %s %s' % (args, uri, dest), verbose)
+        if sparse:
+            self._scm_cmd('sparse-checkout set %s' % ' '.join(sparse),
+                          verbose, cwd=dest)
 
-    def get_branch(self, dest, verbose=True):
+    def is_shallow(self, dest):
+        return os.path.exists(os.path.join(dest, '.git', 'shallow'))
+
+    def has_commit(self, dest, revision):
+        """Is revision in the working copy history."""
+        try:
+            self._scm_cmd('rev-parse -q --verify \'%s^{commit}\'' % (
+                revision), output=True, cwd=dest)
+            return True
+        except interfaces.FetcherRuntimeError:
+            return False
+
+    def deepen(self, dest, revision, verbose=True):
+        """Get the history of a shallow working copy until revision is
+        in it, a bit more each time, then all of it."""
+        if not self.is_shallow(dest) or self.has_commit(dest, revision):
+            return
         args = ''
         if not verbose:
             args += ' -q '
-        cwd = os.getcwd()
-        branch = None
+        for depth in GIT_DEEPEN:
+            self.log.info('%s is not in the shallow history of %s, '
+                          'deepening it by %s.' % (revision, dest, depth))
+            self._scm_cmd('fetch %s --deepen=%s' % (args, depth), verbose,
+                          cwd=dest)
+            if self.has_commit(dest, revision):
+                return
+        self._scm_cmd('fetch %s --unshallow' % args, verbose, cwd=dest)
+
+    def create_mirror(self, path, uri, verbose=True):
+        args = ''
+        if not verbose:
+            args += ' -q '
+        self._scm_cmd('clone --mirror %s %s %s' % (args, uri, path), verbose)
+
+    def has_revision(self, dest, revision):
+        if not COMMIT_ID_RE.match(revision):
+            return False
         try:
-            try:
-                os.chdir(dest)
-                ret = self._scm_cmd('branch %s' % (args,),
-                                    verbose=verbose, output=True)
-                branch = [a.split()[1]
-                          for a in ret.splitlines()
-                          if a.startswith('*')][0]
-            except Exception, e:
-                raise e
-        finally:
-            os.chdir(cwd)
+            self._scm_cmd('--git-dir=%s cat-file -e \'%s^{commit}\'' % (
+                os.path.join(dest, '.git'), revision), output=True)
+            return True
+        except interfaces.FetcherRuntimeError:
+            return False
+
+    def get_remote_head(self, uri, branch=None):
+        ref = branch and 'refs/heads/%s' % branch or 'HEAD'
+        out = self._scm_cmd('ls-remote %s %s' % (uri, ref), output=True,
+                            timeout=self.remote_timeout)
+        for line in out.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+        return None
+
+    def has_head(self, dest, head):
+        try:
+            self._scm_cmd('--git-dir=%s merge-base --is-ancestor %s HEAD' % (
+                os.path.join(dest, '.git'), head), output=True)
+            return True
+        except interfaces.FetcherRuntimeError:
+            # not merged or not there at all
+            return False
+
+    def update_mirror(self, path, uri, verbose=True):
+        args = ''
+        if not verbose:
+            args += ' -q '
+        self._scm_cmd('--git-dir=%s fetch %s' % (path, args), verbose)
+
+    def ssh_command(self, command):
+        if self.ssh is None:
+            return command
+        env = self.get_env()
+        if env.get('GIT_SSH_COMMAND', None) or env.get('GIT_SSH', None):
+            return command
+        return 'GIT_SSH_COMMAND=%s %s' % (self.ssh.get_wrapper(), command)
+
+    def get_branch(self, dest, verbose=True):
+        args = ''
+        if not verbose:
+            args += ' -q '
+        ret = self._scm_cmd('branch %s' % (args,),
+                            verbose=verbose, output=True, cwd=dest)
+        branch = [a.split()[1]
+                  for a in ret.splitlines()
+                  if a.startswith('*')][0]
         return branch
 
     def switch_branch(self, dest, branch, verbose=True):
         args = ''
         if not verbose:
             args += ' -q '
-        cwd = os.getcwd()
-        try:
-            try:
-                os.chdir(dest)
-                self._scm_cmd(
-                    'checkout -f --track %s remotes/origin/%s' % (
-                        args, branch))
-            except Exception, e:
-                raise e
-        finally:
-            os.chdir(cwd)
+        if (self.is_shallow(dest)
+            and not self.has_commit(dest, 'origin/%s' % branch)):
+            # a single branch shallow clone
+            self._scm_cmd(
+                'fetch %s --depth 1 origin '
+                '+refs/heads/%s:refs/remotes/origin/%s' % (
+                    args, branch, branch), verbose, cwd=dest)
+        self._scm_cmd(
+            'checkout -f --track %s remotes/origin/%s' % (
+                args, branch), cwd=dest)
 
 
     def update_wc(self, dest, uri, opts, verbose=True):
         args = opts.get('args', '')
         if not verbose:
             args += ' -q '
-        cwd = os.getcwd()
-        os.chdir(dest)
+        self.dissociate(dest, verbose)
+        mirror = None
+        if opts.get('refresh_mirror', True):
+            mirror = self.get_mirror(uri or self.get_uri(dest), verbose,
+                                     create=False)
+        if mirror:
+            # the pull then only gets what the mirror does not have
+            try:
+                self._scm_cmd(
+                    'fetch %s %s \'+refs/heads/*:refs/remotes/origin/*\'' % (
+                        args, mirror), verbose, cwd=dest)
+            except interfaces.FetcherRuntimeError:
+                pass
         if not uri or (not self._has_uri_changed(dest, uri)):
             uri = ''
         try:
-            self._scm_cmd('pull %s %s' % (args, uri), verbose)
+            self._scm_cmd('pull %s %s' % (args, uri), verbose, cwd=dest)
         except Exception, e:
-            os.chdir(cwd)
-        os.chdir(cwd)
+            pass
+
+    def dissociate(self, dest, verbose=True):
+        """Copy in the working copy the objects it borrows from a mirror
+        (cloned with --reference by older minitage versions)."""
+        alternates = os.path.join(dest, '.git', 'objects', 'info',
+                                  'alternates')
+        if os.path.exists(alternates):
+            self._scm_cmd('repack -a -d -q', verbose, cwd=dest)
+            os.remove(alternates)
 
     def goto_revision(self, dest, uri, opts, verbose=True):
         args = opts.get('goto-revision-args', '')
         if not verbose:
             args += ' -q '
         if 'revision' in opts:
-            cwd = os.getcwd()
-            os.chdir(dest)
+            self.deepen(dest, opts['revision'], verbose)
             self._scm_cmd(
                 'reset %s --hard %s' % (
                     args,
                     opts['revision'],
                 ),
-                verbose
+                verbose,
+                cwd=dest
             )
-            os.chdir(cwd)
 
     def is_valid_src_uri(self, uri):
         """See interface."""
@@ -402,27 +602,28 @@ class GitFetcher(interfaces.IFetcher):
 
     def get_uri(self, dest):
         """get git url"""
+        uri = uris.read_uri(os.path.join(dest, '.git', 'config'),
+                            uris.parse_git_config)
+        if uri is not None:
+            return uri
         self._check_scm_presence()
+        self.log.debug('Running %s %s in %s' % (
+            self.executable,
+            'config --get remote.origin.url',
+            dest
+        ))
         try:
-            cwd = os.getcwd()
-            os.chdir(dest)
-            self.log.debug('Running %s %s in %s' % (
-                self.executable,
-                'config --get remote.origin.url',
-                dest
-            ))
-            process = subprocess.Popen('%s config --get remote.origin.url' % self.executable,
-                                       shell = True, stdout=subprocess.PIPE)
-            ret = process.wait()
-            if ret >1 :
+            result = runner.run(
+                '%s config --get remote.origin.url' % self.executable,
+                capture=True, cwd=dest, env=self.get_env())
+        except runner.CommandError, e:
+            # 1: no url
+            if e.result.returncode > 1:
                 message = '%s failed to achieve correctly.' % self.name
                 raise interfaces.FetcherRuntimeError(message)
-            dest_uri = process.stdout.read().strip()
-            os.chdir(cwd)
-            return dest_uri
-        except Exception, instance:
-            os.chdir(cwd)
-            raise instance
+            result = e.result
+        dest_uri = result.stdout.strip()
+        return dest_uri
 
     def _has_uri_changed(self, dest, uri):
         """See interface."""
@@ -0,0 +1,126 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import atexit
+import shutil
+import logging
+import tempfile
+import subprocess
+
+__logger__ = 'minitage.fetchers.ssh'
+
+""" seconds the shared connections stay open once unused"""
+CONTROL_PERSIST = 600
+WRAPPER = """#!/bin/sh
+printf . >> '%(count)s'
+exec %(ssh)s -o ControlMaster=auto -o 'ControlPath=%(sockets)s/%%r@%%h:%%p' \\
+    -o ControlPersist=%(persist)s "$@"
+"""
+""" scm sub commands which never reach a remote"""
+LOCAL_COMMANDS = ('rev-parse', 'cat-file', 'config', 'log', 'merge-base',
+                  'branch', 'status', 'sparse-checkout')
+""" scm options taking a value as the next argument"""
+VALUE_OPTIONS = ('-R', '-C', '--cwd', '--config', '--repository')
+_multiplexers = {}
+
+
+def is_local(command):
+    """Is the scm command line one which does not need the network."""
+    args = command.split()[1:]
+    while args:
+        arg = args.pop(0)
+        if arg in VALUE_OPTIONS:
+            del args[:1]
+        elif not arg.startswith('-'):
+            return arg in LOCAL_COMMANDS
+    return False
+
+
+def get_multiplexer(config=None):
+    """Return the SSHMultiplexer of a fetcher configuration:
+    [minimerge] ssh, the ssh client (default to ssh).
+    Returns None unless [minimerge] ssh_multiplexing is true."""
+    mconfig = (config or {}).get('minimerge', {})
+    enabled = (mconfig.get('ssh_multiplexing', None) or 'false').strip()
+    if not enabled.lower() in ('true', 'yes', 'on', '1'):
+        return None
+    ssh = (mconfig.get('ssh', None) or 'ssh').strip()
+    if not ssh in _multiplexers:
+        _multiplexers[ssh] = SSHMultiplexer(ssh)
+    return _multiplexers[ssh]
+
+
+class SSHMultiplexer(object):
+    """One ssh connection by host for all the scm commands of the run.
+    The scms are given a wrapper (GIT_SSH_COMMAND, SVN_SSH, hg ui.ssh)
+    which runs ssh with a ControlMaster socket by user, host and port in a
+    temporary directory: the first command to reach a host does the
+    handshake, the others go through its connection. The wrapper must be
+    made (get_wrapper) before forking the workers so that they all share
+    it, and closed by the process which made it: minimerge does both
+    around its run, atexit is only a last resort as the forked workers
+    leave with os._exit.
+    Example::
+        >>> mux = get_multiplexer({'minimerge': {'ssh_multiplexing': 'true'}})
+        >>> mux.get_wrapper()
+        '/tmp/minitage-ssh-XXXXXX/ssh'
+    """
+
+    def __init__(self, ssh='ssh', persist=CONTROL_PERSIST):
+        self.ssh = ssh
+        self.persist = persist
+        self.path = None
+        self.pid = None
+        self.log = logging.getLogger(__logger__)
+
+    def get_wrapper(self):
+        """Path of the ssh wrapper, made on the first call."""
+        if self.path is None:
+            self.path = tempfile.mkdtemp(prefix='minitage-ssh-')
+            self.pid = os.getpid()
+            os.mkdir(os.path.join(self.path, 'sockets'))
+            wrapper = os.path.join(self.path, 'ssh')
+            open(wrapper, 'w').write(WRAPPER % {
+                'count': os.path.join(self.path, 'connections'),
+                'ssh': self.ssh,
+                'sockets': os.path.join(self.path, 'sockets'),
+                'persist': self.persist})
+            os.chmod(wrapper, 0700)
+            atexit.register(self.close)
+        return os.path.join(self.path, 'ssh')
+
+    def get_stats(self):
+        """(connections, [user@host:port of the handshakes])"""
+        if self.path is None:
+            return 0, []
+        connections = 0
+        # the wrapper writes a byte by connection
+        count = os.path.join(self.path, 'connections')
+        if os.path.exists(count):
+            connections = os.path.getsize(count)
+        return connections, sorted(
+            os.listdir(os.path.join(self.path, 'sockets')))
+
+    def close(self):
+        """Close the shared connections, in the process which made them
+        (not in the forked fetchers)."""
+        if self.path is None or self.pid != os.getpid():
+            return
+        connections, masters = self.get_stats()
+        if connections:
+            self.log.debug('%s ssh connections, %s handshakes (%s).' % (
+                connections, len(masters), ', '.join(masters)))
+        for master in masters:
+            socket = os.path.join(self.path, 'sockets', master)
+            devnull = open(os.devnull, 'w')
+            try:
+                subprocess.call(
+                    '%s -o \'ControlPath=%s\' -O exit %s' % (
+                        self.ssh, socket, master.split(':')[0]),
+                    shell=True, stdout=devnull, stderr=devnull)
+            finally:
+                devnull.close()
+        shutil.rmtree(self.path, True)
+        self.path = None
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -10,10 +10,10 @@ from distutils.dir_util import copy_tree
 
 from minitage.core.fetchers import interfaces
 from minitage.core.unpackers.interfaces import IUnpackerFactory
+from minitage.core.store import get_store
+from minitage.core.httpclient import get_pool
 import minitage.core.common
 
-from StringIO import StringIO
-
 class StaticFetchError(interfaces.IFetcherError):
     """StaticFetchError."""
 
@@ -25,6 +25,12 @@ class StaticFetcher(interfaces.IFetcher):
     http_proxy = http://yourproxy:3128
     https_proxy = http://yourproxy:3128
     ftp_proxy = http://yourproxy:3128
+    Downloads are shared with the other packages and prefixes through
+    a DownloadStore, ~/.minitage/store by default:
+    [minimerge]
+    download_store = /path/to/store (or none)
+    HTTP(S) connections are kept alive and reused by all the fetches of
+    the process, see minitage.core.httpclient.
     Example::
         >>> import minitage.core.fetchers.scm
         >>> http = scm.StaticFetcher()
@@ -38,6 +44,9 @@ class StaticFetcher(interfaces.IFetcher):
 
         self.logger = logging.getLogger('minitage.static.fetcher')
         interfaces.IFetcher.__init__(self, 'static', config = config)
+        self.store = get_store(
+            self.config.get('minimerge', {}).get('download_store', None))
+        self.pool = get_pool(self.config.get('minimerge', {}))
 
     def update(self, dest, uri, opts=None, verbose=True):
         """Update a package.
@@ -86,12 +95,12 @@ class StaticFetcher(interfaces.IFetcher):
             tries = 10 # 10 retries
             while tries:
                 try:
-                    downloaded_bits = ''
+                    downloaded = None
                     # if we have not specified the md5, try to get one
                     try:
                         if github:
                             time.sleep(1)
-                        (downloaded_bits, md5,
+                        (downloaded, md5,
                          github, uri, filepath, newer) = (
                              self.md5part(
                                  md5, github,
@@ -135,9 +144,9 @@ class StaticFetcher(interfaces.IFetcher):
                     if github:
                         time.sleep(1)
                     (new_md5,
-                     downloaded_bits) = self.download_part(
+                     downloaded) = self.download_part(
                          newer, verbose,
-                         downloaded_bits, filepath, uri, md5path)
+                         downloaded, filepath, uri, md5path, md5)
                     tries = 0
                 except Exception, e:
                     message = 'Can\'t download file \'%s\' ' % filename
@@ -198,57 +207,72 @@ class StaticFetcher(interfaces.IFetcher):
         pass
 
     def md5part(self, md5, github, uri, filepath, newer):
-        downloaded_bits = None
+        """Get the md5 of uri if we do not have it and see if filepath
+        is to be downloaded again.
+        There is no md5 file on github, the archive is downloaded to
+        compute it.
+        Returns
+            - (md5 of the download or None, md5, github, uri, filepath,
+              newer)
+        """
+        downloaded = None
         if not md5:
             md5 = None
+            previous_md5 = None
+            if os.path.exists(filepath):
+                previous_md5 = minitage.core.common.md5sum(filepath)
             if github:
-                resp = minitage.core.common.urlopen(uri)
-                time.sleep(2) 
-                length = resp.headers.getheader('content-length')
-                downloaded_bits = resp.read()
-                if length: length = int(length)
-                if length != len(downloaded_bits):
-                    raise Exception('Download incomplete, please '
-                                    'retry launching minimerge or '
-                                    'bugreport!')
-                md5 = minitage.core.common.md5sum(StringIO(downloaded_bits))
+                # streamed to disk, the md5 is computed on the way
+                downloaded = md5 = minitage.core.common.download(
+                    uri, filepath, logger=self.logger, pool=self.pool)
+                time.sleep(2)
             else:
-                resp = minitage.core.common.urlopen("%s.md5" % uri)
-                md5 = resp.read()
+                resp = minitage.core.common.urlopen("%s.md5" % uri,
+                                                     pool=self.pool)
+                # md5sum output format is also accepted
+                md5 = (resp.read().split() or [None])[0]
 
             # maybe mark the file as already there
-            if os.path.exists(filepath):
+            if previous_md5 is not None:
                 self.logger.warning('File %s is already downloaded' % filepath)
-                if minitage.core.common.test_md5(filepath, md5):
+                if previous_md5 == md5:
                     self.logger.debug('MD5 has not changed, download is aborted.')
                     newer = False
                 else:
                     self.logger.debug(
                         'Its md5 has changed: %s != %s, redownloading' % (
-                            minitage.core.common.md5sum(filepath), md5
+                            previous_md5, md5
                         )
                     )
-        return (downloaded_bits, md5,
+        return (downloaded, md5,
                 github, uri, filepath, newer)
 
-    def download_part(self, newer, verbose, downloaded_bits, filepath, uri, md5path):
+    def download_part(self, newer, verbose, downloaded, filepath, uri,
+                      md5path, md5=None):
+        """Download uri to filepath if newer, unless it is already
+        downloaded, and write its md5 in md5path.
+        The download must match md5 if it is given.
+        """
         new_md5 = None
         if newer:
-            if verbose:
+            if (not downloaded and md5 and self.store is not None
+                and self.store.link(md5, filepath)):
+                self.logger.info('Using %s from the download store.' % (
+                    filepath))
+                new_md5 = md5
+            elif verbose:
                 self.logger.info('Downloading %s from %s.' % (filepath, uri))
-            if not downloaded_bits:
-                downloaded_bits = minitage.core.common.urlopen(uri).read()
-            # save the downloaded file
-            filep = open(filepath, 'wb')
-            filep.write(downloaded_bits)
-            filep.flush()
-            filep.close()
-            new_md5 = minitage.core.common.md5sum(filepath)
+            new_md5 = new_md5 or downloaded
+            if not new_md5:
+                new_md5 = minitage.core.common.download(
+                    uri, filepath, md5, logger=self.logger, pool=self.pool)
+            if self.store is not None:
+                self.store.add(filepath, new_md5)
             # regenerate the md5 file
             md5p = open(md5path, 'wb')
             md5p.write(new_md5)
             md5p.flush()
             md5p.close()
-        return (new_md5, downloaded_bits)
+        return (new_md5, downloaded)
 
 # vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,147 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import re
+import urllib
+
+""" urls read from the working copies metadata files,
+{file: ((mtime, size), url)}"""
+_uris = {}
+GIT_SECTION_RE = re.compile(
+    r'^\[\s*([^\s\]"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+INI_SECTION_RE = re.compile(r'^\[([^\]]+)\]')
+
+
+def read_uri(path, parser):
+    """Url read by parser in the metadata file at path, cached as long as
+    the file does not change.
+    Returns
+        - the url, None if the file does not exist or if the parser
+          cannot tell (the scm command has to be asked then)
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (st.st_mtime, st.st_size)
+    cached = _uris.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        uri = parser(path)
+    except (IOError, ValueError):
+        uri = None
+    if uri is not None:
+        _uris[path] = (stamp, uri)
+    return uri
+
+
+def _git_value(value):
+    """Unquote a git config value and strip its comment."""
+    chars, quoted, i = [], False, 0
+    value = value.strip()
+    while i < len(value):
+        c = value[i]
+        if c == '"':
+            quoted = not quoted
+        elif c == '\\' and i + 1 < len(value):
+            i += 1
+            chars.append({'n': '\n', 't': '\t', 'b': '\b'}.get(
+                value[i], value[i]))
+        elif c in '#;' and not quoted:
+            break
+        else:
+            chars.append(c)
+        i += 1
+    return ''.join(chars).strip()
+
+
+def parse_git_config(path):
+    """remote.origin.url of a .git/config like git config --get gives it,
+    '' if there is none, None if the configuration includes other files.
+    """
+    section, url = None, ''
+    for line in open(path).read().splitlines():
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        match = GIT_SECTION_RE.match(line)
+        if match:
+            name, subsection = match.groups()
+            if subsection is None and '.' in name:
+                # old [remote.origin] syntax
+                name, subsection = name.split('.', 1)
+                subsection = subsection.lower()
+            section = (name.lower(), subsection)
+            if section[0] in ('include', 'includeif'):
+                return None
+            continue
+        if section == ('remote', 'origin'):
+            key, value = (line.split('=', 1) + [''])[:2]
+            if key.strip().lower() == 'url':
+                # the last one wins
+                url = _git_value(value)
+    return url
+
+
+def parse_ini(path):
+    """{section: {key: value}} of a mercurial or bazaar configuration
+    file, the keys before any section are in the '' section.
+    Returns None if the file includes other files."""
+    sections, section, key = {'': {}}, '', None
+    for line in open(path).read().splitlines():
+        if not line.strip() or line.strip()[0] in '#;':
+            continue
+        if line.startswith('%'):
+            # %include, %unset
+            return None
+        if line[0] in ' \t':
+            if key is not None:
+                # continuation line
+                sections[section][key] += '\n%s' % line.strip()
+            continue
+        match = INI_SECTION_RE.match(line)
+        if match:
+            section, key = match.group(1).strip(), None
+            sections.setdefault(section, {})
+            continue
+        if '=' in line:
+            key, value = [p.strip() for p in line.split('=', 1)]
+            sections[section][key] = value
+    return sections
+
+
+def parse_hgrc(path):
+    """paths.default of a .hg/hgrc, None if it is not there (it may come
+    from the user configuration)."""
+    sections = parse_ini(path)
+    if sections is None:
+        return None
+    return sections.get('paths', {}).get('default', None)
+
+
+def _bzr_display(location):
+    """A bazaar location like bzr info shows it."""
+    if location.startswith('file://'):
+        location = urllib.unquote(location[len('file://'):])
+    if len(location) > 1:
+        location = location.rstrip('/')
+    return location
+
+
+def parse_bzr_branch_conf(path):
+    """The branch a bazaar checkout is bound to, or its parent branch, from
+    its .bzr/branch/branch.conf. None if there is none."""
+    sections = parse_ini(path)
+    if sections is None:
+        return None
+    conf = sections['']
+    location = None
+    if conf.get('bound', 'False').lower() == 'true':
+        location = conf.get('bound_location', None)
+    location = location or conf.get('parent_location', None)
+    if not location:
+        return None
+    return _bzr_display(location)
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,189 @@
+__docformat__ = 'restructuredtext en'
+
+import heapq
+
+
+class GraphError(Exception):
+    """General Graph Error."""
+
+
+class CycleError(GraphError):
+    """The graph is not acyclic.
+    Attributes:
+        - path: names of the nodes making the cycle, the first one is
+          repeated at the end.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        GraphError.__init__(self, ' -> '.join(path))
+
+
+class InvalidOrderError(GraphError):
+    """The sort order is unknown."""
+
+""" orders the graph can be sorted in:
+ - compat: depth first post order, dependencies are walked in the
+   order they are declared. That's the historical minimerge order.
+ - kahn: Kahn's algorithm, nodes are taken by discovery order as soon
+   as all their dependencies are sorted. Independent packages come first.
+"""
+ORDERS = ('compat', 'kahn')
+
+WHITE, GREY, BLACK = 0, 1, 2
+
+
+class DependencyGraph(object):
+    """Dependency graph over minibuilds.
+    Nodes are given integer ids in discovery order, dependencies are
+    stored as adjacency arrays of ids, in declaration order.
+    Example::
+        >>> graph = DependencyGraph(minimerge.find_minibuild)
+        >>> [mb.name for mb in graph.sort(['minibuild-3'])]
+        ['minibuild-0', 'minibuild-4', 'minibuild-1', 'minibuild-2', 'minibuild-3']
+    """
+
+    def __init__(self, resolve):
+        """
+        Arguments:
+            - resolve: callable returning the node (minibuild) for a name.
+              nodes must have a 'dependencies' list of names.
+        """
+        self.resolve = resolve
+        self.ids = {}
+        self.names = []
+        self.nodes = []
+        self.edges = []
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, names):
+        """Register nodes and everything they depend on.
+        If a name cannot be resolved, the nodes registered by the call
+        are forgotten and the error of resolve is raised.
+        Return:
+            - the ids of the given names
+        """
+        count = len(self.nodes)
+        try:
+            roots = [self._add(name) for name in names]
+            queue = roots[:]
+            while queue:
+                node = queue.pop()
+                if self.edges[node] is not None:
+                    continue
+                edges = []
+                for dependency in self.nodes[node].dependencies:
+                    known = dependency in self.ids
+                    dep = self._add(dependency)
+                    edges.append(dep)
+                    if not known:
+                        queue.append(dep)
+                self.edges[node] = edges
+        except:
+            for name in self.names[count:]:
+                del self.ids[name]
+            del self.names[count:]
+            del self.nodes[count:]
+            del self.edges[count:]
+            raise
+        return roots
+
+    def _add(self, name):
+        if not name in self.ids:
+            node = self.resolve(name)
+            self.ids[name] = len(self.nodes)
+            self.names.append(name)
+            self.nodes.append(node)
+            self.edges.append(None)
+        return self.ids[name]
+
+    def sort(self, names, order='compat'):
+        """Return the nodes needed by names, dependencies first.
+        Exceptions:
+            - CycleError if there are circular dependencies.
+            - InvalidOrderError
+        """
+        if not order in ORDERS:
+            raise InvalidOrderError(
+                'Invalid order \'%s\', valid ones are %s' % (
+                    order, ', '.join(ORDERS)))
+        roots = self.add(names)
+        ids = self._dfs(roots)
+        if order == 'kahn':
+            ids = self._kahn(ids)
+        return [self.nodes[node] for node in ids]
+
+    def _dfs(self, roots):
+        """Iterative depth first post order, raises CycleError."""
+        state = [WHITE] * len(self.nodes)
+        result = []
+        for root in roots:
+            if state[root] != WHITE:
+                continue
+            state[root] = GREY
+            path, iterators = [root], [iter(self.edges[root])]
+            while path:
+                for dep in iterators[-1]:
+                    if state[dep] == WHITE:
+                        state[dep] = GREY
+                        path.append(dep)
+                        iterators.append(iter(self.edges[dep]))
+                        break
+                    if state[dep] == GREY:
+                        cycle = path[path.index(dep):] + [dep]
+                        raise CycleError([self.names[n] for n in cycle])
+                else:
+                    node = path.pop()
+                    iterators.pop()
+                    state[node] = BLACK
+                    result.append(node)
+        return result
+
+    def _kahn(self, ids):
+        """Kahn's algorithm over the (acyclic) subgraph made of ids."""
+        selected = set(ids)
+        pending = {}
+        dependents = {}
+        for node in ids:
+            deps = set([d for d in self.edges[node] if d in selected])
+            pending[node] = len(deps)
+            for dep in deps:
+                dependents.setdefault(dep, []).append(node)
+        # smallest discovery id first
+        ready = [node for node in ids if not pending[node]]
+        heapq.heapify(ready)
+        result = []
+        while ready:
+            node = heapq.heappop(ready)
+            result.append(node)
+            for dependent in dependents.get(node, []):
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    heapq.heappush(ready, dependent)
+        return result
+
+    def reachable(self, name, stop):
+        """Names in stop reachable from name without walking through
+        any of them.
+        Arguments:
+            - name: node to start from
+            - stop: names (set) where the walk stops
+        """
+        root = self.add([name])[0]
+        seen = set([root])
+        stack = list(self.edges[root])
+        found = []
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            if self.names[node] in stop:
+                found.append(self.names[node])
+            else:
+                stack.extend(self.edges[node])
+        return found
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,254 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import base64
+import httplib
+import threading
+import urllib
+import urllib2
+import urlparse
+from StringIO import StringIO
+
+""" redirections followed before giving up"""
+MAX_REDIRECTS = 10
+REDIRECTS = (301, 302, 303, 307, 308)
+""" idle connections kept per host"""
+MAX_IDLE = 4
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(config=None):
+    """Return the connection pool for the proxies of a [minimerge]
+    configuration section, or of the environment if there is none there.
+    Pools are shared by the whole process."""
+    proxies = urllib.getproxies()
+    for key, value in (config or {}).items():
+        if key.endswith('_proxy') and value and value.strip():
+            proxies[key[:-len('_proxy')]] = value.strip()
+    key = tuple(sorted(proxies.items()))
+    _lock.acquire()
+    try:
+        if not key in _pools:
+            _pools[key] = HTTPPool(proxies)
+        return _pools[key]
+    finally:
+        _lock.release()
+
+
+def report():
+    """Connections opened and reused by all the pools."""
+    opened = sum([pool.opened for pool in _pools.values()])
+    reused = sum([pool.reused for pool in _pools.values()])
+    return 'HTTP connections: %s opened, %s reused.' % (opened, reused)
+
+
+class HTTPPool(object):
+    """Keep-alive HTTP(S) connections, by host.
+    Connections are reused for the next requests to the same host (or
+    proxy) once their response is read. Proxies are given at creation
+    time (scheme: proxy url) and used without touching os.environ,
+    https goes through CONNECT tunnels. Other schemes (file, ftp) are
+    opened with urllib2.
+    Connections are not shared with forked processes.
+    Example::
+        >>> pool = HTTPPool({'http': 'http://proxy:3128'})
+        >>> pool.open('http://distfiles/zlib.tgz.md5').read()
+        '...'
+        >>> pool.open('http://distfiles/zlib.tgz').read(10)
+        >>> pool.opened, pool.reused
+        (1, 1)
+    """
+
+    def __init__(self, proxies=None):
+        self.proxies = proxies or {}
+        self.idle = {}
+        self.opened = 0
+        self.reused = 0
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._opener = urllib2.build_opener(
+            urllib2.ProxyHandler(self.proxies))
+
+    def _proxy(self, scheme, host):
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.proxy_bypass(host):
+            return None, {}
+        if not '://' in proxy:
+            proxy = 'http://%s' % proxy
+        parts = urlparse.urlsplit(proxy)
+        headers = {}
+        if parts.username:
+            credentials = '%s:%s' % (urllib.unquote(parts.username),
+                                     urllib.unquote(parts.password or ''))
+            headers['Proxy-Authorization'] = 'Basic %s' % (
+                base64.b64encode(credentials))
+        return (parts.hostname, parts.port or 80), headers
+
+    def _connection(self, key):
+        """An idle connection for key, or a new one.
+        Returns
+            - (connection, reused)
+        """
+        self._lock.acquire()
+        try:
+            if self._pid != os.getpid():
+                # the parent process sockets
+                self.idle, self._pid = {}, os.getpid()
+            connections = self.idle.get(key)
+            if connections:
+                self.reused += 1
+                return connections.pop(), True
+            self.opened += 1
+        finally:
+            self._lock.release()
+        scheme, host, port, proxy, headers = key
+        if scheme == 'https':
+            if proxy:
+                connection = httplib.HTTPSConnection(*proxy)
+                connection.set_tunnel(host, port, dict(headers))
+            else:
+                connection = httplib.HTTPSConnection(host, port)
+        else:
+            connection = httplib.HTTPConnection(*(proxy or (host, port)))
+        return connection, False
+
+    def release(self, key, connection):
+        """Give back a connection with nothing left to read."""
+        self._lock.acquire()
+        try:
+            connections = self.idle.setdefault(key, [])
+            if self._pid == os.getpid() and len(connections) < MAX_IDLE:
+                connections.append(connection)
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            idle, self.idle = self.idle, {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def open(self, url, headers=None):
+        """GET url, following redirections.
+        Returns
+            - a response with read, info, geturl and close like the
+              urllib2 ones and the HTTP status as code
+        Exceptions
+            - urllib2.HTTPError for HTTP errors
+            - urllib2.URLError if the host cannot be reached
+        """
+        headers = dict(headers or {})
+        for i in range(MAX_REDIRECTS + 1):
+            scheme = urlparse.urlsplit(url)[0]
+            if not scheme in ('http', 'https'):
+                request = urllib2.Request(url)
+                for header, value in headers.items():
+                    request.add_header(header, value)
+                return self._opener.open(request)
+            response = self._request(url, headers)
+            if not response.code in REDIRECTS:
+                break
+            location = response.info().getheader('location')
+            response.read()
+            response.close()
+            if not location:
+                break
+            url = urlparse.urljoin(url, location)
+        if response.code >= 400:
+            body = response.read()
+            response.close()
+            raise urllib2.HTTPError(url, response.code, response.msg,
+                                    response.info(), StringIO(body))
+        return response
+
+    def _request(self, url, headers):
+        parts = urlparse.urlsplit(url)
+        default_port = {'http': 80, 'https': 443}[parts.scheme]
+        host, port = parts.hostname, parts.port or default_port
+        proxy, proxy_headers = self._proxy(parts.scheme, host)
+        path = urlparse.urlunsplit(('', '', parts.path or '/',
+                                    parts.query, ''))
+        request_headers = dict(headers)
+        if proxy and parts.scheme == 'http':
+            # plain http proxies take the whole url
+            path = urlparse.urlunsplit(parts[:4] + ('',))
+            request_headers.update(proxy_headers)
+            key = ('http', None, None, proxy, ())
+        else:
+            key = (parts.scheme, host, port, proxy,
+                   tuple(sorted(proxy_headers.items())))
+        while True:
+            connection, reused = self._connection(key)
+            try:
+                connection.putrequest('GET', path)
+                for header, value in request_headers.items():
+                    connection.putheader(header, value)
+                connection.endheaders()
+                response = connection.getresponse()
+            except (httplib.HTTPException, IOError), e:
+                connection.close()
+                if reused:
+                    # the server closed the idle connection, retry
+                    continue
+                if isinstance(e, IOError):
+                    raise urllib2.URLError(e)
+                raise
+            return PooledResponse(self, key, connection, response, url)
+
+
+class PooledResponse(object):
+    """Response of a pooled connection, the connection goes back to the
+    pool once the response is read."""
+
+    def __init__(self, pool, key, connection, response, url):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = response.msg
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def read(self, amt=None):
+        if self.connection is None:
+            return ''
+        if amt is None:
+            data = self.response.read()
+        else:
+            data = self.response.read(amt)
+        if self.response.isclosed() or self.response.length == 0:
+            self._release()
+        elif not data and amt:
+            # the server went away before the end
+            self.close()
+        return data
+
+    def _release(self):
+        connection, self.connection = self.connection, None
+        if self.response.will_close:
+            connection.close()
+        else:
+            self.pool.release(self.key, connection)
+
+    def close(self):
+        if self.connection is not None:
+            # not read until the end, it cannot be reused
+            self.connection.close()
+            self.connection = None
+        self.response.close()
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,254 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import re
+import mmap
+import stat
+import tempfile
+
+from minitage.core.objects import mfilter
+
+""" index format version, written on the first line"""
+VERSION = 'minitage-index\t1'
+INDEX = '.index'
+
+
+class IndexEntry(object):
+    """A minibuild in the index."""
+
+    def __init__(self, name, minilay, mtime, size):
+        self.name = name
+        self.minilay = minilay
+        self.path = os.path.join(minilay, name)
+        self.mtime = mtime
+        self.size = size
+
+    def __repr__(self):
+        return '<IndexEntry %s in %s>' % (self.name, self.minilay)
+
+
+class MinilayIndex(object):
+    """On disk index of the minibuilds of a list of minilays.
+    The index is a text file::
+
+        minitage-index  1
+        dir     <minilay path>  <minilay mtime>
+        ...
+        <empty line>
+        <minibuild name>        <minilay rank>  <mtime> <size>
+        ...
+
+    Minilays are written in precedence order, minibuilds are sorted by
+    name then by minilay rank so that lookups are a binary search in
+    the mmaped file.
+    A minilay is only listed again if its mtime changed since the last
+    build, other minilays records are copied from the previous index.
+    If the index cannot be written, it is only kept in memory, as a
+    readonly index is.
+    Example::
+        >>> index = MinilayIndex('/prefix/minilays/.index', minilays)
+        >>> index.find('python-2.7').path
+        '/prefix/minilays/core/python-2.7'
+    """
+
+    def __init__(self, path, minilays, readonly=False):
+        """
+        Arguments:
+            - path: index file
+            - minilays: minilays directories, by order of precedence
+            - readonly: never write the index file
+        """
+        self.path = path
+        self.minilays = list(minilays)
+        self.readonly = readonly
+        self.mtimes = []
+        self.data = ''
+        self.start = 0
+        self.rebuilt = 0
+        self.refresh()
+
+    def _stat_minilays(self):
+        mtimes = []
+        for minilay in self.minilays:
+            try:
+                mtimes.append(repr(os.stat(minilay).st_mtime))
+            except OSError:
+                mtimes.append('')
+        return mtimes
+
+    def refresh(self):
+        """Reload the index, updating it if some minilays changed.
+        Return:
+            - True if the index has been rebuilt
+        """
+        mtimes = self._stat_minilays()
+        if mtimes == self.mtimes:
+            return False
+        data = self._read()
+        old_minilays, old_mtimes, start = self._parse_header(data)
+        if old_minilays == self.minilays and old_mtimes == mtimes:
+            self._set(data, start, mtimes)
+            return False
+        fresh = {}
+        for rank, minilay in enumerate(old_minilays):
+            if minilay in self.minilays:
+                new_rank = self.minilays.index(minilay)
+                if mtimes[new_rank] == old_mtimes[rank]:
+                    fresh[rank] = new_rank
+        records = []
+        # keep records of unchanged minilays
+        for line in data[start:].splitlines():
+            name, rank, mtime, size = line.split('\t')
+            rank = int(rank)
+            if rank in fresh:
+                records.append((name, fresh[rank], mtime, size))
+        reused = fresh.values()
+        for rank, minilay in enumerate(self.minilays):
+            if rank in reused or not mtimes[rank]:
+                continue
+            for name in os.listdir(minilay):
+                if mfilter(name) or '\t' in name or '\n' in name:
+                    continue
+                try:
+                    st = os.stat(os.path.join(minilay, name))
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    records.append(
+                        (name, rank, repr(st.st_mtime), str(st.st_size)))
+        records.sort(key=lambda r: (r[0], r[1]))
+        header = [VERSION]
+        for minilay, mtime in zip(self.minilays, mtimes):
+            header.append('dir\t%s\t%s' % (minilay, mtime))
+        header = '\n'.join(header) + '\n\n'
+        body = ''.join(['%s\t%s\t%s\t%s\n' % r for r in records])
+        self.rebuilt += 1
+        data = header + body
+        if not self.readonly:
+            self._write(data)
+            written = self._read()
+            # if the index is not writable, keep it in memory
+            if written[:len(header)] == header:
+                data = written
+        self._set(data, len(header), mtimes)
+        return True
+
+    def _set(self, data, start, mtimes):
+        self.data, self.start, self.mtimes = data, start, mtimes
+
+    def _read(self):
+        """mmap the index file, '' if there is none."""
+        try:
+            fic = open(self.path, 'rb')
+        except IOError:
+            return ''
+        try:
+            try:
+                return mmap.mmap(fic.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # empty file
+                return ''
+        finally:
+            fic.close()
+
+    def _write(self, content):
+        try:
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(self.path), prefix=INDEX)
+        except EnvironmentError:
+            return
+        try:
+            os.write(fd, content)
+            os.close(fd)
+            os.rename(tmp, self.path)
+        except EnvironmentError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _parse_header(self, data):
+        """Return the minilays, their mtimes and the records offset."""
+        minilays, mtimes = [], []
+        end = data.find('\n\n')
+        if end == -1 or not data[:end].startswith(VERSION):
+            return minilays, mtimes, len(data)
+        for line in data[:end].splitlines()[1:]:
+            kind, minilay, mtime = line.split('\t')
+            minilays.append(minilay)
+            mtimes.append(mtime)
+        return minilays, mtimes, end + 2
+
+    def _seek(self, name):
+        """Offset of the first record whose name is >= name."""
+        data = self.data
+        lo, hi = self.start, len(data)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            begin = data.rfind('\n', self.start - 1, mid) + 1
+            end = data.find('\n', begin)
+            if data[begin:data.find('\t', begin)] < name:
+                lo = end + 1
+            else:
+                hi = begin
+        return lo
+
+    def _entry(self, line):
+        name, rank, mtime, size = line.split('\t')
+        return IndexEntry(name, self.minilays[int(rank)],
+                          float(mtime), int(size))
+
+    def find(self, name):
+        """Return the IndexEntry of the minibuild which has the
+        precedence, None if it is not indexed."""
+        data = self.data
+        begin = self._seek(name)
+        if begin >= len(data):
+            return None
+        line = data[begin:data.find('\n', begin)]
+        if line.split('\t', 1)[0] != name:
+            return None
+        return self._entry(line)
+
+    def entries(self):
+        """All the entries, by name then precedence."""
+        return [self._entry(line)
+                for line in self.data[self.start:].splitlines()]
+
+    def search(self, regex, minilays=None):
+        """Name of the latest minibuild matching regex in the first
+        minilay having one, None if none.
+        Arguments:
+            - regex: regular expression as for common.search_latest
+            - minilays: restrict the search to those minilays
+        """
+        matched = {}
+        for entry in self.entries():
+            if minilays is not None and not entry.minilay in minilays:
+                continue
+            if re.match(regex, entry.name, re.M | re.S | re.U):
+                if entry.name > matched.get(entry.minilay, ''):
+                    matched[entry.minilay] = entry.name
+        for minilay in self.minilays:
+            if minilay in matched:
+                return matched[minilay]
+        return None
+
+
+def get_index(minilays_root):
+    """Return the up to date index of the minilays in minilays_root, in
+    the order os.walk lists them, None if no index was ever built there.
+    The index file is only written by Minimerge, which has its own
+    minilays list: the minilays it does not know or which changed are
+    listed in memory."""
+    minilays_root = os.path.normpath(minilays_root)
+    path = os.path.join(minilays_root, INDEX)
+    if not os.path.exists(path):
+        return None
+    minilays = []
+    for directory in os.listdir(minilays_root):
+        minilay = os.path.join(minilays_root, directory)
+        # os.walk does not go through the links
+        if os.path.isdir(minilay) and not os.path.islink(minilay):
+            minilays.append(minilay)
+    return MinilayIndex(path, minilays, readonly=True)
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -2,6 +2,20 @@ __docformat__ = 'restructuredtext en'
 
 import ConfigParser
 import os
+import threading
+
+import pkg_resources
+
+""" config file -> ((mtime, size), its sections), parsed once by process"""
+_configs = {}
+""" 'module:Class' -> class, imported once by process"""
+_classes = {}
+""" entry points group -> {name: 'module:Class'}"""
+_entry_points = {}
+""" (factory class, config file) -> ((mtime, size), factory), see
+get_factory"""
+_factories = {}
+_lock = threading.RLock()
 
 class InterfaceError(Exception):
     """eneral Interface Error."""
@@ -17,10 +31,81 @@ class InvalidComponentClassPathError(InterfaceError):
 class InvalidComponentClassError(InterfaceError):
     """Component Class is not valid."""
 
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def read_config(path):
+    """Sections of the config file path, read again only if it changed."""
+    key = _stat(path)
+    _lock.acquire()
+    try:
+        if not path in _configs or _configs[path][0] != key:
+            config = ConfigParser.ConfigParser()
+            config.read(path)
+            sections = config._sections
+            for section in sections:
+                sections[section].pop('__name__', None)
+            _configs[path] = (key, sections)
+        return _configs[path][1]
+    finally:
+        _lock.release()
+
+
+def load_class(path):
+    """Import the class of a 'module:Class' path."""
+    _lock.acquire()
+    try:
+        if not path in _classes:
+            smodule, sklass = path.split(':')
+            klass = __import__(smodule, None, None, [''])
+            for attr in sklass.split('.'):
+                klass = getattr(klass, attr)
+            _classes[path] = klass
+        return _classes[path]
+    finally:
+        _lock.release()
+
+
+def get_entry_points(group):
+    """{name: 'module:Class'} of the setuptools entry points of group,
+    the plugins of the other distributions (eg: minitage.fetchers)."""
+    _lock.acquire()
+    try:
+        if not group in _entry_points:
+            _entry_points[group] = dict(
+                [(ep.name, '%s:%s' % (ep.module_name, '.'.join(ep.attrs)))
+                 for ep in pkg_resources.iter_entry_points(group)])
+        return _entry_points[group]
+    finally:
+        _lock.release()
+
+
+def get_factory(factory, config=None):
+    """The factory of the class factory for the config file, made once by
+    process and again if the file changes (configurations which are not
+    files are not shared)."""
+    if not isinstance(config, basestring):
+        return factory(config)
+    key, stat = (factory, config), _stat(config)
+    _lock.acquire()
+    try:
+        if not key in _factories or _factories[key][0] != stat:
+            _factories[key] = (stat, factory(config))
+        return _factories[key][1]
+    finally:
+        _lock.release()
+
+
 class IFactory(object):
     """Interface implementing the design pattern 'factory'.
     Basics
-        To register a new fetcher to the factory you ll have 2 choices:
+        To register a new fetcher to the factory you ll have 3 choices:
             - Indicate something in a config.ini file and give it to the
               instance initialization.
               Example::
@@ -31,6 +116,16 @@ class IFactory(object):
               Example::
                 >>> factory.register('svn', 'module.fetchcher.NiceSvnFetcher')
 
+            - or, from another distribution, declare a setuptools entry point
+              in the minitage.<name> group (minitage.fetchers,
+              minitage.makers, minitage.unpackers).
+              Example::
+                    entry_points={'minitage.fetchers': [
+                        'type = mymodule.mysubmodule:MyFetcherClass']}
+
+        The classes are imported the first time they are asked for and
+        the config files are read once, see get_factory to share a factory.
+
     Attributes
     - products : dictionary:
         { src_type : IFetcher instance}
@@ -44,16 +139,16 @@ class IFactory(object):
                     containing all needed classes.
         """
         self.name = 'minitage.%s' % name
-        self.config = ConfigParser.ConfigParser()
         self.section = {}
         self.sections = {}
-        self.products = {}
+        # registered classes, and 'module:Class' paths not imported yet
+        self._products = {}
+        self._paths = {}
         if config:
             try:
                 if isinstance(config, str):
                     if os.path.exists(config):
-                        self.config.read(config)
-                        self.sections = self.config._sections
+                        self.sections = read_config(config)
                     else:
                         self.sections = {self.name: {}}
                 else:
@@ -67,29 +162,71 @@ class IFactory(object):
                         ' appropriate content for this factory.\n'
                 raise InvalidConfigForFactoryError(message % (self.name))
 
-        # for each class in the config File, try to instantiate and register
-        # the type/plugin in the factory dict.
+        # register the plugins of the other distributions, then the classes
+        # in the config File.
+        self.registerDict(get_entry_points(self.name))
         self.registerDict(self.section)
 
     def registerDict(self, d):
         """For each item/class in the dict:
-        Try to instantiate and register.
+        Register it, it will be imported when it is first needed.
         Arguments:
-            - dict : dictionnary {item:class}
+            - dict : dictionnary {item:'module:Class'}
         Exceptions:
             - InvalidComponentClassPathError
         """
-        # the type/plugin in the factory dict.
-        #
         for key in d:
+            path = d[key].strip()
+            if len([p for p in path.split(':') if p]) != 2:
+                message = 'Invalid Component: \'%s/%s\'' % (key, d[key])
+                raise InvalidComponentClassPathError(message)
+            self._products.pop(key, None)
+            self._paths[key] = path
+
+    def get_product(self, key):
+        """The class registered for key, imported on demand, or None.
+        Exceptions:
+            - InvalidComponentClassPathError
+        """
+        if not key in self._products:
+            if not key in self._paths:
+                return None
             try:
-                smodule, sklass = d[key].strip().split(':')
-                module = __import__(smodule, None, None, [''])
-                klass = getattr(module, sklass)
+                klass = load_class(self._paths[key])
             except Exception:
-                message = 'Invalid Component: \'%s/%s\'' % (key, d[key])
+                message = 'Invalid Component: \'%s/%s\'' % (
+                    key, self._paths[key])
                 raise InvalidComponentClassPathError(message)
             self.register(key, klass)
+        return self._products[key]
+
+    def keys(self):
+        """The registered types, without importing their classes."""
+        keys = set(self._products)
+        keys.update(self._paths)
+        return sorted(keys)
+
+    def get_products(self):
+        """{type: class} of all the registered types."""
+        return dict([(key, self.get_product(key)) for key in self.keys()])
+
+    products = property(get_products)
+
+    def get_instance(self, switch, *args, **kwargs):
+        """Instance of the product registered for switch which matches it,
+        made with args and kwargs. The products registered under other
+        names are only asked to match if there is none."""
+        klass = self.get_product(switch)
+        if klass is not None:
+            instance = klass(*args, **kwargs)
+            if instance.match(switch):
+                return instance
+        for key in self.keys():
+            if key != switch:
+                instance = self.get_product(key)(*args, **kwargs)
+                if instance.match(switch):
+                    return instance
+        return None
 
     def register(self, ltype, klass):
         """Register a product with its factory.
@@ -99,7 +236,8 @@ class IFactory(object):
         """
         # little check that we have instance
         if not  isinstance(klass, str):
-            self.products[ltype] = klass
+            self._products[ltype] = klass
+            self._paths.pop(ltype, None)
         else:
             message = 'Invalid Component: \'%s/%s\' ' % (ltype, klass)
             message += 'does not point to a valid class.'
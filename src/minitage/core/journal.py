@@ -0,0 +1,209 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from minitage.core import plan
+
+""" steps of a package merge, in order"""
+STEPS = ('fetch', 'bootstrap', 'buildout', 'record', 'env')
+""" finished journals kept in the runs directory"""
+KEEP = 10
+SUFFIX = '.journal'
+
+
+class JournalError(Exception):
+    """General Journal Error."""
+
+
+class RunJournal(object):
+    """What a minimerge run has done, to resume it if it fails.
+    The journal is a file of JSON records, one per line, in
+    <prefix>/.minitage/runs:
+
+        - the run: its build plan and modes
+        - the steps done for each package (see STEPS)
+        - the packages completely merged
+        - the failure, or the end of the run
+
+    Records are appended with one write, forked build workers can share
+    the journal.
+    Example::
+        >>> journal = RunJournal.create(runs, build_plan, {})
+        >>> journal.done('zlib-1.2', 'fetch')
+        >>> RunJournal.last(runs).resume_point()
+        ('zlib-1.2', 'bootstrap')
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.run = None
+        self.steps = {}
+        self.completed = []
+        self.failures = []
+        self.finished = False
+
+    def create(klass, directory, build_plan, modes=None):
+        """Start the journal of a new run in directory."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        klass.prune(directory)
+        journal = klass(os.path.join(directory, '%s-%s%s' % (
+            time.strftime('%Y%m%d-%H%M%S'), os.getpid(), SUFFIX)))
+        journal.run = {'plan': build_plan.to_dict(),
+                       'modes': modes or {},
+                       'started': time.time()}
+        journal._write(dict(journal.run, type='run'))
+        return journal
+    create = classmethod(create)
+
+    def load(klass, path):
+        journal = klass(path)
+        journal._read()
+        return journal
+    load = classmethod(load)
+
+    def _read(self):
+        try:
+            lines = open(self.path).readlines()
+        except IOError, e:
+            raise JournalError('Cannot read the run journal %s: %s' % (
+                self.path, e))
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # interrupted while writing the last record
+                continue
+            self._apply(record)
+        if self.run is None:
+            raise JournalError('Invalid run journal: %s' % self.path)
+
+    def reload(self):
+        """Read again the journal, with the records of the workers."""
+        self.__init__(self.path)
+        self._read()
+
+    def journals(klass, directory):
+        """Journals paths of directory, oldest first."""
+        if not os.path.isdir(directory):
+            return []
+        paths = [os.path.join(directory, f)
+                 for f in os.listdir(directory) if f.endswith(SUFFIX)]
+        paths.sort(key=lambda p: (os.path.getmtime(p), p))
+        return paths
+    journals = classmethod(journals)
+
+    def last(klass, directory):
+        """Journal of the last unfinished run in directory, or None."""
+        paths = klass.journals(directory)
+        paths.reverse()
+        for path in paths:
+            try:
+                journal = klass.load(path)
+            except JournalError:
+                continue
+            if not journal.finished:
+                return journal
+    last = classmethod(last)
+
+    def prune(klass, directory, keep=KEEP):
+        """Remove the oldest journals, keeping keep of them."""
+        paths = klass.journals(directory)
+        for path in paths[:max(0, len(paths) - keep)]:
+            os.remove(path)
+    prune = classmethod(prune)
+
+    def _apply(self, record):
+        kind = record.get('type')
+        if kind == 'run':
+            self.run = record
+        elif kind == 'step':
+            self.steps.setdefault(record['package'], []).append(
+                record['step'])
+        elif kind == 'package':
+            self.completed.append(record['package'])
+        elif kind == 'failed':
+            self.failures.append((record['package'], record['error']))
+        elif kind == 'end':
+            self.finished = True
+
+    def _write(self, record):
+        line = '%s\n' % json.dumps(record, sort_keys=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def _record(self, **record):
+        self._apply(record)
+        self._write(record)
+
+    def get_plan(self):
+        return plan.BuildPlan.from_dict(self.run['plan'])
+
+    def get_modes(self):
+        return dict([(str(k), v) for k, v in self.run['modes'].items()])
+
+    def done(self, name, step):
+        """The step of the package name is done."""
+        if not step in STEPS:
+            raise JournalError('Unknown step: %s' % step)
+        if not self.is_done(name, step):
+            self._record(type='step', package=name, step=step)
+
+    def is_done(self, name, step):
+        return step in self.steps.get(name, [])
+
+    def complete(self, name):
+        """The package name is merged."""
+        if not self.is_complete(name):
+            self._record(type='package', package=name)
+
+    def is_complete(self, name):
+        return name in self.completed
+
+    def fail(self, name, error):
+        self._record(type='failed', package=name, error='%s' % error)
+
+    def finish(self):
+        self._record(type='end')
+
+    def resume_point(self):
+        """First package of the plan which is not merged and its first
+        step not done.
+        Returns
+            - (package name, step) or None if everything is merged
+        """
+        for step in self.get_plan():
+            if not self.is_complete(step.name):
+                for s in STEPS:
+                    if not self.is_done(step.name, s):
+                        return step.name, s
+                return step.name, None
+
+    def package(self, name):
+        return PackageJournal(self, name)
+
+
+class PackageJournal(object):
+    """Journal of one package, given to the makers as options['steps']
+    so that they skip and record their own steps."""
+
+    def __init__(self, journal, name):
+        self.journal = journal
+        self.name = name
+
+    def __contains__(self, step):
+        return self.journal.is_done(self.name, step)
+
+    def done(self, step):
+        self.journal.done(self.name, step)
+
+# vim:set et sts=4 ts=4 tw=80:
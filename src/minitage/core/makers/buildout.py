@@ -15,39 +15,19 @@ from iniparse import ConfigParser
 from minitage.core.unpackers  import interfaces as uinterfaces
 import minitage.core.core
 import minitage.core.common
-import subprocess
+from minitage.core import runner
+from minitage.core import tools
 import traceback
 
-from threading  import Thread
-import fcntl
-
-try:
-    from Queue import Queue, Empty
-except ImportError:
-    from queue import Queue, Empty  # python 3.x
-
-ON_POSIX = 'posix' in sys.builtin_module_names
-def run_boot_setup():
-    ret = subprocess.Popen(['bin/buildout', 'setup', '.minitage/setup.py'],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        stdin=subprocess.PIPE,
-    )
-    return ret
-
-
-def enqueue_output(ret, queue):
-    while True:
-        out = ret.stdout.read()
-        eout = ret.stderr.read()
-        if (eout == '') and  (out == '') and (ret.returncode != None):
-            break
-        queue.put(out)
-        queue.put(eout)
-        sys.stdout.write(out)
-        sys.stdout.write(eout)
-    ret.stdout.close()
-    ret.stderr.close()
+def run_boot_setup(directory, env=None, log_file=None):
+    """Result of bin/buildout setup .minitage/setup.py in directory, its
+    stdout being the paths of the distributions it did set up."""
+    try:
+        return runner.run(['bin/buildout', 'setup', '.minitage/setup.py'],
+                          capture=True, cwd=directory, env=env,
+                          log_file=log_file)
+    except runner.CommandError, e:
+        return e.result
 
 
 class BuildoutError(interfaces.IMakerError):
@@ -126,7 +106,6 @@ class BuildoutMaker(interfaces.IMaker):
             config = {}
         self.logger = logging.getLogger(__logger__)
         self.config = config
-        self.cwd = os.getcwd()
         self.buildout_config = 'buildout.cfg'
         interfaces.IMaker.__init__(self)
 
@@ -145,72 +124,51 @@ class BuildoutMaker(interfaces.IMaker):
                    "-c",
                    "import pkg_resources;print not pkg_resources.get_distribution('distribute').version.startswith('0.6')"]
             #self.logger.debug('Run %s' % " ".join(cmd))
-            ret = subprocess.Popen(
-               cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE,)
-            if ret.wait() == 0:
-                if 'true' in ret.stdout.read().lower():
-                    new_st = True
+            ret = runner.run(cmd, capture=True)
+            if 'true' in ret.stdout.lower():
+                new_st = True
         except Exception, e:
             new_st = False
         return new_st
 
-    def upgrade_code(self, opts):
+    def upgrade_code(self, directory, opts):
         """try to run mr.developer but not as a fail element"""
+        develop = os.path.join(directory, 'bin', 'develop')
+        env = opts.get('env', None)
+        log_file = opts.get('log_file', None)
         if (
             not opts['offline']
-            and os.path.isfile('bin/develop')
+            and os.path.isfile(develop)
             and opts['minimerge'].is_package_to_be_updated(
                 opts['minibuild'])
         ):
-            content  = open('bin/develop').read()
+            content  = open(develop).read()
             if 'mr.developer' in content:
                 self.logger.info(
                     'Running mr.developer update')
-                helpret = subprocess.Popen(
-                    ['bin/develop', 'up', '--help'],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    stdin=subprocess.PIPE,
-                )
-                outputs = []
-                while helpret.poll() is None:
-                    outputs.append(helpret.communicate())
-                if helpret.wait() != 0:
+                try:
+                    helpret = runner.run(['bin/develop', 'up', '--help'],
+                                         capture=True, cwd=directory,
+                                         env=env, log_file=log_file)
+                except runner.CommandError, e:
                     raise MrDeveloperError('error with help')
-                else:
-                    content = ''.join([a[0] for a in outputs])
-                    cmd = ['bin/develop', 'up', '-v']
-                    if '--force' in content:
-                        cmd.append('--force')
-                    self.logger.info(
-                        'Running %s' % ' '.join(cmd))
-                    ret = subprocess.Popen(
-                        cmd, bufsize=-1,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        stdin=subprocess.PIPE,)
-                    #for i in (ret.stdout, ret.stderr):
-                    #    fd = i.fileno()
-                    #    fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-                    #    fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-                    q = Queue()
-                    t = Thread(target=enqueue_output, args=(ret, q,))
-                    t.daemon = True
-                    t.start()
-                    outputs = []
-                    ret.wait()
-                    buf = ''
-                    while not q.empty():
-                        buf += q.get()
-                    q.join()
-                    if t and t.is_alive(): #wait for thread to finish
-                        t.join()
-                    if ret.returncode == 0:
-                        self.logger.info('mr.developer successfuly updated code')
-                    else:
-                        raise MrDeveloperError('mr.developer failed to update code')
+                content = helpret.stdout
+                cmd = ['bin/develop', 'up', '-v']
+                if '--force' in content:
+                    cmd.append('--force')
+                self.logger.info(
+                    'Running %s' % ' '.join(cmd))
+                try:
+                    runner.run(cmd, echo=True, cwd=directory, env=env,
+                               log_file=log_file)
+                except runner.CommandError, e:
+                    raise MrDeveloperError('mr.developer failed to update code')
+                self.logger.info('mr.developer successfuly updated code')
 
     def upgrade_bootstrap(self, minimerge, offline, directory=".", py=None):
+        bootstrap = os.path.join(directory, 'bootstrap.py')
+        updated_bootstrap = os.path.join(
+            directory, minimerge.history_dir, 'updated_bootstrap')
         buildout1 = False
         try:
             def findcfgs(path, cfgs=None):
@@ -264,7 +222,7 @@ class BuildoutMaker(interfaces.IMaker):
         # and add possible content
         try:
             try:
-                fic = open('bootstrap.py')
+                fic = open(bootstrap)
                 oldcontent = fic.read()
                 fic.close()
             except:
@@ -274,9 +232,7 @@ class BuildoutMaker(interfaces.IMaker):
             dled = False
             if not offline:
                 try:
-                    open(
-                        os.path.join(minimerge.history_dir,
-                                     'updated_bootstrap'))
+                    open(updated_bootstrap)
                 except:
                     self.logger.info('Bootstrap updated')
                     data = urllib2.urlopen(booturl).read()
@@ -289,17 +245,16 @@ class BuildoutMaker(interfaces.IMaker):
                 data = '\n'.join(ldata)
             if updated:
                 self.logger.info('Bootstrap updated')
-                fic = open('bootstrap.py', 'w')
+                fic = open(bootstrap, 'w')
                 fic.write(data)
                 fic.close()
             if dled:
-                afic = open(os.path.join(
-                    minimerge.history_dir, 'updated_bootstrap'), 'w')
+                afic = open(updated_bootstrap, 'w')
                 afic.write('foo')
                 afic.close()
         except:
             if oldcontent:
-                fic = open('bootstrap.py', 'w')
+                fic = open(bootstrap, 'w')
                 fic.write(oldcontent)
                 fic.close()
 
@@ -337,54 +292,61 @@ class BuildoutMaker(interfaces.IMaker):
         self.logger.info(
             'Running buildout in %s (%s)' % (directory,
                                              self.buildout_config))
-        os.chdir(directory)
         minibuild = opts.get('minibuild', None)
         installed_cfg = os.path.join(directory, '.installed.cfg')
         if not opts:
             opts = {}
         try:
-            try:
-                parts = opts.get('parts', False)
-                if isinstance(parts, str):
-                    parts = parts.split()
-                category = ''
-                if minibuild: category = minibuild.category
-                # Try to upgrade only if we need to
-                # (we chech only when we have a .installed.cfg file
-                if (not opts.get('upgrade', True)
-                    and os.path.exists(installed_cfg)
-                    and (not category=='eggs')):
-                    self.logger.info(
-                        'Buildout will not run in %s'
-                        ' as there is a .installed.cfg file'
-                        ' indicating us that the software is already'
-                        ' installed but minimerge is running in'
-                        ' no-update mode. If you want to try'
-                        ' to update/rebuild it unconditionnaly,'
-                        ' please relaunch with -uUR.' % directory)
-                else:
-                    self.upgrade_code(opts)
+            parts = opts.get('parts', False)
+            if isinstance(parts, str):
+                parts = parts.split()
+            category = ''
+            if minibuild: category = minibuild.category
+            # Try to upgrade only if we need to
+            # (we chech only when we have a .installed.cfg file
+            if (not opts.get('upgrade', True)
+                and os.path.exists(installed_cfg)
+                and (not category=='eggs')):
+                self.logger.info(
+                    'Buildout will not run in %s'
+                    ' as there is a .installed.cfg file'
+                    ' indicating us that the software is already'
+                    ' installed but minimerge is running in'
+                    ' no-update mode. If you want to try'
+                    ' to update/rebuild it unconditionnaly,'
+                    ' please relaunch with -uUR.' % directory)
+            else:
+                # steps done by a failed minimerge run are skipped
+                steps = opts.get('steps', None)
+                if steps is None or not 'bootstrap' in steps:
+                    self.upgrade_code(directory, opts)
                     self.buildout_bootstrap(directory, opts)
+                    if steps is not None:
+                        steps.done('bootstrap')
+                if steps is None or not 'buildout' in steps:
                     self.buildout(directory, parts, opts)
-            except Exception, instance:
-                trace = traceback.format_exc()
-                raise BuildoutError(
-                    'Buildout failed:\n\t%s' % trace)
-        finally:
-            os.chdir(self.cwd)
+                    if steps is not None:
+                        steps.done('buildout')
+        except Exception, instance:
+            trace = traceback.format_exc()
+            raise BuildoutError(
+                'Buildout failed:\n\t%s' % trace)
 
     def buildout_bootstrap(self, directory, opts):
         offline = get_offline(opts)
         dcfg = os.path.expanduser('~/.buildout/default.cfg')
         minimerge = opts.get('minimerge', None)
         py = self.choose_python(directory, opts)
+        env = opts.get('env', None)
+        log_file = opts.get('log_file', None)
         new_st = self.has_setuptools7(py=py)
+        top = os.path.abspath(os.path.join(directory, '..', '..'))
         downloads_caches = [
-            os.path.abspath('../../downloads/dist'),
-            os.path.abspath('../../downloads/minitage/eggs'),
-            os.path.abspath('../../downloads/minitage'),
-            os.path.abspath('../../download/dist'),
-            os.path.abspath('../../download/minitage/eggs'),
+            os.path.join(top, 'downloads/dist'),
+            os.path.join(top, 'downloads/minitage/eggs'),
+            os.path.join(top, 'downloads/minitage'),
+            os.path.join(top, 'download/dist'),
+            os.path.join(top, 'download/minitage/eggs'),
         ]
         if os.path.exists(dcfg):
             try:
@@ -430,9 +392,9 @@ class BuildoutMaker(interfaces.IMaker):
 
         bootstrap_args = ''
         st_bootstrap_args = ''
-        self.upgrade_bootstrap(minimerge, offline, py=py)
+        self.upgrade_bootstrap(minimerge, offline, directory, py=py)
         # be sure which buildout bootstrap we have
-        fic = open('bootstrap.py')
+        fic = open(os.path.join(directory, 'bootstrap.py'))
         content = fic.read()
         fic.close()
         if '--distribute' in content:
@@ -456,8 +418,8 @@ class BuildoutMaker(interfaces.IMaker):
                             distribute_setup_places))
             if ds:
                 for eggc in  (
-                    os.path.abspath(os.path.abspath('../../downloads/minitage/eggs')),
-                    os.path.abspath(os.path.abspath('../../eggs/cache')),
+                    os.path.join(top, 'downloads/minitage/eggs'),
+                    os.path.join(top, 'eggs/cache'),
                 ):
                     if os.path.exists(eggc):
                         break
@@ -476,8 +438,8 @@ class BuildoutMaker(interfaces.IMaker):
         bare_bootstrap_args = bootstrap_args
         st_bare_bootstrap_args = st_bootstrap_args
         boot_can_continue = False
-        if not os.path.isdir(".minitage"):
-            os.makedirs(".minitage")
+        if not os.path.isdir(os.path.join(directory, ".minitage")):
+            os.makedirs(os.path.join(directory, ".minitage"))
         # Be sure to have an unzipped eggs
         SCRIPT = """
 import pkg_resources
@@ -485,7 +447,7 @@ for i in ['setuptools', 'zc.buildout']:
     print pkg_resources.get_distribution(i).location
 
         """
-        fic = open('.minitage/setup.py', 'w')
+        fic = open(os.path.join(directory, '.minitage/setup.py'), 'w')
         fic.write(SCRIPT)
         fic.close()
         if eggs_base is not None:
@@ -512,9 +474,11 @@ for i in ['setuptools', 'zc.buildout']:
                 self.logger.info('Running %s' % cmd)
                 if '--distribute' in cmd:
                     self.logger.warning('Using distribute !')
-                minitage.core.common.Popen(cmd , opts.get('verbose', False))
-                boot_setup = run_boot_setup()
-                if boot_setup.wait() == 0:
+                minitage.core.common.Popen(cmd , opts.get('verbose', False),
+                                           cwd=directory, env=env,
+                                           log_file=log_file)
+                boot_setup = run_boot_setup(directory, env, log_file)
+                if boot_setup.returncode == 0:
                     boot_can_continue = True
             except Exception, e:
                 self.logger.error('Buildout bootstrap failed, trying online !')
@@ -523,9 +487,11 @@ for i in ['setuptools', 'zc.buildout']:
                 try:
                     if '--distribute' in cmd:
                         self.logger.warning('Using distribute !')
-                    minitage.core.common.Popen(cmd, opts.get('verbose', False))
-                    boot_setup = run_boot_setup()
-                    if boot_setup.wait() == 0:
+                    minitage.core.common.Popen(cmd, opts.get('verbose', False),
+                                               cwd=directory, env=env,
+                                               log_file=log_file)
+                    boot_setup = run_boot_setup(directory, env, log_file)
+                    if boot_setup.returncode == 0:
                         boot_can_continue = True
                 except Exception, ex:
                     if ix < len(BARGS) -1:
@@ -535,7 +501,7 @@ for i in ['setuptools', 'zc.buildout']:
             if boot_can_continue:
                 break
         if boot_can_continue:
-            output = [a for a in boot_setup.stdout.read().splitlines()
+            output = [a for a in boot_setup.stdout.splitlines()
                       if os.path.exists(a)]
             for a in output:
                 if os.path.isfile(a):
@@ -607,7 +573,10 @@ for i in ['setuptools', 'zc.buildout']:
                         ' '.join(argv),
                         part
                     ),
-                    opts.get('verbose', False)
+                    opts.get('verbose', False),
+                    cwd=directory,
+                    env=opts.get('env', None),
+                    log_file=opts.get('log_file', None)
                 )
         else:
             self.logger.debug('Installing parts')
@@ -617,14 +586,18 @@ for i in ['setuptools', 'zc.buildout']:
                 ' '.join(argv))
             minitage.core.common.Popen(
                 cmd,
-                opts.get('verbose', False)
+                opts.get('verbose', False),
+                cwd=directory,
+                env=opts.get('env', None),
+                log_file=opts.get('log_file', None)
             )
 
     def choose_python(self, directory, opts):
         python = sys.executable
         mb =  opts.get('minibuild', None)
         if mb:
-            if os.path.exists(mb.python):
+            if tools.which(os.path.basename(mb.python),
+                           [os.path.dirname(mb.python)]):
                 python = mb.python
         return python
 
@@ -49,11 +49,7 @@ class IMakerFactory(interfaces.IFactory):
 
                 -buildout: buildout
         """
-        for key in self.products:
-            klass = self.products[key]
-            instance = klass(self.sections.get(switch, {}))
-            if instance.match(switch):
-                return instance
+        return self.get_instance(switch, self.sections.get(switch, {}))
 
 
 class IMaker(interfaces.IProduct):
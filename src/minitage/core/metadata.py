@@ -0,0 +1,129 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import sys
+import marshal
+import tempfile
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+""" cache format version, bump it when the parsed metadata change"""
+VERSION = 2
+""" minibuild attributes stored in the cache"""
+FIELDS = ('dependencies', 'raw_dependencies', 'revision', 'install_method',
+          'src_uri', 'src_type', 'src_opts', 'src_md5', 'category', 'url',
+          'description', 'scm_branch', 'python', 'src_depth', 'src_filter',
+          'src_sparse')
+
+
+def config_key(minitage_config, *extra):
+    """Hash of all what a minibuild parsing depends on besides its
+    file: minitage.variables, the prefix and the platform."""
+    sections = getattr(minitage_config, '_sections', {})
+    variables = sections.get('minitage.variables', {}).items()
+    variables.sort()
+    prefix = sections.get('minimerge', {}).get('prefix', '')
+    key = repr((VERSION, sys.executable, prefix, variables) + extra)
+    return md5(key).hexdigest()
+
+
+class MetadataCache(object):
+    """Store of the parsed minibuilds.
+    Entries are keyed on the minibuild path and valid as long as the
+    file mtime and size did not change. The whole cache is dropped when
+    the configuration it was built with changes.
+    The cache is one marshal file loaded on first use and written back
+    by save() if anything changed.
+    Example::
+        >>> cache = MetadataCache('/prefix/.minitage/minibuilds.cache', config)
+        >>> stamp = cache.stamp(minibuild.path)
+        >>> data = cache.get(minibuild.path, stamp)
+        >>> if data is None:
+        ...     cache.set(minibuild.path, stamp, parse(minibuild))
+        >>> cache.save()
+    """
+
+    def __init__(self, path, minitage_config=None, *extra):
+        """
+        Arguments:
+            - path: cache file
+            - minitage_config: minimerge configuration
+            - extra: any other values the parsing depends on
+        """
+        self.path = path
+        self.key = config_key(minitage_config, *extra)
+        self.entries = None
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        self.entries = {}
+        try:
+            fic = open(self.path, 'rb')
+        except IOError:
+            return
+        try:
+            try:
+                key, entries = marshal.load(fic)
+                if key == self.key:
+                    self.entries = entries
+            except (EOFError, ValueError, TypeError):
+                # corrupted or from another python, rebuild it
+                pass
+        finally:
+            fic.close()
+
+    def stamp(self, path):
+        """Validity stamp of a file, None if it does not exist."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def get(self, path, stamp):
+        """Return the cached data of path if stamp is still valid."""
+        if self.entries is None:
+            self.load()
+        entry = self.entries.get(path)
+        if stamp is not None and entry is not None and entry[0] == stamp:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def set(self, path, stamp, data):
+        if self.entries is None:
+            self.load()
+        if stamp is not None:
+            self.entries[path] = (stamp, data)
+            self.dirty = True
+
+    def save(self):
+        """Write the cache if it changed."""
+        if not self.dirty:
+            return
+        directory = os.path.dirname(self.path)
+        tmp = None
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory,
+                                       prefix=os.path.basename(self.path))
+            fic = os.fdopen(fd, 'wb')
+            try:
+                marshal.dump((self.key, self.entries), fic)
+            finally:
+                fic.close()
+            os.rename(tmp, self.path)
+            self.dirty = False
+        except EnvironmentError:
+            # read only prefix, just do not cache
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -8,6 +8,7 @@ import re
 from ordereddict import OrderedDict
 
 from minitage.core import collections
+from minitage.core.metadata import FIELDS
 from minitage.core.common  import (
     newline,
     PYTHON_VERSIONS,
@@ -126,10 +127,13 @@ class Minilay(collections.LazyLoadedDict):
         -  self[minibuildName][error] : exception instance if any
     Arguments
         - path: path to the minilay
+        - metadata_cache: MetadataCache for the minibuilds, if any
     """
 
-    def __init__(self, path=None, minitage_config=None, *kw, **kwargs):
+    def __init__(self, path=None, minitage_config=None, metadata_cache=None,
+                 *kw, **kwargs):
         self.minitage_config = minitage_config
+        self.metadata_cache = metadata_cache
         self.path = path
         collections.LazyLoadedDict.__init__(self, *kw, **kwargs)
 
@@ -159,10 +163,23 @@ class Minilay(collections.LazyLoadedDict):
                     if os.path.isfile(mb_path):
                         self[minibuild] = Minibuild(
                             path = mb_path,
-                            minitage_config = self.minitage_config
+                            minitage_config = self.minitage_config,
+                            metadata_cache = self.metadata_cache
                         )
                         self.items.append(minibuild)
 
+    def register(self, item):
+        """Return the minibuild item, which is known to exist in this
+        minilay, without looking at the filesystem."""
+        if not item in self.items:
+            self[item] = Minibuild(
+                path = os.path.join(self.path, item),
+                minitage_config = self.minitage_config,
+                metadata_cache = self.metadata_cache
+            )
+            self.items.append(item)
+        return dict.__getitem__(self, item)
+
 class Minibuild(object):
     """Minibuild object.
     Contains all package metadata including
@@ -184,22 +201,31 @@ class Minibuild(object):
       - src_opts : arguments for the fetch method (import, -rxxx) be aware you
         also must include the check out argument if you using SCM fetch method there.
         like co or export. This argument is also not filtered out, take care !
+      - src_depth : (optionnal) history to check out: a number of commits
+        for git, an svn --depth (empty, files, immediates) for subversion,
+        full to override the [minimerge] src_depth
+      - src_filter : (optionnal) git partial clone filter, eg: blob:none
+      - src_sparse : (optionnal) the only paths of the repository to check
+        out (git sparse checkout, svn sparse directories)
       - dependencies : which minibuilds we are relying to as prior dependencies
       - url : project's homepage
       - description : a short description
       - install_method : how to install (valid methods are 'buildout')
       """
 
-    def __init__(self, path, minitage_config = None, *kw, **kwargs):
+    def __init__(self, path, minitage_config = None, metadata_cache = None,
+                 *kw, **kwargs):
         """
         Arguments
             path: path to the minibuild file. This minibuild file is pytthon
               configparser like object with a minibuild section which will
               define all the metadate:
+            metadata_cache: MetadataCache to get the parsed minibuild from
         Misc
             Thus we can lazy load minibuilds and save performance.
         """
         self.minitage_config = minitage_config
+        self.metadata_cache = metadata_cache
         self.path = path
         self.name = self.path.split(os.path.sep).pop()
         self.state = None
@@ -212,6 +238,9 @@ class Minibuild(object):
         self.src_md5 = None
         self.scm_branch = None
         self.src_uri = None
+        self.src_depth = None
+        self.src_filter = None
+        self.src_sparse = None
         self.url = None
         self.revision = None
         self.category = None
@@ -226,7 +255,8 @@ class Minibuild(object):
                       'revision', 'category', 'src_md5',
                       'raw_dependencies', 'scm_branch', 'python',
                       'dependencies', 'description','src_opts',
-                      'src_type', 'install_method', 'src_type']
+                      'src_type', 'install_method', 'src_type',
+                      'src_depth', 'src_filter', 'src_sparse']
         if attr in lazyloaded and not self.loaded:
             self.loaded = True
             self.load()
@@ -242,6 +272,13 @@ class Minibuild(object):
             message = 'Invalid minibuild name : \'%s\'' % self.name
             raise InvalidMinibuildNameError(message)
 
+        cache, stamp = self.metadata_cache, None
+        if cache is not None:
+            stamp = cache.stamp(self.path)
+            data = cache.get(self.path, stamp)
+            if data is not None:
+                return self.restore(data)
+
         try:
             config = ConfigParser.ConfigParser()
             config.read(self.path)
@@ -306,6 +343,10 @@ class Minibuild(object):
             self.src_opts = section.get('src_opts','').strip()
             # src_md5 is only important if we have src_uri
             self.src_md5 = section.get('src_md5','').strip()
+            # shallow / partial / sparse checkouts
+            self.src_depth = section.get('src_depth','').strip() or None
+            self.src_filter = section.get('src_filter','').strip() or None
+            self.src_sparse = section.get('src_sparse','').strip().split()
             # chech that we got a valid src_type if any
             if not self.src_type in VALID_FETCH_METHODS:
                raise InvalidFetchMethodError(
@@ -351,6 +392,34 @@ class Minibuild(object):
         self.parse_vars()
         self.minibuild_config = config
         self.python = self.choose_python(section.get('python','').strip())
+        if cache is not None:
+            cache.set(self.path, stamp, self.dump())
+        return self
+
+    def dump(self):
+        """Parsed metadata as plain python types."""
+        data = {}
+        for field in FIELDS:
+            value = getattr(self, field)
+            if isinstance(value, list):
+                value = value[:]
+            data[field] = value
+        data['sections'] = [
+            (section, self.minibuild_config._sections[section].items())
+            for section in self.minibuild_config._sections]
+        return data
+
+    def restore(self, data):
+        """Set the metadata from a dump() result."""
+        for field in FIELDS:
+            value = data[field]
+            if isinstance(value, list):
+                value = value[:]
+            setattr(self, field, value)
+        config = ConfigParser.ConfigParser()
+        for section, items in data['sections']:
+            config._sections[section] = config._dict(items)
+        self.minibuild_config = config
         return self
 
     def write(self,
@@ -367,6 +436,9 @@ class Minibuild(object):
               src_md5 = None,
               python = None,
               scm_branch = None,
+              src_depth = None,
+              src_filter = None,
+              src_sparse = None,
              ):
         """Store/Update the minibuild config
         """
@@ -382,7 +454,10 @@ class Minibuild(object):
             ('url', url),
             ('src_opts', src_opts),
             ('python', python),
-            ('scm_branch', scm_branch),]
+            ('scm_branch', scm_branch),
+            ('src_depth', src_depth),
+            ('src_filter', src_filter),
+            ('src_sparse', src_sparse),]
         )
 
         # open config
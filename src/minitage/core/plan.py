@@ -0,0 +1,181 @@
+__docformat__ = 'restructuredtext en'
+
+from StringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+""" fields of a build step, in pretend table order for the flags"""
+FLAGS = (('fetch', 'f', ' '),
+         ('updatecode', 'F', ' '),
+         ('install', 'I', ''),
+         ('reinstall', 'R', ''),
+         ('delete', 'D', ''),
+         ('upgrade', 'U', ' '),
+         ('update', 'u', ' '))
+STEP_FIELDS = ('name', 'path', 'category', 'action', 'meta',
+               'fetch', 'updatecode', 'install', 'reinstall', 'delete',
+               'upgrade', 'update', 'python_versions',
+               'install_python_versions', 'revision', 'installed_revision')
+
+LEGEND = """
+\t FLAGS * PACKAGE_NAME [OLD_REVISION => NEW_REVISION] (python versions)
+\t f : fetch
+\t F : update the code from repository
+\t I : install the package
+\t R : reinstall the package
+\t D : delete the package
+\t U : upgrade the package to the lastest revision if any
+\t u : update the package (for example, re run buildout)
+"""
+
+
+def _str(value):
+    """JSON strings are loaded as unicode."""
+    if isinstance(value, unicode):
+        return str(value)
+    if isinstance(value, list):
+        return [_str(v) for v in value]
+    return value
+
+
+class PlanError(Exception):
+    """General BuildPlan Error."""
+
+
+class Frozen(object):
+    """Attributes can only be set at creation time."""
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is read only' % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is read only' % self.__class__.__name__)
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__
+                and self.to_dict() == other.to_dict())
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class BuildStep(Frozen):
+    """What minimerge will do for one package.
+    Attributes:
+        - name, path, category: the minibuild
+        - action: install, reinstall, delete or generate_env
+        - meta: meta packages have nothing to build
+        - fetch .. update: the pretend flags
+        - python_versions: python versions the package is built for,
+          None if it is not an egg
+        - install_python_versions: the ones not installed yet
+        - revision, installed_revision: revisions of the minibuild and
+          of the installed package (None if not installed)
+    """
+
+    def __init__(self, **kwargs):
+        unknown = [k for k in kwargs if not k in STEP_FIELDS]
+        if unknown:
+            raise PlanError('Unknown build step fields: %s' % (
+                ', '.join(unknown)))
+        for field in STEP_FIELDS:
+            value = kwargs.get(field)
+            if field == 'install_python_versions':
+                value = tuple(value or ())
+            elif field == 'python_versions' and value is not None:
+                value = tuple(value)
+            self._set(field, value)
+
+    def to_dict(self):
+        data = {}
+        for field in STEP_FIELDS:
+            data[field] = getattr(self, field)
+            if isinstance(data[field], tuple):
+                data[field] = list(data[field])
+        return data
+
+    def flags(self):
+        return ''.join([getattr(self, f) and on or off
+                        for f, on, off in FLAGS])
+
+    def __repr__(self):
+        return '<BuildStep %s %s>' % (self.flags(), self.name)
+
+
+class BuildPlan(Frozen):
+    """Ordered build steps of a minimerge run, dependencies first.
+    The plan is computed once and then used to display what will be
+    done (pretend, ask) and to run it. It can be dumped in JSON and
+    loaded back to compare runs.
+    Example::
+        >>> plan = minimerge.get_plan(['libxml2-2.7'])
+        >>> [(step.name, step.flags()) for step in plan]
+        [('zlib-1.2', 'fFI  '), ('libxml2-2.7', 'fFI  ')]
+        >>> BuildPlan.from_json(plan.to_json()) == plan
+        True
+    """
+
+    def __init__(self, action, steps=()):
+        self._set('action', action)
+        self._set('steps', tuple(steps))
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __getitem__(self, index):
+        return self.steps[index]
+
+    def names(self):
+        return [step.name for step in self.steps]
+
+    def pyvers(self):
+        """{package name: [python versions]} for the eggs."""
+        return dict([(step.name, list(step.python_versions))
+                     for step in self.steps
+                     if step.python_versions is not None])
+
+    def to_dict(self):
+        return {'action': self.action,
+                'steps': [step.to_dict() for step in self.steps]}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True, indent=1,
+                          separators=(',', ': '))
+
+    def from_dict(klass, data):
+        return klass(_str(data['action']),
+                     [BuildStep(**dict([(str(k), _str(v))
+                                        for k, v in step.items()]))
+                      for step in data['steps']])
+    from_dict = classmethod(from_dict)
+
+    def from_json(klass, text):
+        return klass.from_dict(json.loads(text))
+    from_json = classmethod(from_json)
+
+    def format(self):
+        """Return the pretend table (StringIO)."""
+        log = StringIO()
+        log.write('Action:\t%s\n\n' % self.action)
+        for step in self.steps:
+            revision, pyvers = '', ''
+            if step.upgrade:
+                revision = '[%s => %s]' % (step.installed_revision,
+                                           step.revision)
+            if step.install_python_versions:
+                pyvers = '(%s)' % ', '.join(step.install_python_versions)
+            log.write('\t\t%s * %s %s %s\n' % (
+                step.flags(), step.name, revision, pyvers))
+        log.write(LEGEND)
+        return log
+
+# vim:set et sts=4 ts=4 tw=80:
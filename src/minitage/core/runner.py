@@ -0,0 +1,216 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import select
+import signal
+import logging
+import subprocess
+
+__logger__ = 'minitage.runner'
+
+""" lines of output kept for the error messages"""
+TAIL = 50
+""" seconds without output after which we look if the command is over:
+its pipes may be kept open by a daemon it started (eg: an ssh master)"""
+POLL = 0.5
+
+
+class CommandError(Exception):
+    """A command failed, its Result is in the result attribute."""
+
+    def __init__(self, message, result):
+        Exception.__init__(self, message)
+        self.result = result
+
+
+class Result(object):
+    """What a command did.
+    Attributes
+        - command: the command
+        - returncode: its exit status, -signal if it was killed
+        - stdout, stderr: its output if it was captured, '' otherwise
+        - tail: its last lines of output, stdout and stderr mixed
+        - rusage: its resource usage (os.wait4), None if unknown
+        - duration: seconds it took
+        - timed_out: was it killed after its timeout
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.returncode = None
+        self.stdout = self.stderr = ''
+        self.tail = []
+        self.rusage = None
+        self.duration = 0
+        self.timed_out = False
+
+
+def _kill(process, group=False):
+    try:
+        if group:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            os.kill(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def run(command, logger=None, echo=False, capture=False, tail=TAIL,
+        timeout=None, log_file=None, cwd=None, env=None):
+    """Run command, reading its output as it comes so that it never
+    blocks on a full pipe.
+    Arguments
+        - command: a shell command line, or a list of arguments
+        - logger: logger of the output lines (debug level), default to
+          minitage.runner
+        - echo: write the output to our stdout and stderr as is, instead
+          of logging it
+        - capture: keep all the output in the result stdout and stderr
+        - tail: number of the last lines kept for the error messages
+        - timeout: seconds after which the command and its children are
+          killed
+        - log_file: file to append the command and its output to
+        - cwd, env: directory and environment to run the command in
+    Returns
+        - the Result
+    Exceptions
+        - CommandError if the command fails or times out
+    """
+    if logger is None:
+        logger = logging.getLogger(__logger__)
+    result = Result(command)
+    shell = isinstance(command, basestring)
+    preexec_fn = None
+    if timeout:
+        # in its own process group to kill the shell children too
+        preexec_fn = os.setpgrp
+    start = time.time()
+    process = subprocess.Popen(command, shell=shell, cwd=cwd, env=env,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               preexec_fn=preexec_fn,
+                               close_fds=True)
+    log = None
+    if log_file:
+        log = open(log_file, 'a')
+        log.write('$ %s\n' % (shell and command or ' '.join(command)))
+    out_fd, err_fd = process.stdout.fileno(), process.stderr.fileno()
+    streams = {out_fd: ([], [], sys.stdout),
+               err_fd: ([], [], sys.stderr)}
+    for fd in streams:
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    lines = result.tail
+
+    def line(text):
+        lines.append(text)
+        if len(lines) > 2 * tail:
+            del lines[:-tail]
+        if log is not None:
+            log.write('%s\n' % text)
+        if not echo:
+            logger.debug(text)
+
+    def read(fd):
+        """Read what fd has, False at its end or if it has nothing for
+        now."""
+        try:
+            data = os.read(fd, 65536)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return False
+            raise
+        if not data:
+            opened.remove(fd)
+            return False
+        pending, captured, out = streams[fd]
+        if echo:
+            out.write(data)
+            out.flush()
+        if capture:
+            captured.append(data)
+        chunks = data.split('\n')
+        pending.append(chunks[0])
+        for chunk in chunks[1:]:
+            line(''.join(pending))
+            pending[:] = [chunk]
+        return True
+
+    status = None
+    try:
+        opened = streams.keys()
+        while opened:
+            wait = POLL
+            if timeout and not result.timed_out:
+                wait = min(wait, max(0, start + timeout - time.time()))
+            try:
+                ready = select.select(opened, [], [], wait)[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                if (timeout and not result.timed_out
+                    and time.time() >= start + timeout):
+                    result.timed_out = True
+                    _kill(process, True)
+                pid, wstatus, rusage = os.wait4(process.pid, os.WNOHANG)
+                if pid:
+                    status, result.rusage = wstatus, rusage
+                    # what it wrote just before exiting, without waiting
+                    # for the daemons which may keep the pipes open
+                    for fd in opened[:]:
+                        while read(fd):
+                            pass
+                    break
+                continue
+            for fd in ready:
+                read(fd)
+        for pending, captured, out in streams.values():
+            if ''.join(pending):
+                line(''.join(pending))
+        while status is None:
+            try:
+                pid, status, result.rusage = os.wait4(process.pid, 0)
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+        if os.WIFSIGNALED(status):
+            result.returncode = -os.WTERMSIG(status)
+        else:
+            result.returncode = os.WEXITSTATUS(status)
+        # do not let subprocess wait for it again
+        process.returncode = result.returncode
+    finally:
+        if process.returncode is None:
+            _kill(process, bool(timeout))
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+        if log is not None:
+            log.close()
+    del lines[:-tail]
+    result.duration = time.time() - start
+    if result.rusage is not None:
+        logging.getLogger(__logger__).debug('\'%s\' took %.1fs (%.1fs user, %.1fs system)' % (
+            shell and command or ' '.join(command), result.duration,
+            result.rusage.ru_utime, result.rusage.ru_stime))
+    result.stdout = ''.join(streams[out_fd][1])
+    result.stderr = ''.join(streams[err_fd][1])
+    if result.returncode != 0:
+        if result.timed_out:
+            reason = 'timed out after %ss' % timeout
+        else:
+            reason = 'exited with %s' % result.returncode
+        message = '\'%s\' %s' % (
+            shell and command or ' '.join(command), reason)
+        if lines and not echo:
+            message += ', its last lines were:\n%s' % '\n'.join(lines)
+        raise CommandError(message, result)
+    return result
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,375 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import sys
+import signal
+import shutil
+import logging
+import tempfile
+import traceback
+
+
+class SchedulerError(Exception):
+    """General Scheduler Error."""
+
+
+class TaskFailedError(SchedulerError):
+    """Some tasks did not achieve correctly."""
+
+
+class DeadlockError(SchedulerError):
+    """Some tasks can never be started."""
+
+__logger__ = 'minitage.scheduler'
+
+
+class Scheduler(object):
+    """Run tasks on a bounded pool of forked workers.
+    Each task runs in its own process, so that builds which change
+    the current directory or the environment do not disturb each
+    others.
+    A task is started as soon as all the tasks it depends on did
+    succeed. When several tasks are ready, they are started in the
+    order they were added.
+    Tasks may also share limited resources (say the host they download
+    from): at most limits[resource] tasks using the resource run at the
+    same time.
+    Example::
+        >>> s = Scheduler(jobs=2)
+        >>> s.add('openssl-1', build_openssl)
+        >>> s.add('libxml2-2.7', build_libxml2)
+        >>> s.add('python-2.7', build_python, ['openssl-1', 'libxml2-2.7'])
+        >>> s.run()
+    """
+
+    def __init__(self, jobs=1, logger=None, limits=None, keep_going=False,
+                 buffered=False):
+        """
+        Arguments:
+            - jobs: maximum number of tasks to run at the same time
+            - logger: logger to report progress to
+            - limits: {resource: maximum number of tasks using it at the
+              same time}, resources which are not there are not limited
+            - keep_going: start the other tasks when one failed, the
+              failures are reported at the end
+            - buffered: write the output of each task at once when it is
+              over, instead of mixing the outputs of the running tasks
+        """
+        self.jobs = max(1, int(jobs))
+        if logger is None:
+            logger = logging.getLogger(__logger__)
+        self.logger = logger
+        self.limits = limits or {}
+        self.keep_going = keep_going
+        self.buffered = buffered
+        self.order = []
+        self.callables = {}
+        self.dependencies = {}
+        self.resources = {}
+        self.outputs = {}
+        """ keys of the tasks run successfully, even if run failed"""
+        self.done = []
+
+    def add(self, key, func=None, dependencies=None, resources=None):
+        """Register a task.
+        Arguments:
+            - key: unique task name
+            - func: callable to run in the worker, None for a task
+              which has nothing to do but to wait for its dependencies
+            - dependencies: keys of the tasks to wait for
+            - resources: the resources the task uses, see limits
+        """
+        if key in self.callables:
+            raise SchedulerError('Task \'%s\' is already scheduled' % key)
+        if dependencies is None:
+            dependencies = []
+        self.order.append(key)
+        self.callables[key] = func
+        self.dependencies[key] = list(dependencies)
+        self.resources[key] = list(resources or [])
+
+    def run(self):
+        """Run all the tasks.
+        Exceptions:
+            - TaskFailedError if any task failed, the tasks depending on
+              it are not started.
+            - DeadlockError if some tasks wait on each other.
+        Return:
+            - the list of the keys of the tasks which have been run, in
+              completion order.
+        """
+        waiting, dependents = {}, {}
+        for key in self.order:
+            dependents.setdefault(key, [])
+            waiting[key] = set([d for d in self.dependencies[key]
+                                if d in self.callables and d != key])
+            for dep in waiting[key]:
+                dependents.setdefault(dep, []).append(key)
+        pending = self.order[:]
+        running, failed = {}, []
+        done = self.done = []
+        busy = dict([(r, 0) for r in self.limits])
+        try:
+            while pending or running:
+                # completing a no-op task may release others, loop until
+                # nothing more can be started.
+                released = self.keep_going or not failed
+                while released:
+                    released = False
+                    for key in pending[:]:
+                        if waiting[key]:
+                            continue
+                        if self.callables[key] is None:
+                            pending.remove(key)
+                            self._complete(key, waiting, dependents, done)
+                            released = True
+                        elif (len(running) < self.jobs
+                              and self._available(key, busy)):
+                            pending.remove(key)
+                            self._use(key, busy, 1)
+                            running[self._spawn(key)] = key
+                if not running:
+                    break
+                pid, status = os.waitpid(-1, 0)
+                key = running.pop(pid, None)
+                if key is None:
+                    continue
+                self._use(key, busy, -1)
+                self._output(key)
+                if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                    self.logger.debug('Task %s finished.' % key)
+                    self._complete(key, waiting, dependents, done)
+                else:
+                    self.logger.error('Task %s failed.' % key)
+                    failed.append(key)
+        except KeyboardInterrupt:
+            for pid in running:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            for key in running.values():
+                self._output(key)
+            raise
+        if failed:
+            message = 'Those tasks failed: %s' % ', '.join(failed)
+            if pending:
+                message += '\nThose tasks were not run: %s' % (
+                    ', '.join(pending))
+            raise TaskFailedError(message)
+        if pending:
+            raise DeadlockError(
+                'Those tasks wait for each other: %s' % ', '.join(pending))
+        return done
+
+    def _available(self, key, busy):
+        """Can the task start without going over a resource limit."""
+        for resource in self.resources[key]:
+            if resource in self.limits:
+                if busy[resource] >= self.limits[resource]:
+                    return False
+        return True
+
+    def _use(self, key, busy, count):
+        for resource in self.resources[key]:
+            if resource in busy:
+                busy[resource] += count
+
+    def _output(self, key):
+        """Write the buffered output of a task which is over."""
+        path = self.outputs.pop(key, None)
+        if path is None:
+            return
+        fic = open(path)
+        try:
+            output = fic.read()
+        finally:
+            fic.close()
+        os.remove(path)
+        if output:
+            sys.stdout.write(output)
+            sys.stdout.flush()
+
+    def _complete(self, key, waiting, dependents, done):
+        done.append(key)
+        for dependent in dependents[key]:
+            waiting[dependent].discard(key)
+
+    def _spawn(self, key):
+        """Fork a worker for a task and return its pid."""
+        self.logger.info('Starting task %s.' % key)
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        output = None
+        if self.buffered:
+            fd, output = tempfile.mkstemp(prefix='minitage-task-')
+            self.outputs[key] = output
+        pid = os.fork()
+        if pid:
+            if output is not None:
+                os.close(fd)
+            return pid
+        # worker side: never go back to the caller code.
+        ret = 0
+        try:
+            try:
+                if output is not None:
+                    # the commands the task runs write there too
+                    os.dup2(fd, 1)
+                    os.dup2(fd, 2)
+                    os.close(fd)
+                self.callables[key]()
+            except BaseException:
+                self.logger.error(
+                    'Task %s failed:\n%s' % (key, traceback.format_exc()))
+                ret = 1
+        finally:
+            logging.shutdown()
+            for stream in (sys.stdout, sys.stderr):
+                try:
+                    stream.flush()
+                except Exception:
+                    pass
+            os._exit(ret)
+
+
+class Prefetcher(object):
+    """Run tasks in order in a forked background worker, at most ahead
+    tasks further than the ones the caller did join.
+    The worker waits for the caller to join a task before starting the
+    next one over the limit, so that it stays ahead without running
+    away. The output of each task is kept until it is joined.
+    Example::
+        >>> p = Prefetcher([('zlib-1', fetch_zlib),
+        ...                 ('openssl-1', fetch_openssl)], ahead=1)
+        >>> p.start()
+        >>> p.join('zlib-1') # waits for zlib to be fetched
+        True
+        >>> build_zlib() # openssl is fetched meanwhile
+        >>> p.join('openssl-1')
+        True
+        >>> p.stop()
+    """
+
+    def __init__(self, tasks, ahead=1, logger=None):
+        """
+        Arguments:
+            - tasks: [(key, callable)] in the order to run them
+            - ahead: number of tasks the worker can run before the
+              caller joins the first one
+            - logger: logger to report progress to
+        """
+        self.tasks = list(tasks)
+        self.keys = [key for key, func in self.tasks]
+        self.ahead = max(1, int(ahead))
+        if logger is None:
+            logger = logging.getLogger(__logger__)
+        self.logger = logger
+        self.results = {}
+        self.pid = None
+        self.directory = None
+
+    def start(self):
+        self.directory = tempfile.mkdtemp(prefix='minitage-prefetch-')
+        go_r, go_w = os.pipe()
+        done_r, done_w = os.pipe()
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        pid = os.fork()
+        if pid:
+            os.close(go_r)
+            os.close(done_w)
+            self.pid, self._go, self._done = pid, go_w, os.fdopen(done_r)
+            os.write(self._go, '.' * self.ahead)
+            return
+        # worker side: never go back to the caller code.
+        ret = 0
+        try:
+            try:
+                os.close(go_w)
+                os.close(done_r)
+                for i, (key, func) in enumerate(self.tasks):
+                    # one token for each task to run, no more tokens when
+                    # the caller is gone
+                    if not os.read(go_r, 1):
+                        break
+                    output = os.path.join(self.directory, '%s' % i)
+                    ok = self._run(key, func, output)
+                    os.write(done_w, '%s %s %s\n' % (int(ok), output, key))
+            except BaseException:
+                ret = 1
+        finally:
+            logging.shutdown()
+            os._exit(ret)
+
+    def _run(self, key, func, output):
+        """Run a task in the worker, its output going to output."""
+        fd = os.open(output, os.O_WRONLY | os.O_CREAT, 0600)
+        saved = os.dup(1), os.dup(2)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+        try:
+            try:
+                func()
+                return True
+            except Exception:
+                self.logger.error(
+                    'Task %s failed:\n%s' % (key, traceback.format_exc()))
+                return False
+        finally:
+            for stream in (sys.stdout, sys.stderr):
+                stream.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+    def join(self, key):
+        """Wait for the task key and write its output.
+        Returns
+            - True if it succeeded, False if it failed or could not be
+              run, None if the task is not one of ours.
+        """
+        if self.pid is None or not key in self.keys:
+            return None
+        while not key in self.results:
+            line = self._done.readline()
+            if not line:
+                self.logger.error('The background worker is gone.')
+                self.results[key] = (False, None)
+                break
+            ok, output, done = line.rstrip('\n').split(' ', 2)
+            self.results[done] = (ok == '1', output)
+        ok, output = self.results[key]
+        if output is not None and os.path.exists(output):
+            fic = open(output)
+            try:
+                sys.stdout.write(fic.read())
+                sys.stdout.flush()
+            finally:
+                fic.close()
+            os.remove(output)
+        try:
+            # the worker can go one task further
+            os.write(self._go, '.')
+        except OSError:
+            pass
+        return ok
+
+    def stop(self):
+        """Stop the worker once its current task is over (a task killed
+        in the middle would leave a half fetched package), the other
+        tasks are dropped."""
+        if self.pid is None:
+            return
+        pid, self.pid = self.pid, None
+        os.close(self._go)
+        self._done.close()
+        try:
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+# vim:set et sts=4 ts=4 tw=80:
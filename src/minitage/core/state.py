@@ -0,0 +1,224 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import time
+
+try:
+    import sqlite3
+except ImportError:
+    try:
+        from pysqlite2 import dbapi2 as sqlite3
+    except ImportError:
+        sqlite3 = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    path TEXT PRIMARY KEY,
+    revision INTEGER,
+    minibuild TEXT
+);
+CREATE TABLE IF NOT EXISTS markers (
+    path TEXT,
+    marker TEXT,
+    value TEXT,
+    PRIMARY KEY (path, marker)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class StateError(Exception):
+    """General State Error."""
+
+
+class StateDB(object):
+    """Installed packages state, stored in one SQLite database.
+    Packages are keyed on their install path. For each of them, we keep
+    the markers (fetch, install, install-X.Y), the installed revision
+    and the recorded minibuild.
+    The marker files of the packages installed by older minitage versions
+    are imported once (see import_files), the database is then trusted and
+    the files are never read again. Until then, the files of the packages
+    which are not recorded are read instead.
+    The connection is reopened in forked processes.
+    Example::
+        >>> db = StateDB('/prefix/.minitage/state.db')
+        >>> db.set_marker(ipath, history, 'install', 'install')
+        >>> db.get_markers(ipath, history)
+        {'install': 'install'}
+    """
+
+    def __init__(self, path):
+        if sqlite3 is None:
+            raise StateError('sqlite3 is not available')
+        self.path = path
+        self._connection = None
+        self._pid = None
+        self._imported = False
+        # connections inherited from a parent process, never closed here
+        self._inherited = []
+
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            if self._connection is not None:
+                self._inherited.append(self._connection)
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.text_factory = str
+            for attempt in range(3):
+                try:
+                    connection.executescript(SCHEMA)
+                    break
+                except sqlite3.OperationalError:
+                    # the schema was made meanwhile by another process
+                    if attempt == 2:
+                        raise
+            connection.commit()
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+    def imported(self):
+        """Were the marker files imported, see import_files."""
+        if not self._imported and os.path.exists(self.path):
+            self._imported = self.connection().execute(
+                'SELECT value FROM settings WHERE key = ?',
+                ('imported',)).fetchone() is not None
+        return self._imported
+
+    def import_files(self, histories):
+        """Import the marker files of the packages which are not recorded
+        yet, the database is trusted afterwards.
+        Arguments
+            - histories: {install path: history directory}
+        """
+        connection = self.connection()
+        for path, history in histories.items():
+            self._ensure(path, history)
+        connection.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)',
+                           ('imported', repr(time.time())))
+        connection.commit()
+        self._imported = True
+
+    def _read_files(self, history):
+        """{marker: value} of the marker files."""
+        markers = {}
+        hd = os.path.join(history, 'markers')
+        if os.path.isdir(hd):
+            for marker in os.listdir(hd):
+                fmarker = os.path.join(hd, marker)
+                if os.path.isfile(fmarker):
+                    markers[marker] = open(fmarker).read()
+        return markers
+
+    def _row(self, path, status=None):
+        """State of path, from status (see status) if given."""
+        if status is not None:
+            return status.get(path)
+        return self._status('WHERE packages.path = ?', (path,)).get(path)
+
+    def _ensure(self, path, history):
+        """Record path, with its marker files if the database is not
+        trusted yet."""
+        connection = self.connection()
+        if connection.execute('SELECT path FROM packages WHERE path = ?',
+                              (path,)).fetchone() is not None:
+            return
+        connection.execute('INSERT INTO packages (path) VALUES (?)', (path,))
+        if not self.imported():
+            for marker, value in self._read_files(history).items():
+                connection.execute(
+                    'INSERT OR REPLACE INTO markers VALUES (?, ?, ?)',
+                    (path, marker, value))
+
+    def _write(self, path, history, sql, args):
+        self._ensure(path, history)
+        connection = self.connection()
+        connection.execute(sql, args)
+        connection.commit()
+
+    def get_markers(self, path, history, status=None):
+        """Return {marker: value} for the package installed in path.
+        Arguments
+            - status: the result of status, not to query the database
+        """
+        row = self._row(path, status)
+        if row is not None:
+            return dict(row['markers'])
+        if self.imported():
+            return {}
+        return self._read_files(history)
+
+    def set_marker(self, path, history, marker, value=''):
+        self._write(path, history,
+                    'INSERT OR REPLACE INTO markers VALUES (?, ?, ?)',
+                    (path, marker, value))
+
+    def get_revision(self, path, history, status=None):
+        """Installed revision, None if it was never recorded."""
+        row = self._row(path, status)
+        if row is not None:
+            return row['revision']
+
+    def get_minibuild(self, path, history):
+        """Recorded minibuild content, None if it was never recorded."""
+        if not os.path.exists(self.path):
+            return None
+        row = self.connection().execute(
+            'SELECT minibuild FROM packages WHERE path = ?',
+            (path,)).fetchone()
+        if row is not None:
+            return row[0]
+
+    def record(self, path, history, revision, minibuild):
+        """Record the installed revision and minibuild."""
+        self._write(path, history,
+                    'UPDATE packages SET revision = ?, minibuild = ? '
+                    'WHERE path = ?', (revision, minibuild, path))
+
+    def set_revision(self, path, history, revision):
+        self._write(path, history,
+                    'UPDATE packages SET revision = ? WHERE path = ?',
+                    (revision, path))
+
+    def forget(self, path):
+        """Drop the state of the package installed in path."""
+        connection = self.connection()
+        connection.execute('DELETE FROM markers WHERE path = ?', (path,))
+        connection.execute('DELETE FROM packages WHERE path = ?', (path,))
+        connection.commit()
+
+    def _status(self, where='', args=()):
+        status = {}
+        if not os.path.exists(self.path):
+            # nothing recorded yet, do not make the database to read it
+            return status
+        for path, revision, marker, value in self.connection().execute(
+            'SELECT packages.path, revision, marker, value FROM packages '
+            'LEFT JOIN markers ON packages.path = markers.path %s' % where,
+            args):
+            state = status.setdefault(path, {'revision': revision,
+                                             'markers': {}})
+            if marker is not None:
+                state['markers'][marker] = value
+        return status
+
+    def status(self):
+        """State of all the packages, in one query: give it to get_markers
+        and get_revision not to query the database for each package.
+        Return:
+            - {install path: {'revision': revision,
+                              'markers': {marker: value}}}
+        """
+        return self._status()
+
+# vim:set et sts=4 ts=4 tw=80:
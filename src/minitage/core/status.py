@@ -0,0 +1,79 @@
+__docformat__ = 'restructuredtext en'
+
+
+class StatusCache(object):
+    """Memoize the packages status queries for one minimerge run.
+    Entries are kept by package name and dropped when the package
+    state is written (markers, recorded minibuild, deletion).
+    The cache is only active between start() and stop(), out of a run
+    the status is always read again.
+    The state of all the packages (StateDB.status) is also kept, it is
+    read again once a package state is written.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.entries = {}
+        self.state = None
+        self.hits = 0
+        self.misses = 0
+        # stats, opens and database queries done to compute the entries
+        self.reads = 0
+        # and the ones the cache hits avoided
+        self.saved = 0
+
+    def start(self):
+        self.entries = {}
+        self.state = None
+        self.active = True
+
+    def stop(self):
+        self.entries = {}
+        self.state = None
+        self.active = False
+
+    def read(self):
+        """Count a stat, an open or a state database query."""
+        self.reads += 1
+
+    def invalidate(self, name):
+        """Forget everything about the package name."""
+        self.entries.pop(name, None)
+        self.state = None
+
+    def report(self):
+        return ('Status cache: %s hits, %s misses, '
+                '%s filesystem and database reads avoided out of %s.' % (
+                    self.hits, self.misses, self.saved,
+                    self.saved + self.reads))
+
+
+def memoized(func):
+    """Cache the result of a Minimerge method taking a package (and
+    any hashable arguments) during a run. The minimerge flags the
+    status depends on are part of the key."""
+    name = func.__name__
+
+    def wrapper(self, package, *args):
+        cache = self.status_cache
+        if not cache.active:
+            return func(self, package, *args)
+        key = (name, package.path, package.revision,
+               self._action, self._update, self._upgrade,
+               tuple(self.pyvers.get(package.name, ()))) + args
+        entries = cache.entries.setdefault(package.name, {})
+        if key in entries:
+            value, cost = entries[key]
+            cache.hits += 1
+            cache.saved += cost
+            return value
+        reads = cache.reads
+        value = func(self, package, *args)
+        cache.misses += 1
+        entries[key] = (value, cache.reads - reads)
+        return value
+    wrapper.__name__ = name
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,173 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import errno
+import shutil
+import time
+
+try:
+    from hashlib import md5, sha256
+except ImportError:
+    from md5 import new as md5
+    sha256 = None
+
+from minitage.core.common import CHUNK_SIZE
+
+""" store shared by all the prefixes of the host"""
+DEFAULT_STORE = os.path.join('~', '.minitage', 'store')
+ALGORITHMS = ('md5', 'sha256')
+_stores = {}
+
+
+def get_store(path=None):
+    """Return the DownloadStore at path, the default one if path is
+    None, None if path is 'none'."""
+    if path is None or not path.strip():
+        path = DEFAULT_STORE
+    if path.strip().lower() == 'none':
+        return None
+    path = os.path.abspath(os.path.expanduser(path.strip()))
+    if not path in _stores:
+        _stores[path] = DownloadStore(path)
+    return _stores[path]
+
+
+def digests(filepath):
+    """{algorithm: hexdigest} of filepath, read once."""
+    hashes = {'md5': md5()}
+    if sha256 is not None:
+        hashes['sha256'] = sha256()
+    fobj = open(filepath, 'rb')
+    try:
+        while True:
+            data = fobj.read(CHUNK_SIZE)
+            if not data:
+                break
+            for h in hashes.values():
+                h.update(data)
+    finally:
+        fobj.close()
+    return dict([(a, h.hexdigest()) for a, h in hashes.items()])
+
+
+def _link(src, dest):
+    """Atomically hardlink src to dest, copy it on another filesystem."""
+    tmp = '%s.store-%s' % (dest, os.getpid())
+    try:
+        os.link(src, tmp)
+    except OSError, e:
+        if not e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(src, tmp)
+    try:
+        os.rename(tmp, dest)
+    except OSError:
+        os.remove(tmp)
+        raise
+
+
+class DownloadStore(object):
+    """Content addressed store of the downloaded files.
+    Files are kept in <store>/md5/<2 first chars>/<md5>, hardlinked as
+    <store>/sha256/../<sha256>, and hardlinked in turn where they are
+    used (.download directories, download caches). The same archive is
+    then downloaded and stored once per host, whatever the number of
+    packages and prefixes using it.
+    The link count of a stored file tells if something still uses it,
+    see prune.
+    Example::
+        >>> store = get_store()
+        >>> store.add('/prefix/dependencies/zlib-1.2/.download/zlib.tgz')
+        >>> store.link('<md5>', '/prefix2/dependencies/zlib-1.2/.download/zlib.tgz')
+        True
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _path(self, algorithm, digest):
+        return os.path.join(self.path, algorithm, digest[:2], digest)
+
+    def get(self, md5=None, sha256=None):
+        """Path of the stored file with one of the digests, or None."""
+        for algorithm, digest in (('md5', md5), ('sha256', sha256)):
+            if digest:
+                path = self._path(algorithm, digest.lower())
+                if os.path.isfile(path):
+                    return path
+
+    def link(self, md5, dest, sha256=None):
+        """Put the stored file with that digest in dest.
+        Returns
+            - True if the store had it
+        """
+        path = self.get(md5, sha256)
+        if path is None:
+            return False
+        directory = os.path.dirname(dest)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if not (os.path.exists(dest) and os.path.samefile(path, dest)):
+            _link(path, dest)
+        return True
+
+    def add(self, filepath, md5=None):
+        """Store filepath, a file already stored is replaced by a link to
+        the store copy.
+        Arguments:
+            - md5: the md5 of the file if it is known, it is trusted.
+        Returns
+            - the stored path
+        """
+        stored = md5 and self.get(md5)
+        if not stored:
+            hashes = digests(filepath)
+            stored = self.get(**hashes)
+            if not stored:
+                stored = self._path('md5', hashes['md5'])
+                for algorithm in ALGORITHMS:
+                    if algorithm in hashes:
+                        path = self._path(algorithm, hashes[algorithm])
+                        if not os.path.isdir(os.path.dirname(path)):
+                            os.makedirs(os.path.dirname(path))
+                        if algorithm == 'md5':
+                            _link(filepath, path)
+                        else:
+                            _link(stored, path)
+                return stored
+        if not os.path.samefile(stored, filepath):
+            _link(stored, filepath)
+        return stored
+
+    def prune(self, max_age=0):
+        """Remove the files nothing uses anymore, the ones with no other
+        links than their store entries, if they were not stored or
+        linked since max_age seconds.
+        Returns
+            - (number of files, bytes) removed
+        """
+        entries = {}
+        for algorithm in ALGORITHMS:
+            top = os.path.join(self.path, algorithm)
+            if not os.path.isdir(top):
+                continue
+            for prefix in os.listdir(top):
+                directory = os.path.join(top, prefix)
+                for name in os.listdir(directory):
+                    path = os.path.join(directory, name)
+                    st = os.stat(path)
+                    entries.setdefault((st.st_dev, st.st_ino),
+                                       [st, []])[1].append(path)
+        count = size = 0
+        now = time.time()
+        for st, paths in entries.values():
+            # linking or unlinking the file updates its ctime
+            if st.st_nlink > len(paths) or now - st.st_ctime < max_age:
+                continue
+            for path in paths:
+                os.remove(path)
+            count += 1
+            size += st.st_size
+        return count, size
+
+# vim:set et sts=4 ts=4 tw=80:
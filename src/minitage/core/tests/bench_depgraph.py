@@ -0,0 +1,104 @@
+"""Benchmark the dependency resolution over synthetic minilays.
+
+Usage::
+
+    python -m minitage.core.tests.bench_depgraph [nodes] [max deps]
+
+The legacy recursive resolution is timed too when the graph is small
+enough not to hit the recursion limit.
+"""
+__docformat__ = 'restructuredtext en'
+
+import sys
+import time
+import random
+
+from minitage.core import graph
+
+
+class Node(object):
+
+    def __init__(self, name, dependencies):
+        self.name = name
+        self.dependencies = dependencies
+
+
+def make_tree(size, max_deps, seed=0):
+    """Random DAG, each node depends on older ones."""
+    rand = random.Random(seed)
+    nodes = {}
+    for i in range(size):
+        deps = []
+        if i:
+            for j in range(rand.randint(0, max_deps)):
+                dep = 'mb-%s' % rand.randint(max(0, i - 50), i - 1)
+                if not dep in deps:
+                    deps.append(dep)
+        nodes['mb-%s' % i] = Node('mb-%s' % i, deps)
+    return nodes
+
+
+def leaves(nodes):
+    """Nodes nothing depends on."""
+    used = set()
+    for node in nodes.values():
+        used.update(node.dependencies)
+    return sorted([name for name in nodes if not name in used])
+
+
+def legacy(resolve, packages, ancestors=None):
+    """The list insertion algorithm minimerge used before the graph
+    engine."""
+    if ancestors is None:
+        ancestors = []
+    for package in packages:
+        mb = resolve(package)
+        index = len(ancestors)
+        for ancestor in ancestors:
+            if mb.name in ancestor.dependencies:
+                index = ancestors.index(ancestor)
+                break
+        if not mb in ancestors:
+            ancestors.insert(index, mb)
+        ancestors = legacy(resolve, mb.dependencies, ancestors)
+    return ancestors
+
+
+def bench(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    size = 5000
+    max_deps = 3
+    if argv:
+        size = int(argv[0])
+    if len(argv) > 1:
+        max_deps = int(argv[1])
+    nodes = make_tree(size, max_deps)
+    roots = leaves(nodes)
+    for order in graph.ORDERS:
+        g = graph.DependencyGraph(nodes.__getitem__)
+        duration, result = bench(g.sort, roots, order)
+        print '%-8s %6d nodes sorted in %.3fs' % (order, len(result), duration)
+    # the legacy algorithm walks every path, only try it on small trees:
+    # chains, then branching DAGs
+    for small_deps in (1, 2, 3):
+        small = make_tree(300, small_deps)
+        sroots = leaves(small)
+        duration, lresult = bench(legacy, small.__getitem__, sroots)
+        g = graph.DependencyGraph(small.__getitem__)
+        gduration, gresult = bench(g.sort, sroots)
+        print ('legacy   %6d nodes (max deps %s) sorted in %.3fs '
+               '(graph: %.3fs, same order: %s)' % (
+                   len(lresult), small_deps, duration, gduration,
+                   lresult == gresult))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set et sts=4 ts=4 tw=80:
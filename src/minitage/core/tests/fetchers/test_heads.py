@@ -0,0 +1,108 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from minitage.core.fetchers import scm, heads
+from minitage.core.tests.base import TestCase
+
+
+class testHeads(TestCase):
+    """Remote heads tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.repo = os.path.join(self.path, 'repo')
+        self.uri = 'file://%s' % self.repo
+        self.cache = os.path.join(self.path, 'remote-heads.json')
+        self.dest = os.path.join(self.path, 'wc')
+        os.system("""
+                  export GIT_AUTHOR_NAME=minitage GIT_AUTHOR_EMAIL=m@m
+                  export GIT_COMMITTER_NAME=minitage GIT_COMMITTER_EMAIL=m@m
+                  mkdir -p %s
+                  cd %s
+                  echo '666'>file
+                  git init -q
+                  git add .
+                  git commit -q -m 'initial import'
+                  git clone -q %s %s
+                  """ % (self.repo, self.repo, self.uri, self.dest))
+        self.git = scm.GitFetcher()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def commit(self, name):
+        os.system("""
+                  export GIT_AUTHOR_NAME=minitage GIT_AUTHOR_EMAIL=m@m
+                  export GIT_COMMITTER_NAME=minitage GIT_COMMITTER_EMAIL=m@m
+                  cd %s
+                  echo '666'>%s
+                  git add .
+                  git commit -q -m %s
+                  """ % (self.repo, name, name))
+
+    def item(self):
+        return (self.git, self.uri, None, self.dest)
+
+    def testGitHead(self):
+        head = self.git.get_remote_head(self.uri)
+        self.assertEquals(
+            head,
+            os.popen('git --git-dir=%s/.git rev-parse HEAD' % (
+                self.repo)).read().strip())
+        self.assertTrue(self.git.has_head(self.dest, head))
+        self.commit('second')
+        head = self.git.get_remote_head(self.uri)
+        self.assertFalse(self.git.has_head(self.dest, head))
+        self.assertEquals(self.git.get_remote_head(self.uri, 'nobranch'),
+                          None)
+
+    def testMoved(self):
+        rheads = heads.RemoteHeads(self.cache)
+        self.assertEquals(rheads.moved([self.item()]), [False])
+        rheads.save()
+        self.commit('second')
+        # still trusted
+        rheads = heads.RemoteHeads(self.cache)
+        self.assertEquals(rheads.moved([self.item()]), [False])
+        # expired
+        rheads = heads.RemoteHeads(self.cache, ttl=0)
+        self.assertEquals(rheads.moved([self.item()]), [True])
+
+    def testUnknown(self):
+        """Working copies are updated when the remote cannot be asked."""
+        rheads = heads.RemoteHeads(self.cache)
+        items = [self.item(),
+                 (self.git, 'file:///proc/no/repo', None, self.dest),
+                 (scm.SvnFetcher(), 'file:///proc/no/repo', None, self.dest)]
+        self.assertEquals(rheads.moved(items), [False, True, True])
+        rheads.save()
+        rheads = heads.RemoteHeads(self.cache)
+        self.assertEquals(len(rheads.heads), 1)
+
+    def testConcurrent(self):
+        """Remotes are asked at the same time."""
+        class Slow(object):
+            name = 'slow'
+            def get_remote_head(self, uri, branch=None):
+                time.sleep(0.5)
+                return uri
+            def has_head(self, dest, head):
+                return True
+        rheads = heads.RemoteHeads(self.cache, jobs=4)
+        start = time.time()
+        items = [(Slow(), 'uri%s' % i, None, self.dest) for i in range(4)]
+        self.assertEquals(rheads.moved(items), [False] * 4)
+        self.assertTrue(time.time() - start < 1.5)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(testHeads))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
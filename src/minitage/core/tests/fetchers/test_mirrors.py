@@ -0,0 +1,133 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from minitage.core.fetchers import scm, mirrors
+from minitage.core.tests.base import TestCase
+
+
+class testMirrors(TestCase):
+    """Local mirrors tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.repo = os.path.join(self.path, 'repo')
+        self.uri = 'file://%s' % self.repo
+        self.prefix = os.path.join(self.path, 'prefix')
+        os.system("""
+                  export GIT_AUTHOR_NAME=minitage GIT_AUTHOR_EMAIL=m@m
+                  export GIT_COMMITTER_NAME=minitage GIT_COMMITTER_EMAIL=m@m
+                  mkdir -p %s
+                  cd %s
+                  echo '666'>file
+                  git init -q
+                  git add .
+                  git commit -q -m 'initial import'
+                  """ % (self.repo, self.repo))
+        mirrors._mirrors.clear()
+        self.git = scm.GitFetcher({'minimerge': {'prefix': self.prefix}})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def commit(self, name):
+        os.system("""
+                  export GIT_AUTHOR_NAME=minitage GIT_AUTHOR_EMAIL=m@m
+                  export GIT_COMMITTER_NAME=minitage GIT_COMMITTER_EMAIL=m@m
+                  cd %s
+                  echo '666'>%s
+                  git add .
+                  git commit -q -m %s
+                  """ % (self.repo, name, name))
+
+    def testGetMirrors(self):
+        self.assertEquals(
+            self.git.mirrors.path,
+            os.path.join(self.prefix, '.minitage', 'mirrors'))
+        self.assertEquals(mirrors.get_mirrors({}), None)
+        self.assertEquals(mirrors.get_mirrors(
+            {'minimerge': {'prefix': self.prefix, 'mirrors': 'none'}}), None)
+        self.assertTrue(mirrors.get_mirrors(
+            {'minimerge': {'mirrors': self.path}}) is mirrors.get_mirrors(
+            {'minimerge': {'prefix': '/p', 'mirrors': self.path}}))
+
+    def testGitCheckout(self):
+        """Working copies get the objects of the mirror, they do not
+        borrow them as the mirror may drop them."""
+        dest = os.path.join(self.path, 'wc1')
+        self.git.fetch(dest, self.uri)
+        mirror = self.git.mirrors.get_path('git', self.uri)
+        self.assertTrue(os.path.isfile(os.path.join(mirror, 'HEAD')))
+        self.assertFalse(os.path.exists(os.path.join(
+            dest, '.git', 'objects', 'info', 'alternates')))
+        shutil.rmtree(mirror)
+        self.assertEquals(os.system(
+            'git --git-dir=%s/.git fsck --no-progress 2>/dev/null' % dest), 0)
+        self.assertEquals(self.git.get_uri(dest), self.uri)
+        self.assertFalse(self.git._has_uri_changed(dest, self.uri))
+
+    def head(self, repo):
+        return os.popen('git --git-dir=%s rev-parse HEAD' % repo).read()
+
+    def testRefreshedOnce(self):
+        """A mirror is refreshed once by process."""
+        self.git.fetch(os.path.join(self.path, 'wc1'), self.uri)
+        mirror = self.git.mirrors.get_path('git', self.uri)
+        first = self.head(mirror)
+        self.commit('second')
+        dest = os.path.join(self.path, 'wc2')
+        self.git.fetch(dest, self.uri)
+        self.assertTrue(os.path.isfile(os.path.join(dest, 'second')))
+        self.assertEquals(self.head(mirror), first)
+        # another run
+        mirrors._mirrors.clear()
+        git = scm.GitFetcher({'minimerge': {'prefix': self.prefix}})
+        git.update(dest, self.uri)
+        self.assertEquals(self.head(mirror),
+                          self.head(os.path.join(self.repo, '.git')))
+        self.assertNotEquals(self.head(mirror), first)
+
+    def testBorrowingWorkingCopy(self):
+        """Working copies of older versions stop borrowing objects."""
+        dest = os.path.join(self.path, 'wc1')
+        os.system('git clone -q --mirror %s %s' % (
+            self.uri, os.path.join(self.path, 'old')))
+        os.system('git clone -q --reference %s %s %s' % (
+            os.path.join(self.path, 'old'), self.uri, dest))
+        self.git.update(dest, self.uri)
+        self.assertFalse(os.path.exists(os.path.join(
+            dest, '.git', 'objects', 'info', 'alternates')))
+        shutil.rmtree(os.path.join(self.path, 'old'))
+        self.assertEquals(os.system(
+            'git --git-dir=%s/.git fsck --no-progress 2>/dev/null' % dest), 0)
+
+    def testNotMoved(self):
+        """The mirror is not refreshed when the remote did not move."""
+        dest = os.path.join(self.path, 'wc1')
+        self.git.fetch(dest, self.uri)
+        mirror = self.git.mirrors.get_path('git', self.uri)
+        first = self.head(mirror)
+        self.commit('second')
+        mirrors._mirrors.clear()
+        git = scm.GitFetcher({'minimerge': {'prefix': self.prefix}})
+        git.update(dest, self.uri, {'refresh_mirror': False})
+        self.assertEquals(self.head(mirror), first)
+        self.assertTrue(os.path.isfile(os.path.join(dest, 'second')))
+
+    def testNoMirror(self):
+        """A repository which cannot be mirrored is cloned as before."""
+        self.git.mirrors.path = '/proc/no/mirrors'
+        dest = os.path.join(self.path, 'wc1')
+        self.git.fetch(dest, self.uri)
+        self.assertTrue(os.path.isfile(os.path.join(dest, 'file')))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(testMirrors))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
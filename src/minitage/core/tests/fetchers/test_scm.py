@@ -139,6 +139,28 @@ class testGit(base.TestCase):
         git.update(opts['dest'],  'file://%s' % opts['path'])
         self.assertTrue(os.path.isfile(os.path.join(opts['dest'], 'file2')))
 
+    def testUpdatePinnedRevision(self):
+        """A revision already there is checked out without the remote."""
+        opts = self.opts
+        git = scm.GitFetcher()
+        git.fetch(opts['dest'], 'file://%s' % opts['path'])
+        revision = os.popen('git --git-dir=%s/.git rev-parse HEAD~' % (
+            opts['dest'])).read().strip()
+        self.assertTrue(git.has_revision(opts['dest'], revision))
+        self.assertFalse(git.has_revision(opts['dest'], 'HEAD~'))
+        self.assertFalse(git.has_revision(opts['dest'], '0' * 40))
+        # abbreviated ids may be names which move
+        self.assertFalse(git.has_revision(opts['dest'], revision[:8]))
+        os.system('git --git-dir=%s/.git branch %s' % (
+            opts['dest'], revision[:8]))
+        self.assertFalse(git.has_revision(opts['dest'], revision[:8]))
+        def update_wc(*args, **kwargs):
+            self.fail('the remote was asked')
+        git.update_wc = update_wc
+        git.update(opts['dest'], 'file://%s' % opts['path'],
+                   dict(revision=revision))
+        self.assertFalse(os.path.isfile(os.path.join(opts['dest'], 'file2')))
+
     def testFetchOrUpdate_fetch(self):
         """testFetchOrUpdate_fetch"""
         opts = self.opts
@@ -0,0 +1,75 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from minitage.core.fetchers import scm
+from minitage.core.tests.base import TestCase
+
+
+class testShallowGit(TestCase):
+    """Shallow, partial and sparse git checkouts tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.repo = os.path.join(self.path, 'repo')
+        self.uri = 'file://%s' % self.repo
+        self.dest = os.path.join(self.path, 'wc')
+        os.system("""
+                  export GIT_AUTHOR_NAME=minitage GIT_AUTHOR_EMAIL=m@m
+                  export GIT_COMMITTER_NAME=minitage GIT_COMMITTER_EMAIL=m@m
+                  mkdir -p %(repo)s/src %(repo)s/doc
+                  cd %(repo)s
+                  git init -q
+                  git config uploadpack.allowFilter true
+                  for i in 1 2 3 4 5;do
+                      echo $i>src/file$i
+                      echo $i>doc/file$i
+                      git add .
+                      git commit -q -m $i
+                  done
+                  git branch -q brancha HEAD~4
+                  """ % {'repo': self.repo})
+        self.git = scm.GitFetcher()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def count(self):
+        return len(os.popen('git --git-dir=%s/.git rev-list --all' % (
+            self.dest)).read().split())
+
+    def testDepth(self):
+        self.git.fetch(self.dest, self.uri, {'depth': '1'})
+        self.assertTrue(self.git.is_shallow(self.dest))
+        self.assertEquals(self.count(), 2)
+        self.git.switch_branch(self.dest, 'brancha')
+        self.assertFalse(os.path.exists(os.path.join(self.dest, 'src',
+                                                     'file2')))
+
+    def testDeepen(self):
+        """A pinned revision out of the shallow history is fetched."""
+        self.git.fetch(self.dest, self.uri,
+                       {'depth': '1', 'revision': 'HEAD~3'})
+        self.assertTrue(self.git.has_commit(self.dest, 'HEAD'))
+        self.assertFalse(os.path.exists(os.path.join(self.dest, 'src',
+                                                     'file3')))
+        self.assertTrue(os.path.exists(os.path.join(self.dest, 'src',
+                                                    'file2')))
+
+    def testSparse(self):
+        self.git.fetch(self.dest, self.uri,
+                       {'sparse': ['src'], 'filter': 'blob:none'})
+        self.assertEquals(sorted(os.listdir(self.dest)), ['.git', 'src'])
+        self.assertEquals(len(os.listdir(os.path.join(self.dest, 'src'))),
+                          5)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(testShallowGit))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
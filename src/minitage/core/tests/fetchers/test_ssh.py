@@ -0,0 +1,156 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+from minitage.core.fetchers import scm, ssh
+from minitage.core.tests.base import TestCase
+
+""" an ssh which runs the commands here, doing the handshake when the
+ControlPath socket is not there yet"""
+FAKE_SSH = """#!%(python)s
+import os, sys, subprocess
+args, options = sys.argv[1:], {}
+log = open('%(log)s', 'a')
+while args and args[0].startswith('-'):
+    flag = args.pop(0)
+    value = args.pop(0)
+    if flag == '-o':
+        key, value = value.split('=', 1)
+    options[flag == '-o' and key or flag] = value
+host, command = args[0], ' '.join(args[1:])
+user = os.environ.get('USER', 'root')
+if '@' in host:
+    user, host = host.split('@', 1)
+socket = options['ControlPath'].replace(
+    '%%r', user).replace('%%h', host).replace('%%p', '22')
+if '-O' in options:
+    log.write('%%s %%s\\n' %% (options['-O'], host))
+    sys.exit(0)
+if not os.path.exists(socket):
+    log.write('handshake %%s\\n' %% host)
+    open(socket, 'w').close()
+log.close()
+sys.exit(subprocess.call(command, shell=True))
+"""
+
+
+class testSSH(TestCase):
+    """Shared ssh connections tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.repo = os.path.join(self.path, 'repo')
+        self.uri = 'ssh://localhost%s' % self.repo
+        self.log = os.path.join(self.path, 'ssh.log')
+        self.fake = os.path.join(self.path, 'fake-ssh')
+        open(self.fake, 'w').write(FAKE_SSH % {'python': sys.executable,
+                                               'log': self.log})
+        os.chmod(self.fake, 0700)
+        os.system("""
+                  export GIT_AUTHOR_NAME=minitage GIT_AUTHOR_EMAIL=m@m
+                  export GIT_COMMITTER_NAME=minitage GIT_COMMITTER_EMAIL=m@m
+                  mkdir -p %s
+                  cd %s
+                  echo '666'>file
+                  git init -q
+                  git add .
+                  git commit -q -m 'initial import'
+                  """ % (self.repo, self.repo))
+        ssh._multiplexers.clear()
+        self.config = {'minimerge': {'ssh': self.fake, 'mirrors': 'none',
+                                     'ssh_multiplexing': 'true'}}
+        self.environ = os.environ.copy()
+        for var in 'GIT_SSH_COMMAND', 'GIT_SSH':
+            os.environ.pop(var, None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.path)
+
+    def testGetMultiplexer(self):
+        mux = ssh.get_multiplexer(self.config)
+        self.assertTrue(mux is ssh.get_multiplexer(self.config))
+        self.assertEquals(mux.ssh, self.fake)
+        self.assertEquals(ssh.get_multiplexer(
+            {'minimerge': {'ssh_multiplexing': 'false'}}), None)
+        self.assertEquals(ssh.get_multiplexer({'minimerge': {}}), None)
+        self.assertEquals(mux.path, None)
+        self.assertEquals(mux.get_stats(), (0, []))
+
+    def testSharedConnection(self):
+        """One handshake by host for all the commands."""
+        git = scm.GitFetcher(self.config)
+        dest = os.path.join(self.path, 'wc')
+        git.fetch(dest, self.uri)
+        self.assertTrue(os.path.isfile(os.path.join(dest, 'file')))
+        git.get_remote_head(self.uri)
+        git.update(dest, self.uri)
+        connections, masters = git.ssh.get_stats()
+        self.assertTrue(connections > 1)
+        self.assertEquals(len(masters), 1)
+        self.assertTrue(masters[0].endswith('@localhost:22'))
+        self.assertEquals(open(self.log).read().count('handshake'), 1)
+        path = git.ssh.path
+        git.ssh.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue('exit localhost' in open(self.log).read())
+
+    def testUserSSH(self):
+        """A GIT_SSH_COMMAND of the user is kept."""
+        os.environ['GIT_SSH_COMMAND'] = self.fake
+        git = scm.GitFetcher(self.config)
+        self.assertEquals(git.ssh_command('git fetch'), 'git fetch')
+        del os.environ['GIT_SSH_COMMAND']
+        git.get_env = lambda: {'GIT_SSH': self.fake}
+        self.assertEquals(git.ssh_command('git fetch'), 'git fetch')
+        hg = scm.HgFetcher(self.config)
+        self.assertTrue(hg.ssh_command('hg pull').startswith(
+            'hg --config ui.ssh=%s pull' % git.ssh.get_wrapper()))
+        git.ssh.close()
+
+    def testLocalCommands(self):
+        """Commands which stay local do not make the wrapper."""
+        self.assertTrue(ssh.is_local('git rev-parse HEAD'))
+        self.assertTrue(ssh.is_local('git --git-dir=/a cat-file -e x'))
+        self.assertTrue(ssh.is_local('hg -R /a log -r x --template x'))
+        self.assertFalse(ssh.is_local('git fetch -q'))
+        self.assertFalse(ssh.is_local('hg --config ui.ssh=ssh pull'))
+        git = scm.GitFetcher(self.config)
+        dest = os.path.join(self.path, 'wc')
+        os.system('git clone -q %s %s' % (self.repo, dest))
+        head = os.popen('git --git-dir=%s/.git rev-parse HEAD' % dest).read()
+        self.assertTrue(git.has_revision(dest, head.strip()))
+        self.assertEquals(git.ssh.path, None)
+
+    def testForkedWorkers(self):
+        """Workers forked after the wrapper is made share it, and do not
+        close it."""
+        mux = ssh.get_multiplexer(self.config)
+        wrapper = mux.get_wrapper()
+        pid = os.fork()
+        if not pid:
+            code = 1
+            try:
+                git = scm.GitFetcher(self.config)
+                if git.ssh.get_wrapper() == wrapper:
+                    git.ssh.close()
+                    code = 0
+            finally:
+                os._exit(code)
+        self.assertEquals(os.waitpid(pid, 0)[1], 0)
+        self.assertTrue(os.path.exists(wrapper))
+        mux.close()
+        self.assertFalse(os.path.exists(wrapper))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(testSSH))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -55,9 +55,9 @@ class testStatic(base.TestCase):
         """testProxysConfig."""
         opts = self.opts
         static = staticm.StaticFetcher({'minimerge': {'http_proxy': 'a a a'}})
-        self.assertEquals(os.environ['http_proxy'], 'a a a')
-        if 'http_proxy' in os.environ:
-            del os.environ['http_proxy']
+        self.assertEquals(static.get_env()['http_proxy'], 'a a a')
+        # the environment of the process is left alone
+        self.assertFalse('http_proxy' in os.environ)
 
 def test_suite():
     suite = unittest.TestSuite()
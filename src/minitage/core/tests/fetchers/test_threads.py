@@ -0,0 +1,86 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+
+from minitage.core.fetchers import scm, mirrors
+from minitage.core.tests.base import TestCase
+
+""" repositories fetched at the same time"""
+REPOSITORIES = 8
+
+
+class testThreads(TestCase):
+    """Fetchers running on threads."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.path, 'prefix')
+        for i in range(REPOSITORIES):
+            repo = os.path.join(self.path, 'repo%s' % i)
+            os.system("""
+                      export GIT_AUTHOR_NAME=minitage GIT_AUTHOR_EMAIL=m@m
+                      export GIT_COMMITTER_NAME=minitage GIT_COMMITTER_EMAIL=m@m
+                      mkdir -p %s
+                      cd %s
+                      echo '%s'>file
+                      git init -q
+                      git add .
+                      git commit -q -m 'initial import'
+                      git checkout -q -b branch%s
+                      echo '%s'>branch
+                      git add .
+                      git commit -q -m branch
+                      git checkout -q master
+                      """ % (repo, repo, i, i, i))
+        mirrors._mirrors.clear()
+        self.config = {'minimerge': {'prefix': self.prefix,
+                                     'http_proxy': 'http://proxy:3128'}}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def work(self, i, errors):
+        """Check out, update, switch branch and go back to a revision."""
+        try:
+            git = scm.GitFetcher(self.config)
+            git.paths = [os.path.join(self.path, 'bin%s' % i)]
+            uri = 'file://%s' % os.path.join(self.path, 'repo%s' % i)
+            dest = os.path.join(self.path, 'wc%s' % i)
+            git.fetch(dest, uri)
+            self.assertEquals(open(os.path.join(dest, 'file')).read(),
+                              '%s\n' % i)
+            git.update(dest, uri, {'branch': 'branch%s' % i})
+            self.assertEquals(git.get_branch(dest), 'branch%s' % i)
+            self.assertEquals(open(os.path.join(dest, 'branch')).read(),
+                              '%s\n' % i)
+            git.update(dest, uri, {'revision': 'HEAD~'})
+            self.assertFalse(os.path.exists(os.path.join(dest, 'branch')))
+            self.assertEquals(git.get_uri(dest), uri)
+        except Exception, e:
+            errors.append((i, e))
+
+    def testConcurrentFetchers(self):
+        cwd, environ = os.getcwd(), os.environ.copy()
+        errors = []
+        threads = [threading.Thread(target=self.work, args=(i, errors))
+                   for i in range(REPOSITORIES)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(errors, [])
+        # nothing global was changed
+        self.assertEquals(os.getcwd(), cwd)
+        self.assertEquals(os.environ, environ)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(testThreads))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
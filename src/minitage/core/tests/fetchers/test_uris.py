@@ -0,0 +1,108 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from minitage.core.fetchers import scm, uris
+from minitage.core.tests.base import TestCase
+
+GIT_CONFIG = """[core]
+\trepositoryformatversion = 0
+\tbare = false
+[remote "upstream"]
+\turl = http://other/repo.git
+[remote "origin"]
+\turl = "http://host/re\\"po.git" ; a comment
+\tfetch = +refs/heads/*:refs/remotes/origin/*
+[branch "master"]
+\tremote = origin
+"""
+HGRC = """# hgrc
+[ui]
+username = minitage
+[paths]
+default:pushurl = ssh://host/repo
+default = http://host/repo
+default-push = ssh://host/repo
+"""
+BRANCH_CONF = """parent_location = file:///tmp/parent/
+bound_location = bzr+ssh://host/trunk/
+bound = True
+"""
+
+
+class testUris(TestCase):
+    """Working copies urls tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        uris._uris.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, content, *path):
+        path = os.path.join(self.path, *path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').write(content)
+        return path
+
+    def testGit(self):
+        path = self.write(GIT_CONFIG, 'config')
+        self.assertEquals(uris.parse_git_config(path),
+                          'http://host/re"po.git')
+        path = self.write('[remote.origin]\nurl=/x\n[core]\n', 'config')
+        self.assertEquals(uris.parse_git_config(path), '/x')
+        path = self.write('[core]\n[include]\npath=/x\n', 'config')
+        self.assertEquals(uris.parse_git_config(path), None)
+        self.write('[core]\n', 'config')
+        self.assertEquals(uris.parse_git_config(path), '')
+
+    def testGitFetcher(self):
+        """The url parsed is the one git gives."""
+        repo = os.path.join(self.path, 'repo')
+        dest = os.path.join(self.path, 'wc')
+        os.system('git init -q %s;git clone -q file://%s %s 2>/dev/null;'
+                  'cd %s;git remote set-url origin "file://%s"' % (
+                      repo, repo, dest, dest, repo))
+        self.assertEquals(scm.GitFetcher().get_uri(dest), 'file://%s' % repo)
+        self.assertEquals(
+            uris.parse_git_config(os.path.join(dest, '.git', 'config')),
+            os.popen('cd %s;git config --get remote.origin.url' % (
+                dest)).read().strip())
+
+    def testHg(self):
+        path = self.write(HGRC, '.hg', 'hgrc')
+        self.assertEquals(uris.parse_hgrc(path), 'http://host/repo')
+        self.assertEquals(scm.HgFetcher().get_uri(self.path),
+                          'http://host/repo')
+        self.write('%include /etc/hgrc\n', '.hg', 'hgrc')
+        self.assertEquals(uris.parse_hgrc(path), None)
+
+    def testBzr(self):
+        path = self.write(BRANCH_CONF, '.bzr', 'branch', 'branch.conf')
+        self.assertEquals(scm.BzrFetcher().get_uri(self.path),
+                          'bzr+ssh://host/trunk')
+        self.write(BRANCH_CONF.replace('True', 'False'),
+                   '.bzr', 'branch', 'branch.conf')
+        self.assertEquals(uris.parse_bzr_branch_conf(path), '/tmp/parent')
+
+    def testCache(self):
+        path = self.write('[paths]\ndefault = /a\n', '.hg', 'hgrc')
+        self.assertEquals(uris.read_uri(path, uris.parse_hgrc), '/a')
+        self.assertEquals(uris.read_uri(path, None), '/a')
+        self.write('[paths]\ndefault = /ab\n', '.hg', 'hgrc')
+        self.assertEquals(uris.read_uri(path, uris.parse_hgrc), '/ab')
+        self.assertEquals(uris.read_uri('/nonexisting', uris.parse_hgrc),
+                          None)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(testUris))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,144 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import logging
+import tempfile
+
+from minitage.core import core, journal, tools
+from minitage.core.makers import interfaces as makers
+from minitage.core.tests.base import TestCase
+
+MINIBUILD = """[minibuild]
+src_uri=http://example.com/foo.tgz
+src_type=static
+install_method=fake
+install-method-bypass=true
+category=dependencies
+"""
+
+""" directories installed by the FakeMaker"""
+installed = []
+""" packages the FakeMaker is interrupted on"""
+interrupted = []
+
+
+class FakeMaker(makers.IMaker):
+    """Maker which just remembers what it installs."""
+
+    def __init__(self, config=None):
+        makers.IMaker.__init__(self)
+        self.config = config
+
+    def match(self, switch):
+        return switch == 'fake'
+
+    def get_options(self, minimerge, minibuild, **kwargs):
+        return {}
+
+    def install(self, directory, opts=None):
+        if os.path.basename(directory) in interrupted:
+            raise KeyboardInterrupt()
+        installed.append(os.path.basename(directory))
+        # the package provides a tool
+        bin = os.path.join(directory, tools.BIN)
+        os.makedirs(bin)
+        open(os.path.join(bin, os.path.basename(directory)), 'w').close()
+
+
+class TestActions(TestCase):
+    """Minimerge actions tests."""
+
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        minilay = os.path.join(self.prefix, 'minilays', 'test')
+        os.makedirs(minilay)
+        os.makedirs(os.path.join(self.prefix, 'etc'))
+        for name in ('zlib-1.2', 'openssl-1'):
+            open(os.path.join(minilay, name), 'w').write(MINIBUILD)
+        config = os.path.join(self.prefix, 'etc', 'minimerge.cfg')
+        open(config, 'w').write(
+            '[minimerge]\nprefix=%s\ndefault_minilays=\n'
+            '[minitage.makers]\n'
+            'fake=minitage.core.tests.test_actions:FakeMaker\n' % (
+                self.prefix))
+        self.merge = core.Minimerge({
+            'config': config, 'nolog': False, 'skip_self_upgrade': True,
+            'packages': [], 'action': 'install'})
+        del installed[:]
+        del interrupted[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.prefix)
+
+    def testJournaledPackages(self):
+        """Each package is built with its own step and journal."""
+        packages = [self.merge._find_minibuild(name)
+                    for name in ('zlib-1.2', 'openssl-1')]
+        build_plan = self.merge.make_plan(packages)
+        self.merge._journal = journal.RunJournal.create(
+            os.path.join(self.prefix, 'runs'), build_plan)
+        self.merge._do_action(
+            'install', packages,
+            dict([(step.name, step) for step in build_plan]))
+        self.assertEquals(installed, ['zlib-1.2', 'openssl-1'])
+        loaded = journal.RunJournal.load(self.merge._journal.path)
+        for package in packages:
+            self.assertTrue('record' in loaded.package(package.name))
+            self.assertTrue(self.merge.is_installed(package))
+
+    def testInterrupted(self):
+        """An interrupted run says how to resume it."""
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        self.merge.logger.addHandler(handler)
+        interrupted.append('openssl-1')
+        self.merge._offline = True
+        build_plan = self.merge.make_plan(
+            [self.merge._find_minibuild(name)
+             for name in ('zlib-1.2', 'openssl-1')])
+        try:
+            self.assertRaises(KeyboardInterrupt, self.merge.execute,
+                              build_plan)
+        finally:
+            self.merge.logger.removeHandler(handler)
+        self.assertEquals(installed, ['zlib-1.2'])
+        self.assertTrue([m for m in messages
+                         if 'was interrupted' in m and '--resume' in m])
+
+    def testStatusReads(self):
+        """With the state database, the status of all the packages is one
+        query."""
+        cache = self.merge.status_cache
+        cache.start()
+        for name in ('zlib-1.2', 'openssl-1', 'zlib-1.2'):
+            package = self.merge._find_minibuild(name)
+            self.assertFalse(self.merge.is_installed(package))
+            self.assertEquals(self.merge.get_installed_revision(package),
+                              None)
+        self.assertEquals(cache.reads, 1)
+        cache.stop()
+
+    def testParallelTools(self):
+        """The tools the workers install are looked up again."""
+        self.merge._jobs = 2
+        deps = os.path.join(self.prefix, 'dependencies')
+        self.assertEquals(tools.providers(deps, 'zlib-1.2'), [])
+        packages = [self.merge._find_minibuild(name)
+                    for name in ('zlib-1.2', 'openssl-1')]
+        build_plan = self.merge.make_plan(packages)
+        self.merge._merge_parallel(
+            packages, fetch=False,
+            steps=dict([(step.name, step) for step in build_plan]))
+        self.assertEquals(tools.providers(deps, 'zlib-1.2'), [
+            os.path.join(deps, 'zlib-1.2', tools.BIN)])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestActions))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
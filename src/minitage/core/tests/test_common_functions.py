@@ -104,6 +104,23 @@ class TestCommon(base.TestCase):
             open(ret).read(),
             'foo'
         )
+
+    def testDownload(self):
+        """testDownload."""
+        data = 'a' * (common.CHUNK_SIZE * 2 + 1)
+        open(self.tf, 'w').write(data)
+        dest = '%s/b' % self.path
+        self.assertEquals(common.download('file://%s' % self.tf, dest),
+                          common.md5sum(self.tf))
+        self.assertEquals(open(dest).read(), data)
+        # a bad download leaves the previous file
+        open(self.tf, 'w').write('new')
+        self.assertRaises(common.MinimergeMD5Mismatch,
+                          common.download, 'file://%s' % self.tf, dest,
+                          'false')
+        self.assertEquals(open(dest).read(), data)
+        self.assertEquals(os.listdir(self.path).count('b'), 1)
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestCommon))
@@ -0,0 +1,131 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+from StringIO import StringIO
+
+from minitage.core import common
+from minitage.core.tests.base import TestCase
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve server.files, honouring Range requests when the If-Range
+    validator is the ETag of the file. server.cut bytes are sent before
+    the connection is closed."""
+
+    def do_GET(self):
+        server = self.server
+        data = server.files.get(self.path)
+        server.requests.append((self.path, self.headers.getheader('range')))
+        if data is None:
+            self.send_error(404)
+            return
+        etag = '"%s%s"' % (len(data), server.etags.get(self.path, ''))
+        first = 0
+        rng = self.headers.getheader('range')
+        if (server.ranges and rng
+            and self.headers.getheader('if-range') == etag):
+            first = int(rng.split('=')[1].split('-')[0])
+        if first >= len(data) and first:
+            self.send_error(416)
+            return
+        if first:
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (
+                first, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data) - first))
+        self.end_headers()
+        body = data[first:]
+        if server.cut is not None:
+            body, server.cut = body[:server.cut], None
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownload(TestCase):
+    """Streamed and resumed downloads tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.files = {}
+        self.server.etags = {}
+        self.server.requests = []
+        self.server.ranges = True
+        self.server.cut = None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.data = os.urandom(common.CHUNK_SIZE * 2 + 100)
+        self.server.files['/f.tgz'] = self.data
+        self.uri = 'http://127.0.0.1:%s/f.tgz' % self.server.server_port
+        self.dest = os.path.join(self.path, 'f.tgz')
+        self.md5 = common.md5sum(StringIO(self.data))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+    def interrupt(self, size=1000):
+        self.server.cut = size
+        self.assertRaises(common.MinimergeDownloadError,
+                          common.download, self.uri, self.dest)
+        self.assertEquals(os.path.getsize('%s.part' % self.dest), size)
+        self.assertFalse(os.path.exists(self.dest))
+
+    def testResume(self):
+        self.interrupt()
+        md5 = common.download(self.uri, self.dest)
+        self.assertEquals(open(self.dest, 'rb').read(), self.data)
+        self.assertEquals(md5, common.md5sum(self.dest))
+        self.assertEquals(self.server.requests[-1],
+                          ('/f.tgz', 'bytes=1000-'))
+        self.assertEquals(os.listdir(self.path), ['f.tgz'])
+
+    def testChanged(self):
+        """The file changed on the server, it is downloaded again."""
+        self.interrupt()
+        self.server.etags['/f.tgz'] = 'new'
+        common.download(self.uri, self.dest)
+        self.assertEquals(open(self.dest, 'rb').read(), self.data)
+
+    def testNoRanges(self):
+        self.server.ranges = False
+        self.interrupt()
+        common.download(self.uri, self.dest)
+        self.assertEquals(open(self.dest, 'rb').read(), self.data)
+
+    def testMd5(self):
+        """A resumed download which does not match its md5 is dropped."""
+        self.interrupt()
+        open('%s.part' % self.dest, 'r+b').write('garbage')
+        self.assertRaises(common.MinimergeMD5Mismatch,
+                          common.download, self.uri, self.dest, self.md5)
+        self.assertEquals(os.listdir(self.path), [])
+        common.download(self.uri, self.dest, self.md5)
+        self.assertEquals(open(self.dest, 'rb').read(), self.data)
+
+    def testNoResume(self):
+        self.server.cut = 1000
+        self.assertRaises(common.MinimergeDownloadError,
+                          common.download, self.uri, self.dest,
+                          resume=False)
+        self.assertEquals(os.listdir(self.path), [])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestDownload))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -1,15 +1,27 @@
 __docformat__ = 'restructuredtext en'
 import unittest
 from minitage.core.tests.fetchers import (
+    test_heads,
     test_interfaces,
+    test_mirrors,
     test_scm,
-    test_static,)
+    test_shallow,
+    test_ssh,
+    test_static,
+    test_threads,
+    test_uris,)
 
 def test_suite():
     suite = unittest.TestSuite()
-    for m in (test_interfaces,
+    for m in (test_heads,
+              test_interfaces,
+              test_mirrors,
               test_scm,
+              test_shallow,
+              test_ssh,
               test_static,
+              test_threads,
+              test_uris,
              ):
         suite.addTest(m.test_suite())
     return suite
@@ -0,0 +1,158 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+
+from minitage.core import graph
+from minitage.core.tests.base import TestCase
+from minitage.core.tests import bench_depgraph
+
+
+class Node(object):
+    """Minibuild stand-in."""
+
+    def __init__(self, name, dependencies):
+        self.name = name
+        self.dependencies = dependencies
+
+
+def resolver(tree):
+    """Return a resolve function over {name: [dependencies]}."""
+    nodes = dict([(name, Node(name, deps)) for name, deps in tree.items()])
+    def resolve(name):
+        return nodes[name]
+    return resolve
+
+# same tree as in test_minimerge
+TREE = {
+    'minibuild-0': [],
+    'minibuild-1': ['minibuild-0'],
+    'minibuild-2': ['minibuild-4', 'minibuild-1'],
+    'minibuild-3': ['minibuild-2'],
+    'minibuild-4': ['minibuild-0'],
+    'minibuild-5': ['minibuild-7'],
+    'minibuild-6': ['minibuild-5'],
+    'minibuild-7': ['minibuild-6'],
+    'minibuild-8': ['minibuild-8'],
+    'minibuild-9': ['minibuild-0', 'minibuild-3'],
+    'minibuild-10': ['minibuild-11'],
+    'minibuild-11': ['minibuild-12'],
+    'minibuild-12': ['minibuild-13'],
+    'minibuild-13': ['minibuild-10'],
+}
+
+
+class TestGraph(TestCase):
+    """Dependency graph tests."""
+
+    def sort(self, names, order='compat', tree=TREE):
+        g = graph.DependencyGraph(resolver(tree))
+        return [n.name for n in g.sort(names, order)]
+
+    def testCompatOrder(self):
+        """Historical minimerge order is kept."""
+        self.assertEquals(self.sort(['minibuild-3']),
+                          ['minibuild-0', 'minibuild-4', 'minibuild-1',
+                           'minibuild-2', 'minibuild-3'])
+        self.assertEquals(self.sort(['minibuild-9']),
+                          ['minibuild-0', 'minibuild-4', 'minibuild-1',
+                           'minibuild-2', 'minibuild-3', 'minibuild-9'])
+        self.assertEquals(self.sort(['minibuild-1', 'minibuild-4']),
+                          ['minibuild-0', 'minibuild-1', 'minibuild-4'])
+
+    def testKahnOrder(self):
+        """Every node comes after its dependencies."""
+        tree = {'a': ['c'], 'b': [], 'c': [], 'd': ['a', 'b']}
+        self.assertEquals(self.sort(['d'], 'kahn', tree),
+                          ['b', 'c', 'a', 'd'])
+        result = self.sort(['minibuild-9'], 'kahn')
+        for name in result:
+            for dep in TREE[name]:
+                self.assertTrue(result.index(dep) < result.index(name))
+
+    def testInvalidOrder(self):
+        self.assertRaises(graph.InvalidOrderError,
+                          self.sort, ['minibuild-0'], 'foo')
+
+    def testCycles(self):
+        """The exact cycle is reported."""
+        for names, path in (
+            (['minibuild-8'], ['minibuild-8', 'minibuild-8']),
+            (['minibuild-6'], ['minibuild-6', 'minibuild-5',
+                               'minibuild-7', 'minibuild-6']),
+            (['minibuild-13'], ['minibuild-13', 'minibuild-10',
+                                'minibuild-11', 'minibuild-12',
+                                'minibuild-13']),
+        ):
+            try:
+                self.sort(names)
+            except graph.CycleError, e:
+                self.assertEquals(e.path, path)
+                self.assertEquals(str(e), ' -> '.join(path))
+            else:
+                self.fail('No cycle detected for %s' % names)
+
+    def testCycleBehindSharedNode(self):
+        """A node reached twice is not a cycle."""
+        tree = {'a': ['b', 'c'], 'b': ['d'], 'c': ['d'], 'd': []}
+        self.assertEquals(self.sort(['a'], tree=tree), ['d', 'b', 'c', 'a'])
+        tree['d'] = ['c']
+        try:
+            self.sort(['a'], tree=tree)
+        except graph.CycleError, e:
+            self.assertEquals(e.path, ['d', 'c', 'd'])
+        else:
+            self.fail('No cycle detected')
+
+    def testDeepChain(self):
+        """Deep chains do not hit the recursion limit."""
+        size = 5000
+        tree = {'n0': []}
+        for i in range(1, size):
+            tree['n%s' % i] = ['n%s' % (i - 1)]
+        for order in graph.ORDERS:
+            result = self.sort(['n%s' % (size - 1)], order, tree)
+            self.assertEquals(result, ['n%s' % i for i in range(size)])
+
+    def testLegacyOrder(self):
+        """The compat order is the one of the former resolution, on
+        chains and on branching DAGs."""
+        for max_deps in (1, 2, 3):
+            for seed in range(3):
+                nodes = bench_depgraph.make_tree(150, max_deps, seed)
+                roots = bench_depgraph.leaves(nodes)
+                g = graph.DependencyGraph(nodes.__getitem__)
+                self.assertEquals(
+                    g.sort(roots),
+                    bench_depgraph.legacy(nodes.__getitem__, roots))
+
+    def testMissingDependency(self):
+        """A failed add leaves the graph usable."""
+        tree = dict(TREE)
+        tree['broken'] = ['minibuild-1', 'missing']
+        g = graph.DependencyGraph(resolver(tree))
+        self.assertRaises(KeyError, g.add, ['minibuild-4', 'broken'])
+        self.assertEquals(len(g), 0)
+        self.assertEquals([n.name for n in g.sort(['minibuild-2'])],
+                          ['minibuild-0', 'minibuild-4', 'minibuild-1',
+                           'minibuild-2'])
+        self.assertRaises(KeyError, g.add, ['broken'])
+        self.assertEquals(len(g), 4)
+        self.assertEquals([n.name for n in g.sort(['minibuild-3'])],
+                          ['minibuild-0', 'minibuild-4', 'minibuild-1',
+                           'minibuild-2', 'minibuild-3'])
+
+    def testReachable(self):
+        g = graph.DependencyGraph(resolver(TREE))
+        stop = set(['minibuild-0', 'minibuild-2'])
+        self.assertEquals(g.reachable('minibuild-9', stop),
+                          ['minibuild-2', 'minibuild-0'])
+        self.assertEquals(g.reachable('minibuild-4', stop),
+                          ['minibuild-0'])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestGraph))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
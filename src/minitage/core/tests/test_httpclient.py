@@ -0,0 +1,138 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import urllib2
+import BaseHTTPServer
+
+from minitage.core import common
+from minitage.core import httpclient
+from minitage.core.tests.base import TestCase
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Keep-alive server of server.files, server.redirects and, as a
+    proxy, of absolute urls. server.ports records the client port of each
+    request."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.ports.append(self.client_address[1])
+        server.requests.append(self.path)
+        path = self.path
+        if '://' in path:
+            path = '/%s' % path.split('://', 1)[1].split('/', 1)[1]
+        if path in server.redirects:
+            self.send_response(302)
+            self.send_header('Location', server.redirects[path])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = server.files.get(path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '9')
+            self.end_headers()
+            self.wfile.write('not found')
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(BaseHTTPServer.HTTPServer):
+
+    def handle_error(self, request, client_address):
+        """Clients going away are expected."""
+
+
+class TestHTTPPool(TestCase):
+    """Keep-alive connections pool tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.files = {'/a': 'a' * 100,
+                             '/b': os.urandom(common.CHUNK_SIZE * 2)}
+        self.server.redirects = {'/c': '/a'}
+        self.server.ports = []
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.pool = httpclient.HTTPPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+    def testReuse(self):
+        self.assertEquals(self.pool.open('%s/a' % self.url).read(),
+                          'a' * 100)
+        dest = os.path.join(self.path, 'b')
+        common.download('%s/b' % self.url, dest, pool=self.pool)
+        self.assertEquals(open(dest, 'rb').read(), self.server.files['/b'])
+        self.assertEquals(self.pool.open('%s/c' % self.url).read(),
+                          'a' * 100)
+        self.assertEquals((self.pool.opened, self.pool.reused), (1, 3))
+        self.assertEquals(len(set(self.server.ports)), 1)
+
+    def testNotRead(self):
+        """A response which is not read until its end closes its
+        connection."""
+        response = self.pool.open('%s/b' % self.url)
+        response.read(10)
+        response.close()
+        self.pool.open('%s/a' % self.url).read()
+        self.assertEquals((self.pool.opened, self.pool.reused), (2, 0))
+
+    def testServerClosed(self):
+        """Idle connections closed by the server are opened again."""
+        self.pool.open('%s/a' % self.url).read()
+        for connections in self.pool.idle.values():
+            for connection in connections:
+                connection.sock.close()
+        self.assertEquals(self.pool.open('%s/a' % self.url).read(),
+                          'a' * 100)
+
+    def testHTTPError(self):
+        try:
+            self.pool.open('%s/nothere' % self.url)
+        except urllib2.HTTPError, e:
+            self.assertEquals(e.code, 404)
+            self.assertEquals(e.read(), 'not found')
+        else:
+            self.fail('No HTTPError')
+        self.pool.open('%s/a' % self.url).read()
+        self.assertEquals((self.pool.opened, self.pool.reused), (1, 1))
+
+    def testProxy(self):
+        """Proxies come from the configuration, not os.environ."""
+        environ = os.environ.copy()
+        pool = httpclient.get_pool({'http_proxy': self.url})
+        self.assertTrue(pool is httpclient.get_pool({'http_proxy': self.url}))
+        self.assertEquals(os.environ, environ)
+        self.assertEquals(
+            pool.open('http://distfiles.minitage.org/a').read(), 'a' * 100)
+        self.assertEquals(self.server.requests,
+                          ['http://distfiles.minitage.org/a'])
+        pool.close()
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestHTTPPool))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,123 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import time
+import shutil
+import tempfile
+
+from minitage.core import index, common
+from minitage.core.tests.base import TestCase
+
+
+class TestIndex(TestCase):
+    """Minilays index tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.minilays = []
+        for minilay in ('ml1', 'ml2'):
+            self.minilays.append(os.path.join(self.path, minilay))
+            os.mkdir(self.minilays[-1])
+        self.index_path = os.path.join(self.path, index.INDEX)
+        self.stamp = int(time.time())
+        for name in ('python-2.6', 'python-2.7', 'libxml2-2.7', '.hidden'):
+            self.touch(self.minilays[0], name)
+        self.touch(self.minilays[1], 'libxml2-2.7')
+        self.touch(self.minilays[1], 'zlib-1.2')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def touch(self, minilay, name):
+        open(os.path.join(minilay, name), 'w').write('[minibuild]\n')
+        # let the minilay mtime change
+        self.stamp += 1
+        os.utime(minilay, (self.stamp, self.stamp))
+
+    def testFind(self):
+        idx = index.MinilayIndex(self.index_path, self.minilays)
+        self.assertTrue(os.path.exists(self.index_path))
+        entry = idx.find('libxml2-2.7')
+        self.assertEquals(entry.path,
+                          os.path.join(self.minilays[0], 'libxml2-2.7'))
+        self.assertEquals(entry.size, len('[minibuild]\n'))
+        self.assertEquals(idx.find('zlib-1.2').minilay, self.minilays[1])
+        for name in ('.hidden', 'python', 'zzz', 'a'):
+            self.assertEquals(idx.find(name), None)
+        # precedence is the order of the minilays
+        idx = index.MinilayIndex(self.index_path, self.minilays[::-1])
+        self.assertEquals(idx.find('libxml2-2.7').minilay, self.minilays[1])
+
+    def testWarm(self):
+        """An up to date index is reused as is."""
+        idx = index.MinilayIndex(self.index_path, self.minilays)
+        self.assertEquals(idx.rebuilt, 1)
+        self.assertFalse(idx.refresh())
+        idx = index.MinilayIndex(self.index_path, self.minilays)
+        self.assertEquals(idx.rebuilt, 0)
+        self.assertEquals(idx.find('python-2.6').name, 'python-2.6')
+
+    def testIncremental(self):
+        """Only changed minilays are listed again."""
+        idx = index.MinilayIndex(self.index_path, self.minilays)
+        self.touch(self.minilays[1], 'openssl-1')
+        # remove a file behind the back of an unchanged minilay: it is
+        # still indexed as the minilay was not listed again.
+        mtime = os.stat(self.minilays[0]).st_mtime
+        os.remove(os.path.join(self.minilays[0], 'python-2.6'))
+        os.utime(self.minilays[0], (mtime, mtime))
+        self.assertTrue(idx.refresh())
+        self.assertNotEquals(idx.find('openssl-1'), None)
+        self.assertNotEquals(idx.find('python-2.6'), None)
+
+    def testNotWritable(self):
+        """The index is kept in memory if it cannot be written."""
+        idx = index.MinilayIndex(
+            os.path.join(self.path, 'nonexisting', index.INDEX),
+            self.minilays)
+        self.assertEquals(idx.find('zlib-1.2').name, 'zlib-1.2')
+
+    def testSearchLatest(self):
+        self.assertEquals(
+            common.search_latest('python-2\..*', self.path), 'python-2.7')
+        index.MinilayIndex(self.index_path, self.minilays)
+        self.assertEquals(
+            common.search_latest('python-2\..*', self.path), 'python-2.7')
+        self.assertEquals(
+            common.search_latest('zlib.*', self.path), 'zlib-1.2')
+        self.assertRaises(common.MinibuildNotFoundException,
+                          common.search_latest, 'foo', self.path)
+
+    def testSearchOrder(self):
+        """The latest minibuild of the first minilay walked wins, as
+        without index."""
+        walked = [m for m in os.listdir(self.path)
+                  if os.path.isdir(os.path.join(self.path, m))]
+        self.touch(os.path.join(self.path, walked[0]), 'foo-1')
+        self.touch(os.path.join(self.path, walked[1]), 'foo-2')
+        self.assertEquals(common.search_latest('foo-.*', self.path), 'foo-1')
+        for minilays in (self.minilays, self.minilays[::-1]):
+            index.MinilayIndex(self.index_path, minilays)
+            self.assertEquals(
+                common.search_latest('foo-.*', self.path), 'foo-1')
+
+    def testSearchReadOnly(self):
+        """Searches do not write the index of Minimerge, the minilays
+        it does not know are listed."""
+        index.MinilayIndex(self.index_path, self.minilays[:1])
+        content = open(self.index_path).read()
+        self.assertEquals(
+            common.search_latest('zlib.*', self.path), 'zlib-1.2')
+        self.touch(self.minilays[0], 'openssl-1')
+        self.assertEquals(
+            common.search_latest('openssl.*', self.path), 'openssl-1')
+        self.assertEquals(open(self.index_path).read(), content)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestIndex))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -6,12 +6,21 @@ import shutil
 import optparse
 import ConfigParser
 
+import pkg_resources
+
 from minitage.core import interfaces
 
 class test(object):
         """."""
 
 
+class Factory(interfaces.IFactory):
+    """A factory of the minitage.interface products."""
+
+    def __init__(self, config=None):
+        interfaces.IFactory.__init__(self, 'interface', config)
+
+
 from minitage.core.testing import LAYER
 from minitage.core.tests import base
 
@@ -46,6 +55,47 @@ item1=minitage.core.tests.test_interfaces:test
                           i.register, 'foo', 'foo.Bar')
         self.assertRaises(NotImplementedError, i.__call__, 'foo')
 
+    def testLazyFactory(self):
+        """Classes are imported when asked for, the switch picks them."""
+        open(self.path, 'w').write("""
+[minitage.interface]
+item1=minitage.core.tests.test_interfaces:test
+item2=minitage.core.tests.notamodule:test
+""")
+        i = interfaces.get_factory(Factory, self.path)
+        self.assertTrue(i is interfaces.get_factory(Factory, self.path))
+        self.assertEquals(i.keys(), ['item1', 'item2'])
+        self.assertEquals(i.get_product('item1'), test)
+        self.assertEquals(i.get_product('item3'), None)
+        self.assertRaises(interfaces.InvalidComponentClassPathError,
+                          i.get_product, 'item2')
+        self.assertRaises(interfaces.InvalidComponentClassPathError,
+                          i.registerDict, {'item3': 'nocolon'})
+
+    def testEntryPoints(self):
+        """Plugins of other distributions are registered."""
+        egg = os.path.join(os.path.dirname(self.path),
+                           'plugin-1.0.egg-info')
+        if not os.path.isdir(egg):
+            os.makedirs(egg)
+        open(os.path.join(egg, 'PKG-INFO'), 'w').write(
+            'Metadata-Version: 1.0\nName: plugin\nVersion: 1.0\n')
+        open(os.path.join(egg, 'entry_points.txt'), 'w').write(
+            '[minitage.plugins]\n'
+            'item4 = minitage.core.tests.test_interfaces:test\n')
+        for dist in pkg_resources.find_distributions(
+            os.path.dirname(self.path), True):
+            pkg_resources.working_set.add(dist)
+        interfaces._entry_points.clear()
+        open(self.path, 'w').write('[minitage.plugins]\n')
+        try:
+            i = interfaces.IFactory('plugins', self.path)
+            self.assertEquals(i.keys(), ['item4'])
+            self.assertEquals(i.get_product('item4'), test)
+        finally:
+            interfaces._entry_points.clear()
+            shutil.rmtree(egg)
+
     def testProduct(self):
         """testProduct"""
         p = interfaces.IProduct()
@@ -0,0 +1,108 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from minitage.core.journal import RunJournal, JournalError
+from minitage.core.plan import BuildPlan, BuildStep
+from minitage.core.tests.base import TestCase
+
+
+class TestRunJournal(TestCase):
+    """Run journal tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.runs = os.path.join(self.path, 'runs')
+        self.plan = BuildPlan('install', [
+            BuildStep(name=name, category='dependencies', action='install',
+                      install=True)
+            for name in ('zlib-1.2', 'meta-x', 'openssl-1')])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testResume(self):
+        journal = RunJournal.create(self.runs, self.plan, {'offline': True})
+        for step in ('fetch', 'bootstrap', 'buildout', 'record', 'env'):
+            journal.done('zlib-1.2', step)
+        journal.complete('zlib-1.2')
+        journal.complete('meta-x')
+        journal.done('openssl-1', 'fetch')
+        journal.package('openssl-1').done('bootstrap')
+        journal.fail('openssl-1', 'buildout failed')
+        loaded = RunJournal.last(self.runs)
+        self.assertEquals(loaded.path, journal.path)
+        self.assertEquals(loaded.get_plan(), self.plan)
+        self.assertEquals(loaded.get_modes(), {'offline': True})
+        self.assertEquals(loaded.completed, ['zlib-1.2', 'meta-x'])
+        self.assertEquals(loaded.failures,
+                          [('openssl-1', 'buildout failed')])
+        self.assertEquals(loaded.resume_point(), ('openssl-1', 'buildout'))
+        steps = loaded.package('openssl-1')
+        self.assertTrue('bootstrap' in steps)
+        self.assertFalse('buildout' in steps)
+        self.assertRaises(JournalError, loaded.done, 'openssl-1', 'foo')
+        loaded.complete('openssl-1')
+        self.assertEquals(loaded.resume_point(), None)
+        loaded.finish()
+        self.assertEquals(RunJournal.last(self.runs), None)
+
+    def testTruncated(self):
+        """A record interrupted while written is ignored."""
+        journal = RunJournal.create(self.runs, self.plan)
+        journal.done('zlib-1.2', 'fetch')
+        open(journal.path, 'a').write('{"package": "zlib-1.2", "st')
+        loaded = RunJournal.load(journal.path)
+        self.assertEquals(loaded.resume_point(), ('zlib-1.2', 'bootstrap'))
+        open(journal.path, 'w').write('')
+        self.assertRaises(JournalError, RunJournal.load, journal.path)
+        self.assertEquals(RunJournal.last(self.runs), None)
+
+    def testFork(self):
+        """Forked workers append to the same journal."""
+        journal = RunJournal.create(self.runs, self.plan)
+        pids = []
+        for name in ('zlib-1.2', 'openssl-1'):
+            pid = os.fork()
+            if not pid:
+                ret = 1
+                try:
+                    journal.done(name, 'fetch')
+                    journal.complete(name)
+                    ret = 0
+                finally:
+                    os._exit(ret)
+            pids.append(pid)
+        for pid in pids:
+            self.assertEquals(os.waitpid(pid, 0)[1], 0)
+        loaded = RunJournal.load(journal.path)
+        self.assertEquals(sorted(loaded.completed),
+                          ['openssl-1', 'zlib-1.2'])
+        self.assertEquals(loaded.resume_point(), ('meta-x', 'fetch'))
+        # the parent reads what its workers did
+        self.assertEquals(journal.completed, [])
+        journal.reload()
+        self.assertEquals(sorted(journal.completed),
+                          ['openssl-1', 'zlib-1.2'])
+        journal.complete('meta-x')
+        self.assertEquals(RunJournal.load(journal.path).resume_point(),
+                          None)
+
+    def testPrune(self):
+        for i in range(4):
+            open(os.path.join(self.path, '%s.journal' % i), 'w').close()
+            os.utime(os.path.join(self.path, '%s.journal' % i), (i, i))
+        RunJournal.prune(self.path, 2)
+        self.assertEquals(sorted(os.listdir(self.path)),
+                          ['2.journal', '3.journal'])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestRunJournal))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,102 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+import ConfigParser
+
+from minitage.core import metadata, objects
+from minitage.core.tests.base import TestCase
+
+MINIBUILD = """[minibuild]
+dependencies=libxml2-2.7
+dependencies-%s=zlib-1.2
+src_uri=http://foo/${version}.tgz
+src_type=static
+install_method=buildout
+category=dependencies
+revision=3
+%s
+"""
+
+
+class TestMetadataCache(TestCase):
+    """Minibuilds metadata cache tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.path, '.minitage', 'cache')
+        self.minibuild = os.path.join(self.path, 'libxslt-1.1')
+        self.write()
+        self.config = self.make_config('1.1')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, extra=''):
+        open(self.minibuild, 'w').write(MINIBUILD % (objects.UNAME, extra))
+
+    def make_config(self, version):
+        config = ConfigParser.ConfigParser()
+        config.add_section('minimerge')
+        config.set('minimerge', 'prefix', self.path)
+        config.add_section('minitage.variables')
+        config.set('minitage.variables', 'version', version)
+        return config
+
+    def load(self, config=None):
+        """Load the minibuild through a fresh cache, as a new run does."""
+        if config is None:
+            config = self.config
+        cache = metadata.MetadataCache(self.cache_path, config)
+        mb = objects.Minibuild(path=self.minibuild, minitage_config=config,
+                               metadata_cache=cache)
+        # lazy loading
+        mb.dependencies
+        cache.save()
+        return mb, cache
+
+    def testWarm(self):
+        mb, cache = self.load()
+        self.assertEquals((cache.hits, cache.misses), (0, 1))
+        self.assertTrue(os.path.exists(self.cache_path))
+        cached, cache = self.load()
+        self.assertEquals((cache.hits, cache.misses), (1, 0))
+        for field in metadata.FIELDS:
+            self.assertEquals(getattr(cached, field), getattr(mb, field))
+        self.assertEquals(cached.src_uri, 'http://foo/1.1.tgz')
+        self.assertEquals(cached.dependencies, ['zlib-1.2', 'libxml2-2.7'])
+        self.assertEquals(cached.revision, 3)
+        self.assertEquals(
+            cached.minibuild_config._sections['minibuild']['category'],
+            'dependencies')
+        # the cached lists are not shared
+        cached.dependencies.append('foo')
+        self.assertEquals(self.load()[0].dependencies,
+                          ['zlib-1.2', 'libxml2-2.7'])
+
+    def testInvalidation(self):
+        self.load()
+        # the minibuild changed
+        self.write('url=http://foo')
+        mb, cache = self.load()
+        self.assertEquals((cache.hits, cache.misses), (0, 1))
+        self.assertEquals(mb.url, 'http://foo')
+        # the variables changed
+        mb, cache = self.load(self.make_config('1.2'))
+        self.assertEquals((cache.hits, cache.misses), (0, 1))
+        self.assertEquals(mb.src_uri, 'http://foo/1.2.tgz')
+
+    def testInvalidMinibuildNotCached(self):
+        self.write('src_type=foo')
+        self.assertRaises(objects.InvalidFetchMethodError, self.load)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestMetadataCache))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
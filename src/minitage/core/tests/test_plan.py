@@ -0,0 +1,61 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+
+from minitage.core.plan import BuildPlan, BuildStep, PlanError
+from minitage.core.tests.base import TestCase
+
+
+class TestBuildPlan(TestCase):
+    """Build plan tests."""
+
+    def setUp(self):
+        self.plan = BuildPlan('install', [
+            BuildStep(name='zlib-1.2', path='/minilays/dependencies/zlib-1.2',
+                      category='dependencies', action='install',
+                      fetch=True, updatecode=True, install=True,
+                      revision=2),
+            BuildStep(name='lxml-2.2', path='/minilays/eggs/lxml-2.2',
+                      category='eggs', action='install', upgrade=True,
+                      python_versions=['2.4', '2.6'],
+                      install_python_versions=['2.6'],
+                      revision=3, installed_revision=1),
+        ])
+
+    def testReadOnly(self):
+        step = self.plan[0]
+        self.assertRaises(AttributeError, setattr, step, 'install', False)
+        self.assertRaises(AttributeError, delattr, step, 'fetch')
+        self.assertRaises(AttributeError, setattr, self.plan, 'steps', ())
+        self.assertEquals(step.python_versions, None)
+        self.assertEquals(step.install_python_versions, ())
+
+    def testUnknownField(self):
+        self.assertRaises(PlanError, BuildStep, name='zlib-1.2', foo=1)
+
+    def testPyvers(self):
+        self.assertEquals(self.plan.names(), ['zlib-1.2', 'lxml-2.2'])
+        self.assertEquals(self.plan.pyvers(), {'lxml-2.2': ['2.4', '2.6']})
+
+    def testJson(self):
+        loaded = BuildPlan.from_json(self.plan.to_json())
+        self.assertEquals(loaded, self.plan)
+        self.assertEquals(loaded[1].python_versions, ('2.4', '2.6'))
+        self.assertNotEquals(loaded, BuildPlan('delete', self.plan.steps))
+
+    def testFormat(self):
+        self.assertEquals([step.flags() for step in self.plan],
+                          ['fFI  ', '  U '])
+        text = self.plan.format().getvalue()
+        self.assertTrue(text.startswith('Action:\tinstall\n'))
+        self.assertTrue('\t\tfFI   * zlib-1.2  \n' in text)
+        self.assertTrue('* lxml-2.2 [1 => 3] (2.6)\n' in text)
+        self.assertTrue('U : upgrade the package' in text)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestBuildPlan))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
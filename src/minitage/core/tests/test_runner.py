@@ -0,0 +1,118 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+
+from minitage.core import runner
+from minitage.core.tests.base import TestCase
+
+
+class Lines(logging.Handler):
+    """Handler keeping the messages."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+
+class testRunner(TestCase):
+    """Commands runner tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.logger = logging.getLogger('minitage.tests.runner')
+        self.logger.setLevel(logging.DEBUG)
+        self.lines = Lines()
+        self.logger.addHandler(self.lines)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.lines)
+        shutil.rmtree(self.path)
+
+    def testBigOutput(self):
+        """More than a pipe buffer on both outputs does not block."""
+        result = runner.run(
+            [sys.executable, '-c', 'import sys;'
+             'sys.stderr.write("e" * 200000);'
+             'sys.stdout.write("o\\n" * 200000)'], capture=True)
+        self.assertEquals(result.returncode, 0)
+        self.assertEquals(len(result.stdout), 400000)
+        self.assertEquals(len(result.stderr), 200000)
+        self.assertTrue(result.rusage.ru_utime >= 0)
+
+    def testLines(self):
+        result = runner.run(['sh', '-c', 'echo a; echo b >&2; printf c'],
+                            logger=self.logger)
+        self.assertEquals(sorted(self.lines.lines), ['a', 'b', 'c'])
+        self.assertEquals(sorted(result.tail), ['a', 'b', 'c'])
+        self.assertEquals(result.stdout, '')
+
+    def testTail(self):
+        try:
+            runner.run('seq 1000; exit 3', logger=self.logger, tail=5)
+            self.fail('no error')
+        except runner.CommandError, e:
+            self.assertEquals(e.result.returncode, 3)
+            self.assertEquals(e.result.tail, ['996', '997', '998', '999',
+                                              '1000'])
+            self.assertTrue('exited with 3' in str(e))
+            self.assertTrue(str(e).endswith('999\n1000'))
+        self.assertEquals(len(self.lines.lines), 1000)
+
+    def testTimeout(self):
+        start = time.time()
+        try:
+            runner.run('sleep 10; sleep 10', timeout=0.5)
+            self.fail('no error')
+        except runner.CommandError, e:
+            self.assertTrue(e.result.timed_out)
+            self.assertTrue('timed out' in str(e))
+        self.assertTrue(time.time() - start < 5)
+
+    def testDaemon(self):
+        """A child keeping the pipes open does not keep us waiting."""
+        start = time.time()
+        result = runner.run('(sleep 10 &); echo done', capture=True)
+        self.assertEquals(result.stdout, 'done\n')
+        self.assertTrue(time.time() - start < 5)
+
+    def testOutputAfterExit(self):
+        """What is left in the pipes of a reaped command is read."""
+        select = runner.select.select
+
+        def nothing(r, w, x, wait):
+            # as if the command exited before we looked at its output
+            time.sleep(wait)
+            return [], [], []
+        runner.select.select = nothing
+        try:
+            result = runner.run('(sleep 10 &); seq 3; echo e >&2',
+                                capture=True)
+        finally:
+            runner.select.select = select
+        self.assertEquals(result.stdout, '1\n2\n3\n')
+        self.assertEquals(result.stderr, 'e\n')
+        self.assertEquals(sorted(result.tail), ['1', '2', '3', 'e'])
+
+    def testLogFile(self):
+        log = os.path.join(self.path, 'package.log')
+        runner.run('echo a', logger=self.logger, log_file=log)
+        runner.run('echo b', logger=self.logger)
+        runner.run(['echo', 'c'], logger=self.logger, log_file=log)
+        self.assertEquals(open(log).read(), '$ echo a\na\n$ echo c\nc\n')
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(testRunner))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,208 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import time
+import shutil
+import tempfile
+
+from minitage.core import scheduler
+from minitage.core.tests.base import TestCase
+
+
+class TasksTestCase(TestCase):
+    """Tasks writing what they do in a log."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.log = os.path.join(self.path, 'log')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def task(self, key, duration=0, fail=False):
+        """Return a task writing its start and end in the log."""
+        def func():
+            self.write('start %s' % key)
+            time.sleep(duration)
+            if fail:
+                raise Exception('%s failed' % key)
+            self.write('end %s' % key)
+        return func
+
+    def write(self, line):
+        fd = os.open(self.log, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        os.write(fd, '%s\n' % line)
+        os.close(fd)
+
+    def events(self):
+        if not os.path.exists(self.log):
+            return []
+        return open(self.log).read().splitlines()
+
+
+class TestScheduler(TasksTestCase):
+    """Scheduler tests."""
+
+    def testDependenciesFirst(self):
+        """A task starts only when its dependencies are done."""
+        s = scheduler.Scheduler(jobs=3)
+        s.add('openssl-1', self.task('openssl-1', 0.3))
+        s.add('libxml2-2.7', self.task('libxml2-2.7', 0.3))
+        s.add('python-2.7', self.task('python-2.7'),
+              ['openssl-1', 'libxml2-2.7'])
+        done = s.run()
+        self.assertEquals(done[-1], 'python-2.7')
+        events = self.events()
+        start = events.index('start python-2.7')
+        self.assertTrue(events.index('end openssl-1') < start)
+        self.assertTrue(events.index('end libxml2-2.7') < start)
+        # independent tasks did run at the same time
+        self.assertEquals(
+            sorted(events[:2]), ['start libxml2-2.7', 'start openssl-1'])
+
+    def testSerial(self):
+        """With one job, ready tasks run in order."""
+        s = scheduler.Scheduler(jobs=1)
+        for key in ['a', 'b', 'c']:
+            s.add(key, self.task(key))
+        self.assertEquals(s.run(), ['a', 'b', 'c'])
+        self.assertEquals(self.events(), ['start a', 'end a',
+                                          'start b', 'end b',
+                                          'start c', 'end c'])
+
+    def testNoop(self):
+        """Tasks without callable just wait for their dependencies."""
+        s = scheduler.Scheduler(jobs=2)
+        s.add('a', self.task('a'))
+        s.add('meta-a', None, ['a'])
+        s.add('b', self.task('b'), ['meta-a'])
+        self.assertEquals(s.run(), ['a', 'meta-a', 'b'])
+
+    def testFailure(self):
+        """Dependents of a failed task are not run."""
+        s = scheduler.Scheduler(jobs=2)
+        s.add('a', self.task('a', fail=True))
+        s.add('b', self.task('b'), ['a'])
+        self.assertRaises(scheduler.TaskFailedError, s.run)
+        self.assertEquals(self.events(), ['start a'])
+
+    def testDoneOnFailure(self):
+        """The tasks run are known even if one failed."""
+        s = scheduler.Scheduler(jobs=1)
+        s.add('a', self.task('a'))
+        s.add('meta-a', None, ['a'])
+        s.add('b', self.task('b', fail=True), ['meta-a'])
+        s.add('c', self.task('c'), ['b'])
+        self.assertRaises(scheduler.TaskFailedError, s.run)
+        self.assertEquals(s.done, ['a', 'meta-a'])
+
+    def testKeepGoing(self):
+        """All the tasks are run, the failures are reported together."""
+        s = scheduler.Scheduler(jobs=1, keep_going=True)
+        s.add('a', self.task('a', fail=True))
+        s.add('b', self.task('b'))
+        s.add('c', self.task('c', fail=True))
+        s.add('d', self.task('d'), ['c'])
+        try:
+            s.run()
+        except scheduler.TaskFailedError, e:
+            self.assertTrue('failed: a, c' in '%s' % e)
+            self.assertTrue('not run: d' in '%s' % e)
+        else:
+            self.fail('No TaskFailedError')
+        self.assertEquals(self.events(), ['start a', 'start b', 'end b',
+                                          'start c'])
+
+    def testLimits(self):
+        """Tasks using a limited resource wait for it."""
+        s = scheduler.Scheduler(jobs=3, limits={'host': 1})
+        s.add('a', self.task('a', 0.3), resources=['host'])
+        s.add('b', self.task('b', 0.3), resources=['host'])
+        s.add('c', self.task('c', 0.1), resources=['other'])
+        s.run()
+        events = self.events()
+        self.assertEquals(sorted(events[:2]), ['start a', 'start c'])
+        self.assertTrue(events.index('end a') < events.index('start b'))
+
+    def testBuffered(self):
+        """The output of a task is written at once when it is over."""
+        output = os.path.join(self.path, 'output')
+        fd = os.open(output, os.O_WRONLY | os.O_CREAT)
+        saved = os.dup(1)
+        os.dup2(fd, 1)
+        os.close(fd)
+        try:
+            s = scheduler.Scheduler(jobs=2, buffered=True)
+            for key, duration in (('a', 0.3), ('b', 0.1)):
+                def func(key=key, duration=duration):
+                    os.system('echo %s1' % key)
+                    time.sleep(duration)
+                    os.system('echo %s2' % key)
+                s.add(key, func)
+            s.run()
+        finally:
+            os.dup2(saved, 1)
+            os.close(saved)
+        self.assertEquals(open(output).read().split(),
+                          ['b1', 'b2', 'a1', 'a2'])
+        self.assertEquals(s.outputs, {})
+
+    def testDeadlock(self):
+        """Tasks waiting for each other are detected."""
+        s = scheduler.Scheduler(jobs=2)
+        s.add('a', self.task('a'), ['b'])
+        s.add('b', self.task('b'), ['a'])
+        self.assertRaises(scheduler.DeadlockError, s.run)
+
+
+class TestPrefetcher(TasksTestCase):
+    """Prefetcher tests."""
+
+    def testAhead(self):
+        """The worker stays ahead tasks ahead of the joined ones."""
+        tasks = [(key, self.task(key)) for key in 'abcd']
+        p = scheduler.Prefetcher(tasks, ahead=2)
+        p.start()
+        try:
+            time.sleep(0.3)
+            self.assertEquals(self.events(), ['start a', 'end a',
+                                              'start b', 'end b'])
+            self.assertTrue(p.join('a'))
+            time.sleep(0.3)
+            self.assertEquals(self.events()[-1], 'end c')
+            self.assertEquals(p.join('e'), None)
+            self.assertTrue(p.join('b'))
+            self.assertTrue(p.join('c'))
+            self.assertTrue(p.join('d'))
+        finally:
+            p.stop()
+        self.assertFalse(os.path.exists(p.directory))
+
+    def testFailure(self):
+        p = scheduler.Prefetcher([('a', self.task('a', fail=True)),
+                                  ('b', self.task('b'))])
+        p.start()
+        try:
+            self.assertFalse(p.join('a'))
+            self.assertTrue(p.join('b'))
+        finally:
+            p.stop()
+
+    def testStop(self):
+        """Stopping waits for the running task, the others are not run."""
+        p = scheduler.Prefetcher([('a', self.task('a', 0.3)),
+                                  ('b', self.task('b'))], ahead=2)
+        p.start()
+        time.sleep(0.1)
+        p.stop()
+        self.assertEquals(self.events(), ['start a', 'end a'])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestScheduler))
+    suite.addTest(unittest.makeSuite(TestPrefetcher))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
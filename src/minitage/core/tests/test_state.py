@@ -0,0 +1,123 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from minitage.core import state
+from minitage.core.tests.base import TestCase
+
+
+class TestStateDB(TestCase):
+    """Installed packages state database tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = state.StateDB(
+            os.path.join(self.path, '.minitage', 'state.db'))
+        self.ipath = os.path.join(self.path, 'dependencies', 'zlib-1.2')
+        self.history = os.path.join(self.ipath, '.minitage')
+        os.makedirs(self.history)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.path)
+
+    def testMarkers(self):
+        self.assertEquals(self.db.get_markers(self.ipath, self.history), {})
+        self.db.set_marker(self.ipath, self.history, 'install', 'install')
+        self.db.set_marker(self.ipath, self.history, 'install-2.6')
+        self.assertEquals(self.db.get_markers(self.ipath, self.history),
+                          {'install': 'install', 'install-2.6': ''})
+        self.db.record(self.ipath, self.history, 3, '[minibuild]\n')
+        self.assertEquals(self.db.get_revision(self.ipath, self.history), 3)
+        self.assertEquals(self.db.get_minibuild(self.ipath, self.history),
+                          '[minibuild]\n')
+        status = self.db.status()
+        self.assertEquals(status.keys(), [self.ipath])
+        self.assertEquals(status[self.ipath]['revision'], 3)
+        self.assertEquals(status[self.ipath]['markers'],
+                          {'install': 'install', 'install-2.6': ''})
+        self.assertEquals(
+            self.db.get_markers(self.ipath, self.history, status),
+            {'install': 'install', 'install-2.6': ''})
+        self.assertEquals(
+            self.db.get_revision(self.ipath, self.history, status), 3)
+        self.db.forget(self.ipath)
+        self.assertEquals(self.db.status(), {})
+
+    def testMigration(self):
+        """Marker files of older minitage versions are read until they
+        are imported."""
+        os.mkdir(os.path.join(self.history, 'markers'))
+        open(os.path.join(self.history, 'markers', 'fetch'), 'w').write(
+            'fetch')
+        self.assertFalse(self.db.imported())
+        self.assertEquals(self.db.get_markers(self.ipath, self.history),
+                          {'fetch': 'fetch'})
+        self.assertEquals(self.db.get_revision(self.ipath, self.history),
+                          None)
+        self.db.import_files({self.ipath: self.history})
+        self.assertTrue(self.db.imported())
+        self.assertEquals(self.db.status()[self.ipath]['markers'],
+                          {'fetch': 'fetch'})
+
+    def testReadOnly(self):
+        """Reading the state writes nothing."""
+        os.mkdir(os.path.join(self.history, 'markers'))
+        open(os.path.join(self.history, 'markers', 'fetch'), 'w').write(
+            'fetch')
+        self.assertEquals(self.db.get_markers(self.ipath, self.history),
+                          {'fetch': 'fetch'})
+        self.assertEquals(self.db.status(), {})
+        self.assertFalse(self.db.imported())
+        self.assertFalse(os.path.exists(self.db.path))
+
+    def testTrusted(self):
+        """Once imported, the marker files are not read anymore."""
+        self.db.import_files({})
+        markers = os.path.join(self.history, 'markers')
+        os.mkdir(markers)
+        open(os.path.join(markers, 'install'), 'w').write('install')
+        self.assertEquals(self.db.get_markers(self.ipath, self.history), {})
+        self.db.set_marker(self.ipath, self.history, 'fetch', 'fetch')
+        self.assertEquals(self.db.get_markers(self.ipath, self.history),
+                          {'fetch': 'fetch'})
+        # a new database is trusted once imported
+        db = state.StateDB(self.db.path)
+        self.assertTrue(db.imported())
+        db.close()
+
+    def testRemovedPackage(self):
+        """The state of a deleted package is forgotten."""
+        self.db.set_marker(self.ipath, self.history, 'install', 'install')
+        self.db.forget(self.ipath)
+        self.assertEquals(self.db.get_markers(
+            self.ipath, self.history, self.db.status()), {})
+        self.db.set_marker(self.ipath, self.history, 'fetch', 'fetch')
+        self.assertEquals(self.db.status()[self.ipath]['markers'],
+                          {'fetch': 'fetch'})
+
+    def testFork(self):
+        """Forked processes use their own connection."""
+        self.db.set_marker(self.ipath, self.history, 'install', 'install')
+        pid = os.fork()
+        if not pid:
+            ret = 1
+            try:
+                self.db.set_marker(self.ipath, self.history, 'fetch', 'fetch')
+                ret = 0
+            finally:
+                os._exit(ret)
+        self.assertEquals(os.waitpid(pid, 0)[1], 0)
+        self.assertEquals(self.db.get_markers(self.ipath, self.history),
+                          {'install': 'install', 'fetch': 'fetch'})
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestStateDB))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,94 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+
+from minitage.core.status import StatusCache, memoized
+from minitage.core.tests.base import TestCase
+
+
+class Package(object):
+
+    def __init__(self, name, revision=1):
+        self.name = name
+        self.path = '/minilays/%s' % name
+        self.revision = revision
+
+
+class FakeMinimerge(object):
+    """Minimerge stand-in with a marker store."""
+
+    def __init__(self):
+        self.status_cache = StatusCache()
+        self._action = 'install'
+        self._update = False
+        self._upgrade = True
+        self.pyvers = {}
+        self.markers = {}
+
+    @memoized
+    def get_markers(self, package):
+        self.status_cache.read()
+        return self.markers.get(package.name, [])[:]
+
+    @memoized
+    def is_installed(self, package):
+        return 'install' in self.get_markers(package)
+
+    @memoized
+    def is_to_be_installed(self, package):
+        return (self._action == 'install'
+                and not self.is_installed(package))
+
+    def set_mark(self, package, marker):
+        self.markers.setdefault(package.name, []).append(marker)
+        self.status_cache.invalidate(package.name)
+
+
+class TestStatusCache(TestCase):
+    """Status cache tests."""
+
+    def setUp(self):
+        self.fake = FakeMinimerge()
+        self.cache = self.fake.status_cache
+        self.package = Package('zlib-1.2')
+
+    def testInactive(self):
+        for i in range(3):
+            self.fake.is_to_be_installed(self.package)
+        self.assertEquals(self.cache.reads, 3)
+        self.assertEquals(self.cache.hits, 0)
+
+    def testMemoized(self):
+        self.cache.start()
+        for i in range(3):
+            self.assertTrue(self.fake.is_to_be_installed(self.package))
+            self.assertFalse(self.fake.is_installed(self.package))
+        self.assertEquals(self.cache.reads, 1)
+        self.assertEquals(self.cache.saved, 5)
+        # flags are part of the key
+        self.fake._action = 'delete'
+        self.assertFalse(self.fake.is_to_be_installed(self.package))
+        self.assertEquals(self.cache.reads, 1)
+        self.cache.stop()
+        self.assertEquals(self.cache.entries, {})
+
+    def testInvalidation(self):
+        self.cache.start()
+        other = Package('openssl-1')
+        self.assertFalse(self.fake.is_installed(self.package))
+        self.assertFalse(self.fake.is_installed(other))
+        self.fake.set_mark(self.package, 'install')
+        self.assertTrue(self.fake.is_installed(self.package))
+        self.assertFalse(self.fake.is_installed(other))
+        self.assertEquals(self.cache.reads, 3)
+        # a new revision of the package is another entry
+        self.assertTrue(self.fake.is_installed(Package('zlib-1.2', 2)))
+        self.assertEquals(self.cache.reads, 4)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestStatusCache))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
@@ -0,0 +1,91 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from minitage.core import common
+from minitage.core import store
+from minitage.core.fetchers import static
+from minitage.core.tests.base import TestCase
+
+
+class TestDownloadStore(TestCase):
+    """Download store tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = store.DownloadStore(os.path.join(self.path, 'store'))
+        self.archive = os.path.join(self.path, 'zlib-src')
+        open(self.archive, 'w').write('zlib')
+        self.md5 = common.md5sum(self.archive)
+        open('%s.md5' % self.archive, 'w').write(self.md5)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testAddLink(self):
+        self.assertFalse(self.store.link(self.md5, 'foo'))
+        stored = self.store.add(self.archive)
+        self.assertEquals(stored, self.store.get(self.md5))
+        self.assertEquals(os.stat(stored).st_nlink, 3)
+        sha = store.digests(self.archive)['sha256']
+        self.assertTrue(os.path.samefile(self.store.get(sha256=sha), stored))
+        dest = os.path.join(self.path, 'p2', '.download', 'zlib-src')
+        self.assertTrue(self.store.link(self.md5, dest))
+        self.assertTrue(os.path.samefile(dest, stored))
+        # a copy of a stored file is replaced by a link
+        copy = os.path.join(self.path, 'copy-src')
+        shutil.copy(self.archive, copy)
+        self.store.add(copy)
+        self.assertTrue(os.path.samefile(copy, stored))
+
+    def testPrune(self):
+        self.store.add(self.archive)
+        self.assertEquals(self.store.prune(), (0, 0))
+        os.remove(self.archive)
+        self.assertEquals(self.store.prune(3600), (0, 0))
+        self.assertEquals(self.store.prune(), (1, 4))
+        self.assertEquals(self.store.get(self.md5), None)
+
+    def testStaticFetcher(self):
+        """A second prefix does not download anything."""
+        fetcher = static.StaticFetcher(
+            {'minimerge': {'download_store': self.store.path},
+             'minitage.unpackers': {}})
+        uri = 'file://%s' % self.archive
+        fetcher.fetch(os.path.join(self.path, 'p1'), uri)
+        os.remove(self.archive)
+        dest = os.path.join(self.path, 'p2')
+        fetcher.fetch(dest, uri)
+        self.assertEquals(open(os.path.join(dest, 'zlib-src')).read(),
+                          'zlib')
+        self.assertTrue(os.path.samefile(
+            os.path.join(dest, '.download', 'zlib-src'),
+            self.store.get(self.md5)))
+
+    def testGetFromCache(self):
+        uri = 'file://%s#md5=%s' % (self.archive, self.md5)
+        cache = os.path.join(self.path, 'cache')
+        common.get_from_cache(uri, cache, store=self.store)
+        os.remove(self.archive)
+        cache2 = os.path.join(self.path, 'cache2')
+        fname = common.get_from_cache(uri, cache2, offline=True,
+                                      store=self.store)
+        self.assertTrue(os.path.samefile(fname, self.store.get(self.md5)))
+
+    def testGetStore(self):
+        self.assertEquals(store.get_store('none'), None)
+        self.assertTrue(store.get_store(self.path) is
+                        store.get_store(self.path))
+        self.assertEquals(store.get_store().path,
+                          os.path.expanduser(store.DEFAULT_STORE))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestDownloadStore))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
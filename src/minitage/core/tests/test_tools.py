@@ -0,0 +1,95 @@
+__docformat__ = 'restructuredtext en'
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from minitage.core import tools
+from minitage.core.tests.base import TestCase
+
+
+class testTools(TestCase):
+    """Tools lookups cache tests."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.deps = os.path.join(self.path, 'dependencies')
+        tools.forget()
+
+    def tearDown(self):
+        tools.forget()
+        shutil.rmtree(self.path)
+
+    def provide(self, dependency, program):
+        bin = os.path.join(self.deps, dependency, tools.BIN)
+        if not os.path.isdir(bin):
+            os.makedirs(bin)
+        open(os.path.join(bin, program), 'w').close()
+        return bin
+
+    def testWhich(self):
+        bin = self.provide('git-1.7', 'git')
+        self.assertEquals(tools.which('git', [bin]),
+                          os.path.join(bin, 'git'))
+        self.assertEquals(tools.which('hg', [bin]), None)
+        # cached: the tool is not looked for again
+        os.remove(os.path.join(bin, 'git'))
+        self.assertEquals(tools.which('git', bin),
+                          os.path.join(bin, 'git'))
+        self.assertTrue('git: %s' % os.path.join(bin, 'git')
+                        in tools.report())
+        self.assertTrue('hg: not found' in tools.report())
+
+    def testNotFoundLifetime(self):
+        """Tools not found are looked up again after a while."""
+        bin = os.path.join(self.deps, 'git-1.7', tools.BIN)
+        self.assertEquals(tools.which('git', [bin]), None)
+        self.provide('git-1.7', 'git')
+        self.assertEquals(tools.which('git', [bin]), None)
+        ttl = tools.NOT_FOUND_TTL
+        tools.NOT_FOUND_TTL = 0
+        try:
+            self.assertEquals(tools.which('git', [bin]),
+                              os.path.join(bin, 'git'))
+        finally:
+            tools.NOT_FOUND_TTL = ttl
+
+    def testProviders(self):
+        git = self.provide('git-1.7', 'git')
+        self.assertEquals(tools.providers(self.deps, 'git'), [git])
+        self.assertEquals(tools.providers(self.deps, 'hg'), [])
+        # listed once
+        hg = self.provide('mercurial-1.9', 'hg')
+        self.assertEquals(tools.providers(self.deps, 'hg'), [])
+        self.assertEquals(tools.providers(
+            os.path.join(self.path, 'nothere'), 'hg'), [])
+
+    def testForget(self):
+        git = self.provide('git-1.7', 'git')
+        self.assertEquals(tools.which('hg', [git]), None)
+        self.assertEquals(tools.which('git', [git]),
+                          os.path.join(git, 'git'))
+        self.assertEquals(tools.providers(self.deps, 'hg'), [])
+        hg = self.provide('mercurial-1.9', 'hg')
+        os.remove(os.path.join(git, 'git'))
+        open(os.path.join(git, 'hg'), 'w').close()
+        # mercurial is installed: its dependencies are listed again and
+        # the tools which were not found are looked up again
+        tools.forget(os.path.join(self.deps, 'mercurial-1.9'))
+        self.assertEquals(tools.providers(self.deps, 'hg'), [git, hg])
+        self.assertEquals(tools.which('hg', [git]),
+                          os.path.join(git, 'hg'))
+        self.assertEquals(tools.which('git', [git]),
+                          os.path.join(git, 'git'))
+        # git is reinstalled
+        tools.forget(os.path.join(self.deps, 'git-1.7'))
+        self.assertEquals(tools.which('git', [git]), None)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(testTools))
+    return suite
+
+# vim:set et sts=4 ts=4 tw=80:
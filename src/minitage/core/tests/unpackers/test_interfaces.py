@@ -2,6 +2,8 @@ __docformat__ = 'restructuredtext en'
 
 import unittest
 import os
+import shutil
+import tempfile
 from minitage.core import interfaces, unpackers
 from minitage.core.unpackers import tar as mtar
 
@@ -27,10 +29,83 @@ class testInterfaces(base.TestCase):
     def testFactory(self):
         """testFactory"""
         f = unpackers.interfaces.IUnpackerFactory()
-        os.system('touch toto;tar cvf tar toto')
-        tar = f('tar')
-        self.assertEquals(tar.__class__.__name__,
-                          unpackers.tar.TarUnpacker.__name__)
+        path = tempfile.mkdtemp()
+        try:
+            os.system('cd %s && touch toto && tar cf tar toto' % path)
+            tar = f(os.path.join(path, 'tar'))
+            self.assertEquals(tar.__class__.__name__,
+                              unpackers.tar.TarUnpacker.__name__)
+        finally:
+            shutil.rmtree(path)
+
+    def testSniff(self):
+        """The formats are read from the first bytes of the files."""
+        path = tempfile.mkdtemp()
+        try:
+            os.system("""
+                      cd %s
+                      echo aaaa > toto
+                      tar -cf toto.tar toto
+                      tar -czf toto.tgz toto
+                      tar -cjf toto.tbz2 toto
+                      gzip -c toto > toto.gz
+                      zip -q toto.zip toto
+                      cp toto.zip zipped
+                      """ % path)
+            open(os.path.join(path, 'empty'), 'wb').write(
+                'PK\x05\x06' + '\x00' * 18)
+            open(os.path.join(path, 'spanned'), 'wb').write(
+                'PK\x07\x08' + open(os.path.join(path, 'zipped'),
+                                      'rb').read())
+            sniff = unpackers.interfaces.sniff
+            j = lambda name: os.path.join(path, name)
+            self.assertEquals(sniff(j('toto.tar')), 'tar')
+            self.assertEquals(sniff(j('toto.tgz')), 'gzip')
+            self.assertEquals(sniff(j('toto.tbz2')), 'bzip2')
+            self.assertEquals(sniff(j('toto.zip')), 'zip')
+            self.assertEquals(sniff(j('zipped')), 'zip')
+            self.assertEquals(sniff(j('empty')), 'zip')
+            self.assertEquals(sniff(j('spanned')), 'zip')
+            # not archives
+            self.assertEquals(sniff(j('toto.gz')), None)
+            self.assertEquals(sniff(j('toto')), None)
+            self.assertEquals(sniff(path), None)
+            self.assertEquals(sniff(j('notthere')), None)
+            f = unpackers.interfaces.IUnpackerFactory()
+            self.assertEquals(f(j('toto.tgz')).__class__.__name__,
+                              'TarUnpacker')
+            self.assertEquals(f(j('toto.zip')).__class__.__name__,
+                              'ZipUnpacker')
+            self.assertEquals(f(j('toto.gz')), None)
+            self.assertEquals(f(j('zipped')).__class__.__name__,
+                              'ZipUnpacker')
+        finally:
+            shutil.rmtree(path)
+
+    def testSniffOnce(self):
+        """An archive is read once to get its format and unpack it."""
+        path = tempfile.mkdtemp()
+        interfaces = unpackers.interfaces
+        read = []
+        _sniff = interfaces._sniff
+        interfaces._sniff = lambda p: read.append(p) or _sniff(p)
+        try:
+            os.system('cd %s && echo aaaa > toto && tar -czf toto.tgz toto'
+                      % path)
+            archive = os.path.join(path, 'toto.tgz')
+            unpacker = interfaces.IUnpackerFactory()(archive)
+            self.assertTrue(unpacker.match(archive))
+            unpacker.unpack(archive, os.path.join(path, 'dest'))
+            self.assertTrue(os.path.exists(
+                os.path.join(path, 'dest', 'toto')))
+            self.assertEquals(read, [archive])
+            # a new archive there is read
+            os.system('cd %s && tar -cf toto.tgz toto' % path)
+            self.assertEquals(interfaces.sniff(archive), 'tar')
+            self.assertEquals(read, [archive, archive])
+        finally:
+            interfaces._sniff = _sniff
+            shutil.rmtree(path)
 
 
 def test_suite():
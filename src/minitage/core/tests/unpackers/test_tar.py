@@ -16,6 +16,7 @@ class testTar(base.TestCase):
     """testtar"""
 
     def setUp(self):
+        self.cwd = os.getcwd()
         opts.update(dict(
             path=os.path.expanduser('%(p)s/minitagerepo') % self.layer,
             dest=os.path.expanduser('%(p)s/minitagerepodest') % self.layer,
@@ -27,6 +28,11 @@ class testTar(base.TestCase):
                 shutil.rmtree(path)
             os.makedirs(path)
 
+    def tearDown(self):
+        os.chdir(self.cwd)
+        for k in opts:
+            if os.path.exists(opts[k]):
+                shutil.rmtree(opts[k])
 
     def testTarfile(self):
         """testTarfile."""
@@ -78,6 +84,23 @@ class testTar(base.TestCase):
         self.assertTrue(os.path.isfile('a/toto'))
         self.assertEquals(open('a/toto').read(),'aaaa\n')
 
+    def testTarxzfile(self):
+        """testTarxzfile: with the tar command."""
+        path = opts['path']
+        os.chdir(path)
+        os.system("""
+                  mkdir a;
+                  echo "aaaa"> a/toto;
+                  tar -cJf toto.txz a;
+                  tar --zstd -cf toto.tzst a;
+                  rm -rf a""")
+        f = interfaces.IUnpackerFactory()
+        for archive, format in (('toto.txz', 'xz'), ('toto.tzst', 'zstd')):
+            self.assertEquals(interfaces.sniff(archive), format)
+            tar = f('%s/%s' % (path, archive))
+            tar.unpack('%s/%s' % (path, archive), '%s/%s' % (path, format))
+            self.assertEquals(open('%s/a/toto' % format).read(), 'aaaa\n')
+
 
 def test_suite():
     suite = unittest.TestSuite()
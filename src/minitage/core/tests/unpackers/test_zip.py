@@ -14,12 +14,17 @@ class testZip(base.TestCase):
 
     def setUp(self):
         """."""
+        self.cwd = os.getcwd()
         self.path = self.layer['p'] + '/ziptest'
         path = self.path
         if os.path.exists(path):
             shutil.rmtree(path)
         os.makedirs(path)
 
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.path)
+
     def testZipfile(self):
         path = self.path
         """testZipfile."""
@@ -0,0 +1,112 @@
+__docformat__ = 'restructuredtext en'
+
+import os
+import sys
+import time
+import threading
+
+""" where the minitage built tools are, under a dependency"""
+BIN = os.path.join('parts', 'part', 'bin')
+""" seconds a tool which is not there is remembered: it may be installed
+by something else than a minimerge run, which forgets it (see forget)"""
+NOT_FOUND_TTL = 10
+""" (program, search path) -> (full path, None if it is not there,
+lookup time)"""
+_tools = {}
+""" dependencies directory -> {program: [bin directories providing it]}"""
+_providers = {}
+_stats = {'hits': 0, 'misses': 0}
+_lock = threading.Lock()
+
+
+def _lookup(program, path):
+    for entry in path.split(os.pathsep):
+        fp = os.path.abspath(os.path.join(entry, program))
+        if os.path.exists(fp):
+            return fp
+        if ((sys.platform.startswith('win')
+             or sys.platform.startswith('cyg'))
+            and os.path.exists(fp + '.exe')):
+            return fp + '.exe'
+    return None
+
+
+def which(program, path=None):
+    """Full path of program in path (a PATH string or a list of
+    directories, default to our PATH), or None.
+    Lookups are done once by process, see forget, the tools not found
+    are looked up again after NOT_FOUND_TTL seconds."""
+    if path is None:
+        path = os.environ.get('PATH', '')
+    if not isinstance(path, basestring):
+        path = os.pathsep.join(path)
+    key = (program, path)
+    _lock.acquire()
+    try:
+        if key in _tools:
+            fp, stamp = _tools[key]
+            if fp is not None or time.time() - stamp < NOT_FOUND_TTL:
+                _stats['hits'] += 1
+                return fp
+        _stats['misses'] += 1
+        fp = _lookup(program, path)
+        _tools[key] = (fp, time.time())
+        return fp
+    finally:
+        _lock.release()
+
+
+def providers(dependencies, program):
+    """bin directories of the dependencies (<dependencies>/*/parts/part/bin)
+    which provide program. The dependencies are listed once."""
+    _lock.acquire()
+    try:
+        if not dependencies in _providers:
+            found = {}
+            if os.path.isdir(dependencies):
+                for name in sorted(os.listdir(dependencies)):
+                    bin = os.path.join(dependencies, name, BIN)
+                    if os.path.isdir(bin):
+                        for tool in os.listdir(bin):
+                            found.setdefault(tool, []).append(bin)
+            _providers[dependencies] = found
+        return list(_providers[dependencies].get(program, []))
+    finally:
+        _lock.release()
+
+
+def forget(path=None):
+    """Forget what we know about the tools in path (a dependency which is
+    installed or removed): the dependencies it is in are listed again,
+    the tools found there and the ones not found are looked up again.
+    Everything is forgotten if path is None."""
+    _lock.acquire()
+    try:
+        if path is None:
+            _tools.clear()
+            _providers.clear()
+            return
+        path = os.path.abspath(path)
+        for dependencies in _providers.keys():
+            if path.startswith(os.path.abspath(dependencies) + os.sep):
+                del _providers[dependencies]
+        for key, (fp, stamp) in _tools.items():
+            if fp is None or fp.startswith(path + os.sep):
+                del _tools[key]
+    finally:
+        _lock.release()
+
+
+def report():
+    """The tools resolved during the run."""
+    tools = {}
+    for (program, path), (fp, stamp) in _tools.items():
+        tools.setdefault(program, set()).add(fp or 'not found')
+    lines = ['Tools: %s lookups, %s cached.' % (
+        _stats['hits'] + _stats['misses'], _stats['hits'])]
+    for program in sorted(tools):
+        lines.append('    %s: %s' % (
+            program, ', '.join(sorted(tools[program]))))
+    return '\n'.join(lines)
+
+# vim:set et sts=4 ts=4 tw=80:
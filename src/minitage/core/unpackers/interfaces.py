@@ -1,8 +1,32 @@
 __docformat__ = 'restructuredtext en'
 
-import subprocess
+import os
+import bz2
+import gzip
+import tarfile
 
 from minitage.core import interfaces
+from minitage.core import runner
+
+""" archive formats by their first bytes"""
+MAGIC = (
+    ('\x1f\x8b', 'gzip'),
+    ('BZh', 'bzip2'),
+    ('\xfd7zXZ\x00', 'xz'),
+    ('\x28\xb5\x2f\xfd', 'zstd'),
+    ('PK\x03\x04', 'zip'),
+    # empty zip
+    ('PK\x05\x06', 'zip'),
+    # spanned zip
+    ('PK\x07\x08', 'zip'),
+)
+""" the formats of the tar archives, plain or compressed"""
+TAR_FORMATS = ('tar', 'gzip', 'bzip2', 'xz', 'zstd')
+""" the unpacker of each format"""
+UNPACKERS = {'tar': 'tar', 'gzip': 'tar', 'bzip2': 'tar', 'xz': 'tar',
+             'zstd': 'tar', 'zip': 'zip'}
+""" (path, mtime, size) -> format of the archives already sniffed"""
+_sniffed = {}
 
 class IUnpackerError(Exception):
     """General Unpacker Error."""
@@ -16,6 +40,68 @@ class UnpackerRuntimeError(IUnpackerError):
     """Unknown runtime Error."""
 
 
+def _is_tar_header(block):
+    """Is block the first header of a tar archive."""
+    if len(block) < tarfile.BLOCKSIZE:
+        return False
+    if block[257:262] == 'ustar':
+        return True
+    # old archives: just see if the header checksum is right
+    try:
+        tarfile.TarInfo.frombuf(block[:tarfile.BLOCKSIZE])
+    except Exception:
+        return False
+    return True
+
+
+def sniff(path):
+    """Format of the archive path from its first bytes: tar, gzip,
+    bzip2, xz, zstd (tar archives, compressed or not) or zip.
+    Returns None for the other files: only the first block of the gzip
+    and bzip2 files is decompressed to see that they are tar archives.
+    An archive is read once as long as it does not change: the factory,
+    match and unpack all ask for its format."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), st.st_mtime, st.st_size)
+    if not key in _sniffed:
+        _sniffed[key] = _sniff(path)
+    return _sniffed[key]
+
+
+def _sniff(path):
+    try:
+        fic = open(path, 'rb')
+        try:
+            header = fic.read(tarfile.BLOCKSIZE)
+        finally:
+            fic.close()
+    except IOError:
+        return None
+    for magic, format in MAGIC:
+        if header.startswith(magic):
+            if format in ('gzip', 'bzip2'):
+                try:
+                    if format == 'gzip':
+                        fic = gzip.open(path)
+                    else:
+                        fic = bz2.BZ2File(path)
+                    try:
+                        header = fic.read(tarfile.BLOCKSIZE)
+                    finally:
+                        fic.close()
+                except Exception:
+                    return None
+                if not _is_tar_header(header):
+                    return None
+            return format
+    if _is_tar_header(header):
+        return 'tar'
+    return None
+
+
 class IUnpackerFactory(interfaces.IFactory):
     """Interface Factory."""
 
@@ -40,14 +126,15 @@ class IUnpackerFactory(interfaces.IFactory):
             - switch: archive absolute path
               Default ones:
 
-                -tar: tar|gz|bz2
+                -tar: tar|gz|bz2|xz|zstd
                 -zip: zip
+        The format is read from the first bytes of the archive (see sniff),
+        the other unpackers are only asked to match if it is unknown.
         """
-        for key in self.products:
-            klass = self.products[key]
-            instance = klass(config = self.section)
-            if instance.match(switch):
-                return instance
+        klass = self.get_product(UNPACKERS.get(sniff(switch)))
+        if klass is not None:
+            return klass(config = self.section)
+        return self.get_instance(switch, config = self.section)
 
 class IUnpacker(interfaces.IProduct):
     """Interface for unpacking a package to somewhere.
@@ -101,11 +188,10 @@ class IUnpacker(interfaces.IProduct):
 
     def _unpack_cmd(self, command):
         """Helper to run unpack commands."""
-        p = subprocess.Popen('%s %s 2>&1' % (self.executable, command),
-                             shell = True, stdout=subprocess.PIPE)
-        ret = p.wait()
-        if ret != 0:
-            message = '%s failed to achieve correctly.' % self.name
+        try:
+            runner.run('%s %s' % (self.executable, command))
+        except runner.CommandError, e:
+            message = '%s failed to achieve correctly.\n%s' % (self.name, e)
             raise UnpackerRuntimeError(message)
 
 # vim:set et sts=4 ts=4 tw=80:
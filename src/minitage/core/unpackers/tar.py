@@ -11,6 +11,7 @@ class TarUnpacker(interfaces.IUnpacker):
     def __init__(self, config = None):
         self.config = config
         interfaces.IUnpacker.__init__(self, 'tar',  config)
+        self.executable = 'tar'
 
     def unpack(self, filep, dest = './', opts=None):
         """Update a package.
@@ -21,6 +22,14 @@ class TarUnpacker(interfaces.IUnpacker):
             - dest : destination folder.
             - opts : arguments for the unpacker
         """
+        format = interfaces.sniff(filep)
+        if format in ('xz', 'zstd'):
+            # not known by tarfile, the tar command does them
+            if not os.path.isdir(dest):
+                os.makedirs(dest)
+            flags = {'xz': '-xJf', 'zstd': '--zstd -xf'}[format]
+            self._unpack_cmd('%s \'%s\' -C \'%s\'' % (flags, filep, dest))
+            return
         try:
             tar = tarfile.open(filep)
             if not os.path.isdir(dest):
@@ -35,7 +44,7 @@ class TarUnpacker(interfaces.IUnpacker):
 
     def match(self, switch):
         """Test if the switch match the module."""
-        if tarfile.is_tarfile(switch):
+        if interfaces.sniff(switch) in interfaces.TAR_FORMATS:
             return True
         return False
 
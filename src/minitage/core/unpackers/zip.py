@@ -57,7 +57,8 @@ class ZipUnpacker(interfaces.IUnpacker):
 
     def match(self, switch):
         """Test if the switch match the module."""
-        if zipfile.is_zipfile(switch) or switch.endswith('.zip'):
+        if (interfaces.sniff(switch) == 'zip'
+            or switch.endswith('.zip')):
             return True
         return False
 